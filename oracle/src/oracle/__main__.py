@@ -8,10 +8,13 @@ ORACLE_MAP = {
     "llama": "oracle.models.llama_oracle",
     "gpt": "oracle.models.gpt_oracle",
     "uva": "oracle.models.uva_oracle",
+    "ollama": "oracle.models.ollama_oracle",
 }
 
 TESTER = "oracle.test.graph_comparison"
 ANALYSER = "oracle.models.result_calculator"
+CORPUS_COMPILER = "oracle.test.corpus"
+CLIENT = "oracle.models.oracle_client"
 
 def call_module_main(module_path: str, argv: List[str] or None = None):
     module = importlib.import_module(module_path)
@@ -19,24 +22,48 @@ def call_module_main(module_path: str, argv: List[str] or None = None):
         return module.main(argv)
     raise SystemExit(f"Module {module_path} has no callable main(argv=None).")
 
+def serve_model(model_key: str):
+    from oracle.models.oracle_server import OracleServer
+    module_path = ORACLE_MAP[model_key]
+    module = importlib.import_module(module_path)
+    if not hasattr(module, "make_oracle"):
+        raise SystemExit(f"Module {module_path} has no callable make_oracle().")
+    OracleServer(module.make_oracle(), model_key).serve_forever()
+
 def main(argv: List[str] or None = None):
     parser = argparse.ArgumentParser(prog="oracle", description="Run oracle models or tester")
     sub = parser.add_subparsers(dest="command", required=True)
     sub.add_parser("test", help="Run the AIF graph comparison tool")
-    sub.add_parser("analyse", help="Run the AIF graph metadata analysis")
+    analyse_parser = sub.add_parser("analyse", help="Run the AIF graph metadata analysis")
+    analyse_parser.add_argument("rest", nargs=argparse.REMAINDER, help="Output directories to merge and extra args")
+    sub.add_parser("compile", help="Compile the benchmark directory into a binary corpus for the tester")
     model_parser = sub.add_parser("model", help="Run a model")
     model_parser.add_argument("-m", "--model", choices=list(ORACLE_MAP.keys()),required=True, help="Which model to run")
+    model_parser.add_argument("--server", default=None, help="Submit to a running oracle server at this URL instead of loading the model (default ORACLE_SERVER_URL)")
     model_parser.add_argument("rest", nargs=argparse.REMAINDER, help="Extra args for the model")
+    serve_parser = sub.add_parser("serve", help="Load a model once and serve oracle jobs over HTTP")
+    serve_parser.add_argument("-m", "--model", choices=list(ORACLE_MAP.keys()), required=True, help="Which model to serve")
 
     args = parser.parse_args(argv)
 
     if args.command == "analyse":
-        return call_module_main(ANALYSER)
+        return call_module_main(ANALYSER, args.rest or None)
 
     if args.command == "test":
         return call_module_main(TESTER)
 
+    if args.command == "compile":
+        return call_module_main(CORPUS_COMPILER)
+
+    if args.command == "serve":
+        return serve_model(args.model)
+
     if args.command == "model":
+        from oracle.models.oracle_config import SERVER_URL
+        server_url = args.server or SERVER_URL
+        if server_url:
+            module = importlib.import_module(CLIENT)
+            return module.main(args.rest or None, server_url=server_url, model=args.model)
         module_path = ORACLE_MAP[args.model]
         return call_module_main(module_path, args.rest or None)
     return None
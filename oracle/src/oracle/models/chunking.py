@@ -0,0 +1,246 @@
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Dict, Any, List, Tuple
+
+from oracle.models.rate_limiter import CHARS_PER_TOKEN
+from oracle.test.models import AIFGraph, AIFNode, AIFEdge, NODE_FIELDS, EDGE_FIELDS
+from shared.parser import extract_last_json
+
+# The discussion module writes every turn as "participant<N>: <answer>", answers can span several lines
+TURN_START = re.compile(r"^participant\s*\d+\s*:", re.IGNORECASE | re.MULTILINE)
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+def split_turns(text: str) -> List[str]:
+    starts = [match.start() for match in TURN_START.finditer(text)]
+    if not starts:
+        # Not a discussion transcript, paragraphs are the next best boundary
+        return [part.strip() for part in re.split(r"\n\s*\n", text) if part.strip()]
+    turns = [text[:starts[0]].strip()] if text[:starts[0]].strip() else []
+    turns += [text[start:end].strip() for start, end in zip(starts, starts[1:] + [len(text)])]
+    return turns
+
+"""
+    Splits the turns into windows of at most `max_tokens` tokens, each window repeats the last `overlap_turns` turns of
+    the previous one, so that arguments that answer the previous turn keep their context
+    A single turn longer than `max_tokens` becomes a window of its own, turns are never cut. Returns the (start, end)
+    indices of the turns of every window.
+"""
+def make_window_ranges(
+    turns: List[str],
+    max_tokens: int,
+    overlap_turns: int = 1,
+    count_tokens: Callable[[str], int] = estimate_tokens
+) -> List[Tuple[int, int]]:
+    lengths = [count_tokens(turn) for turn in turns]
+    ranges: List[Tuple[int, int]] = []
+    start = 0
+    while start < len(turns):
+        end = start + 1
+        size = lengths[start]
+        while end < len(turns) and size + lengths[end] <= max_tokens:
+            size += lengths[end]
+            end += 1
+        if size > max_tokens:
+            print(f"  A turn of {size} tokens does not fit into a window of {max_tokens} tokens, sending it on its own")
+        ranges.append((start, end))
+        if end >= len(turns):
+            break
+        # Always move forward, also when the overlap would cover the whole window
+        start = max(start + 1, end - overlap_turns)
+    return ranges
+
+def normalise(text: str) -> str:
+    return " ".join(text.strip().lower().split())
+
+"""
+    Finds the turn of every L-node of a window, as an index into all turns of the text
+    A locution matches the turns that equal it (with or without the speaker) and otherwise the turns that contain it.
+    Repeated locutions with the same text take the matching turns in order, so two "participant1: yes" of one window get
+    two different turns. L-nodes without a matching turn are left out.
+"""
+def locate_locutions(nodes: List[AIFNode], start: int, turns: List[str]) -> Dict[str, int]:
+    texts = [normalise(turn) for turn in turns]
+    without_speaker = [normalise(TURN_START.sub("", turn, count=1)) for turn in turns]
+    taken: Dict[str, set] = {}
+    located: Dict[str, int] = {}
+    for node in nodes:
+        text = node.normalised_text()
+        if not text:
+            continue
+        candidates = [i for i in range(len(turns)) if text in (texts[i], without_speaker[i])] \
+            or [i for i in range(len(turns)) if text in texts[i]]
+        free = [i for i in candidates if i not in taken.setdefault(text, set())]
+        if free:
+            taken[text].add(free[0])
+            located[node.node_id] = start + free[0]
+    return located
+
+def is_i_node(node: AIFNode) -> bool:
+    return (node.type or "").strip().upper() in ("I", "I-NODE")
+
+def is_l_node(node: AIFNode) -> bool:
+    return (node.type or "").strip().upper() in ("L", "L-NODE")
+
+def to_aif_dict(graph: AIFGraph) -> Dict[str, Any]:
+    nodes = []
+    for node in graph.nodes.values():
+        d = {json_key: getattr(node, name) for json_key, name in NODE_FIELDS.items() if getattr(node, name) is not None}
+        nodes.append({**d, **node.extras})
+    edges = []
+    for edge in graph.edges:
+        d = {json_key: getattr(edge, name) for json_key, name in EDGE_FIELDS.items() if getattr(edge, name) is not None}
+        edges.append({**d, **edge.extras})
+    return {"nodes": nodes, "edges": edges}
+
+"""
+    Merges the AIF fragments of the windows into one graph with new, sequential node and edge IDs
+    I-nodes with the same normalised text are kept once, which removes the propositions that were extracted twice from
+    the overlapping turns. An L-node is only merged with one of the same text from the same turn, `windows` holds the
+    (start, turns) of the window of every fragment for finding the turns (see locate_locutions), without it L-nodes are
+    never merged. A scheme node is merged with an earlier one of the same type, scheme and text (the illocution of a YA
+    node) that connects the same merged nodes. Scheme nodes are keyed once their neighbours have their merged IDs,
+    neighbours that never get one (cycles of scheme nodes) are qualified with the fragment, so they are not matched
+    against other fragments. Duplicate edges and edges to nodes that are not in their fragment are dropped.
+"""
+def merge_fragments(
+    fragments: List[AIFGraph],
+    windows: Optional[List[Tuple[int, List[str]]]] = None
+) -> Tuple[AIFGraph, int]:
+    merged = AIFGraph()
+    text_nodes: Dict[Tuple[str, str, Any], str] = {}
+    scheme_nodes: Dict[Tuple, str] = {}
+    seen_edges = set()
+    duplicates = 0
+
+    def add(node: AIFNode) -> str:
+        new_id = str(len(merged.nodes) + 1)
+        merged.add_node(AIFNode(
+            node_id=new_id, text=node.text, type=node.type, timestamp=node.timestamp,
+            scheme=node.scheme, scheme_id=node.scheme_id, extras=node.extras
+        ))
+        return new_id
+
+    for index, fragment in enumerate(fragments):
+        ids: Dict[str, str] = {}
+        l_nodes = [node for node in fragment.nodes.values() if is_l_node(node)]
+        turns = locate_locutions(l_nodes, *windows[index]) if windows is not None else {}
+        for node in fragment.nodes.values():
+            if not is_i_node(node) and not is_l_node(node):
+                continue
+            # Nodes without text (or L-nodes without a turn) cannot be matched, they are kept apart under their own ID
+            unique = f"{index}:{node.node_id}"
+            if is_i_node(node):
+                key = ("I", node.normalised_text() or unique, None)
+            else:
+                key = ("L", node.normalised_text(), turns.get(node.node_id, unique))
+            if key in text_nodes:
+                duplicates += 1
+            else:
+                text_nodes[key] = add(node)
+            ids[node.node_id] = text_nodes[key]
+
+        neighbours = {
+            node.node_id: (
+                [e.from_id for e in fragment.edges if e.to_id == node.node_id and e.from_id in fragment.nodes],
+                [e.to_id for e in fragment.edges if e.from_id == node.node_id and e.to_id in fragment.nodes]
+            )
+            for node in fragment.nodes.values() if node.node_id not in ids
+        }
+        remaining = [node for node in fragment.nodes.values() if node.node_id not in ids]
+        while remaining:
+            ready = [
+                node for node in remaining
+                if all(n in ids or n == node.node_id for n in neighbours[node.node_id][0] + neighbours[node.node_id][1])
+            ]
+            # Without progress, the rest waits on each other, one is keyed with fragment-qualified IDs
+            batch = ready or remaining[:1]
+            for node in batch:
+                sources, targets = (frozenset(ids.get(n, f"{index}:{n}") for n in side) for side in neighbours[node.node_id])
+                key = ((node.type or "").strip().upper(), node.scheme, node.normalised_text(), sources, targets)
+                if key in scheme_nodes:
+                    duplicates += 1
+                else:
+                    scheme_nodes[key] = add(node)
+                ids[node.node_id] = scheme_nodes[key]
+            remaining = [node for node in remaining if node.node_id not in ids]
+
+        for edge in fragment.edges:
+            if edge.from_id not in ids or edge.to_id not in ids:
+                continue
+            from_id, to_id = ids[edge.from_id], ids[edge.to_id]
+            if (from_id, to_id) in seen_edges or from_id == to_id:
+                continue
+            seen_edges.add((from_id, to_id))
+            merged.add_edge(AIFEdge(
+                edge_id=str(len(merged.edges) + 1), from_id=from_id, to_id=to_id,
+                form_edge_id=edge.form_edge_id, extras=edge.extras
+            ))
+    return merged, duplicates
+
+def parse_fragment(output: Optional[Dict[str, Any]]) -> Optional[AIFGraph]:
+    if output is None:
+        return None
+    parsed = extract_last_json(output.get("message") or "")
+    if not isinstance(parsed, dict) or not isinstance(parsed.get("nodes"), list) or not isinstance(parsed.get("edges"), list):
+        return None
+    try:
+        return AIFGraph.from_dict_lists(parsed["nodes"], parsed["edges"])
+    except (TypeError, AttributeError) as e:
+        print(f"  Ignoring a malformed AIF fragment: {e}")
+        return None
+
+"""
+    Extracts the AIF graph of a long text window by window
+    The windows (see make_window_ranges) go through `query_fn` with up to `concurrency` in flight and their fragments are
+    merged (see merge_fragments). Returns None when no window produced a usable fragment. The metadata holds the summed
+    token counts of the windows, the number of windows and of the failed ones, and the removed duplicate nodes.
+"""
+def query_chunked(
+    text: str,
+    query_fn: Callable[[str], Optional[Dict[str, Any]]],
+    make_prompt_fn: Callable[[str], str],
+    max_tokens: int,
+    overlap_turns: int = 1,
+    concurrency: int = 1,
+    count_tokens: Callable[[str], int] = estimate_tokens
+) -> Optional[Dict[str, Any]]:
+    turns = split_turns(text)
+    windows = [(start, turns[start:end]) for start, end in make_window_ranges(turns, max_tokens, overlap_turns, count_tokens)]
+    prompts = [make_prompt_fn("\n".join(window)) for _, window in windows]
+    print(f"Querying {len(prompts)} windows with up to {concurrency} concurrent queries...")
+
+    def query_window(prompt: str) -> Tuple[Optional[Dict[str, Any]], float]:
+        start = time.time()
+        try:
+            output = query_fn(prompt)
+        except Exception as e:
+            print("Querying a window failed with error: ", e)
+            output = None
+        return output, time.time() - start
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        results = list(executor.map(query_window, prompts))
+
+    fragments = [(parse_fragment(output), window) for (output, _), window in zip(results, windows)]
+    usable = [(fragment, window) for fragment, window in fragments if fragment is not None]
+    if not usable:
+        return None
+    merged, duplicates = merge_fragments([fragment for fragment, _ in usable], [window for _, window in usable])
+
+    window_metadata = [(output or {}).get("metadata") or {} for output, _ in results]
+    metadata: Dict[str, Any] = {"chunks": len(windows), "failed_chunks": len(windows) - len(usable), "duplicate_nodes": duplicates}
+    for key in ("input_tokens", "output_tokens", "total_tokens"):
+        metadata[key] = sum(m.get(key) or 0 for m in window_metadata)
+    metadata["chunk_elapsed_times"] = [elapsed for _, elapsed in results]
+    models = {m.get("model") for m in window_metadata} - {None}
+    if len(models) == 1:
+        metadata["model"] = models.pop()
+
+    return {
+        "message": json.dumps(to_aif_dict(merged), ensure_ascii=False),
+        "metadata": metadata
+    }
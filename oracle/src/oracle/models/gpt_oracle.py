@@ -1,14 +1,15 @@
 import os
-import time
 from pathlib import Path
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import sys
 from dotenv import load_dotenv
-from typing import Callable, Optional, Dict, Any
+from typing import Callable, Optional, Dict, Any, Awaitable
 
 from oracle.models.oracle_config import GPT_CONFIG, PROMPT_CONFIG_FILE, ROOT_DIR
-from oracle.models.shared import run_with_query, clean_json
+from oracle.models.response_cache import open_response_cache
+from oracle.models.rate_limiter import RateLimiter, query_with_limits, query_with_limits_async
+from oracle.models.shared import Oracle, clean_json
 from shared.parser import read_txt_file
 
 load_dotenv()
@@ -18,61 +19,77 @@ if not OPENAI_API_KEY:
     print("OPENAI_API_KEY environment variable is not set. Make sure the API key is in the .env file.")
     sys.exit(1)
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Retries are done by query_with_limits, so that they go through the shared rate limiter
+client = OpenAI(api_key=OPENAI_API_KEY, base_url=GPT_CONFIG["BASE_URL"], max_retries=0)
+async_client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=GPT_CONFIG["BASE_URL"], max_retries=0)
+limiter = RateLimiter(GPT_CONFIG["REQUESTS_PER_MINUTE"], GPT_CONFIG["TOKENS_PER_MINUTE"])
 
 def make_chatgpt_query(
     model: str = GPT_CONFIG["MODEL_NAME"],
     temperature: float = GPT_CONFIG["TEMPERATURE"],
-    retries: int = 2,
+    retries: int = GPT_CONFIG["MAX_RETRIES"],
 ) -> Callable[[str], Optional[str]]:
 
     def query_fn(prompt_text: str) -> Optional[Dict[str, Any]]:
-        attempt = 0
-        while attempt <= retries:
-            try:
-                resp = None
-                message = None
-                if GPT_CONFIG["USE_PROMPT"] is not None and GPT_CONFIG["USE_PROMPT"] is True:
-                    print("Using predefined prompt...")
-                    resp = client.responses.create(
-                        prompt={
-                            "id": GPT_CONFIG["PROMPT_ID"],
-                            "version": GPT_CONFIG["PROMPT_VERSION"]
-                        },
-                        input=prompt_text
-                    )
-                    message = resp.output[1].content[0].text
-                else:
-                    print("Using local config to construct the prompt")
-                    resp = client.responses.create(
-                        model=model,
-                        input=prompt_text,
-                        temperature=temperature,
-                    )
-                    message = resp.output[0].content[0].text
-
-                metadata = {
-                    "input_tokens": resp.usage.input_tokens,
-                    "output_tokens": resp.usage.output_tokens,
-                    "total_tokens": resp.usage.total_tokens,
-                    "model": resp.model
-                }
-
-                return {
-                    "message": clean_json(message),
-                    "metadata": metadata
-                }
-            except Exception as e:
-                print(e)
-                attempt += 1
-                if attempt > retries:
-                    print("ChatGPT error:", e)
-                    return None
-                time.sleep(1 + attempt)
-        return None
+        request = make_request(prompt_text, model, temperature)
+        return query_with_limits(
+            lambda: parse_response(client.responses.create(**request)),
+            limiter, prompt_text, retries, "ChatGPT"
+        )
 
     return query_fn
 
+def make_chatgpt_async_query(
+    model: str = GPT_CONFIG["MODEL_NAME"],
+    temperature: float = GPT_CONFIG["TEMPERATURE"],
+    retries: int = GPT_CONFIG["MAX_RETRIES"],
+) -> Callable[[str], Awaitable[Optional[Dict[str, Any]]]]:
+
+    async def query_fn(prompt_text: str) -> Optional[Dict[str, Any]]:
+        request = make_request(prompt_text, model, temperature)
+
+        async def send() -> Dict[str, Any]:
+            return parse_response(await async_client.responses.create(**request))
+
+        return await query_with_limits_async(send, limiter, prompt_text, retries, "ChatGPT")
+
+    return query_fn
+
+def make_request(prompt_text: str, model: str, temperature: float) -> Dict[str, Any]:
+    if GPT_CONFIG["USE_PROMPT"] is not None and GPT_CONFIG["USE_PROMPT"] is True:
+        print("Using predefined prompt...")
+        return {
+            "prompt": {
+                "id": GPT_CONFIG["PROMPT_ID"],
+                "version": GPT_CONFIG["PROMPT_VERSION"]
+            },
+            "input": prompt_text
+        }
+    print("Using local config to construct the prompt")
+    return {
+        "model": model,
+        "input": prompt_text,
+        "temperature": temperature,
+    }
+
+def parse_response(resp) -> Dict[str, Any]:
+    if GPT_CONFIG["USE_PROMPT"] is not None and GPT_CONFIG["USE_PROMPT"] is True:
+        message = resp.output[1].content[0].text
+    else:
+        message = resp.output[0].content[0].text
+
+    metadata = {
+        "input_tokens": resp.usage.input_tokens,
+        "output_tokens": resp.usage.output_tokens,
+        "total_tokens": resp.usage.total_tokens,
+        "model": resp.model
+    }
+
+    return {
+        "message": clean_json(message),
+        "metadata": metadata
+    }
+
 def make_prompt_fn(text: str) -> str:
     if GPT_CONFIG["USE_PROMPT"] is not None and GPT_CONFIG["USE_PROMPT"] is True:
         return text
@@ -85,11 +102,39 @@ def make_prompt_fn(text: str) -> str:
     config = read_txt_file(prompt_config_path)
     return f"{config}\n\nInput text:\n\"\"\"{text}\"\"\"\n\n\"\"\""
 
+def prompt_config_fingerprint() -> str:
+    # With a stored prompt the instructions live on the OpenAI side, otherwise they come from the local config file
+    if GPT_CONFIG["USE_PROMPT"] is not None and GPT_CONFIG["USE_PROMPT"] is True:
+        return f"{GPT_CONFIG['PROMPT_ID']}:{GPT_CONFIG['PROMPT_VERSION']}"
+
+    if ROOT_DIR and ROOT_DIR != "NONE":
+        root = Path(ROOT_DIR)
+    else:
+        root = Path(__file__).resolve().parents[3]
+    return read_txt_file(root / PROMPT_CONFIG_FILE)
+
+def make_oracle() -> Oracle:
+    cache = open_response_cache()
+    run_settings = {
+        "model": GPT_CONFIG["MODEL_NAME"],
+        "prompt_config": prompt_config_fingerprint(),
+        "sampling": {"temperature": GPT_CONFIG["TEMPERATURE"], "use_prompt": GPT_CONFIG["USE_PROMPT"]},
+    }
+    return Oracle(
+        name=GPT_CONFIG["MODEL_NAME"],
+        query_fn=cache.wrap(make_chatgpt_query(), **run_settings),
+        make_prompt_fn=make_prompt_fn,
+        async_query_fn=cache.wrap_async(make_chatgpt_async_query(), **run_settings),
+        run_settings=run_settings,
+        cache=cache
+    )
+
 def main(argv=None):
     print("Starting ChatGPT oracle with argv:", argv)
 
-    gpt_query_fn = make_chatgpt_query()
-    run_with_query(query_fn=gpt_query_fn, make_prompt_fn=make_prompt_fn)
+    oracle = make_oracle()
+    oracle.run()
+    oracle.print_summary()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,166 @@
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from oracle.models.oracle_config import WATCH_POLL_INTERVAL, WATCH_DEBOUNCE, WATCH_QUEUE_SIZE, WATCH_IDLE_TIMEOUT
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+class ChangeHandler(FileSystemEventHandler):
+
+    def __init__(self, watcher: "InputWatcher"):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if not event.is_directory:
+            for attribute in ("src_path", "dest_path"):
+                path = getattr(event, attribute, None)
+                if path:
+                    self.watcher.notify(Path(path))
+
+"""
+    Finds new and modified .txt files in the input directory and puts them into `work_queue`
+    Uses filesystem notifications when watchdog is installed and polls the directory every `poll_interval` seconds
+    otherwise. A file is only queued once its size and modification time did not change for `debounce` seconds, so
+    files that are still being written are not picked up halfway. Putting into the bounded queue blocks while the oracle
+    is behind, so the watcher never runs ahead of it by more than the queue size.
+"""
+class InputWatcher:
+
+    def __init__(
+        self,
+        input_path: Path,
+        work_queue: "queue.Queue[Optional[Tuple[Path, float]]]",
+        poll_interval: float = WATCH_POLL_INTERVAL,
+        debounce: float = WATCH_DEBOUNCE
+    ):
+        self.input_path = input_path
+        self.work_queue = work_queue
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.queued: Dict[str, Tuple[int, int]] = {}
+        self.pending: Dict[Path, Tuple[Tuple[int, int], float]] = {}
+        self.changed: Set[Path] = set()
+        self.lock = threading.Lock()
+        self.last_activity = time.time()
+
+    @staticmethod
+    def is_input(path: Path) -> bool:
+        return path.suffix.lower() == ".txt"
+
+    def notify(self, path: Path) -> None:
+        if self.is_input(path):
+            with self.lock:
+                self.changed.add(path)
+
+    def scan(self) -> None:
+        for path in self.input_path.iterdir():
+            if path.is_file():
+                self.notify(path)
+
+    def tick(self, now: float) -> None:
+        with self.lock:
+            changed, self.changed = self.changed, set()
+        for path in changed | set(self.pending):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                self.pending.pop(path, None)
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if self.queued.get(path.name) == signature:
+                self.pending.pop(path, None)
+                continue
+            previous = self.pending.get(path)
+            if previous is None or previous[0] != signature:
+                self.pending[path] = (signature, now)
+            elif now - previous[1] >= self.debounce and stat.st_size > 0:
+                del self.pending[path]
+                self.queued[path.name] = signature
+                self.last_activity = now
+                self.work_queue.put((path, now))
+
+    def is_idle(self) -> bool:
+        with self.lock:
+            return not self.changed and not self.pending and self.work_queue.unfinished_tasks == 0
+
+    def run(self, stop: threading.Event, idle_timeout: float = WATCH_IDLE_TIMEOUT) -> None:
+        observer = None
+        if Observer is not None:
+            observer = Observer()
+            observer.schedule(ChangeHandler(self), str(self.input_path), recursive=False)
+            observer.start()
+            print(f"Watching {self.input_path} for new transcripts")
+        else:
+            print(f"Watching {self.input_path} for new transcripts every {self.poll_interval} s (install watchdog for notifications)")
+
+        self.scan()
+        next_poll = time.time() + self.poll_interval
+        try:
+            while not stop.is_set():
+                now = time.time()
+                if observer is None and now >= next_poll:
+                    self.scan()
+                    next_poll = now + self.poll_interval
+                self.tick(now)
+                if idle_timeout > 0 and self.is_idle() and now - self.last_activity > idle_timeout:
+                    print(f"No new transcripts for {idle_timeout} s, stopping")
+                    break
+                stop.wait(min(0.5, self.debounce / 2) if self.debounce > 0 else 0.1)
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+"""
+    Runs `process_path(path, queued_at)` on every transcript the watcher finds, with `workers` threads taking files from a queue of at
+    most `queue_size` files
+    Returns after `idle_timeout` seconds without new files and with nothing left to process (0 = runs until Ctrl+C).
+"""
+def watch_input_dir(
+    input_path: Path,
+    process_path: Callable[[Path, float], None],
+    workers: int = 1,
+    queue_size: int = WATCH_QUEUE_SIZE,
+    poll_interval: float = WATCH_POLL_INTERVAL,
+    debounce: float = WATCH_DEBOUNCE,
+    idle_timeout: float = WATCH_IDLE_TIMEOUT
+) -> None:
+    work_queue: "queue.Queue[Optional[Tuple[Path, float]]]" = queue.Queue(maxsize=max(1, queue_size))
+    watcher = InputWatcher(input_path, work_queue, poll_interval, debounce)
+    stop = threading.Event()
+
+    def work() -> None:
+        while True:
+            item = work_queue.get()
+            try:
+                if item is None:
+                    return
+                path, queued_at = item
+                print(f"Picked up {path.name} after {time.time() - queued_at:.1f} s in the queue ({work_queue.qsize()} more queued)")
+                process_path(path, queued_at)
+            except Exception as e:
+                print(f"Processing {item[0].name} failed with error: {e}")
+            finally:
+                work_queue.task_done()
+
+    threads = [threading.Thread(target=work, daemon=True) for _ in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+    try:
+        watcher.run(stop, idle_timeout)
+    except KeyboardInterrupt:
+        print("Stopping the watcher, finishing the queued files...")
+    stop.set()
+    for _ in threads:
+        work_queue.put(None)
+    for thread in threads:
+        thread.join()
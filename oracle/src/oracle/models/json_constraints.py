@@ -0,0 +1,77 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from transformers import LogitsProcessor
+
+from oracle.models.json_schema import TokenIndex, initial_state, is_done
+
+def make_token_index(tokenizer) -> Tuple[TokenIndex, List[str]]:
+    # Special tokens decode to "", so they are never allowed inside the document
+    token_texts = [tokenizer.decode([token_id], skip_special_tokens=True) for token_id in range(len(tokenizer))]
+    return TokenIndex(token_texts), token_texts
+
+"""
+    Masks every token that would not keep the generated text a valid prefix of a document of `schema`
+    Every row keeps its generated tokens and the automaton state after each of them. On every call the recorded tokens
+    are compared with the current sequence, so candidates that were rejected during assisted decoding are rolled back
+    before the new tokens are applied. Once a row holds a complete document only the eos tokens are left. Masks are
+    cached per automaton state.
+"""
+class JSONSchemaLogitsProcessor(LogitsProcessor):
+
+    def __init__(
+        self,
+        token_index: TokenIndex,
+        token_texts: List[str],
+        schema: Any,
+        prompt_length: int,
+        batch_size: int,
+        eos_token_ids: List[int],
+        mask_cache: Optional[Dict[Tuple, torch.Tensor]] = None
+    ):
+        self.token_index = token_index
+        self.token_texts = token_texts
+        self.prompt_length = prompt_length
+        self.eos_token_ids = eos_token_ids
+        self.tokens: List[List[int]] = [[] for _ in range(batch_size)]
+        self.states: List[List[Optional[Tuple]]] = [[initial_state(schema)] for _ in range(batch_size)]
+        # Pass the same dict to every processor of a run to build the mask of each state only once
+        self.masks: Dict[Tuple, torch.Tensor] = mask_cache if mask_cache is not None else {}
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        for row in range(len(self.tokens)):
+            state = self.advance_row(row, input_ids[row, self.prompt_length:].tolist())
+            if state is None:
+                # Cannot happen with the mask applied, left unconstrained rather than forcing a broken document
+                continue
+            scores[row] = scores[row] + self.mask_for(state, scores)
+        return scores
+
+    def advance_row(self, row: int, current: List[int]) -> Optional[Tuple]:
+        tokens, states = self.tokens[row], self.states[row]
+        common = len(tokens)
+        if current[:common] != tokens:
+            mismatches = (i for i, (recorded, token) in enumerate(zip(tokens, current)) if recorded != token)
+            common = next(mismatches, min(len(tokens), len(current)))
+        del tokens[common:]
+        del states[common + 1:]
+
+        for token in current[common:]:
+            state = states[-1]
+            if state is not None and token not in self.eos_token_ids:
+                state = self.token_index.advance(state, self.token_texts[token])
+            tokens.append(token)
+            states.append(state)
+        return states[-1]
+
+    def mask_for(self, state: Tuple, scores: torch.FloatTensor) -> torch.Tensor:
+        mask = self.masks.get(state)
+        if mask is None:
+            allowed = self.eos_token_ids if is_done(state) else self.token_index.allowed_tokens(state)
+            mask = torch.full((scores.shape[-1],), float("-inf"), dtype=scores.dtype, device=scores.device)
+            mask[torch.tensor(allowed or self.eos_token_ids, dtype=torch.long, device=scores.device)] = 0.0
+            self.masks[state] = mask
+        return mask
+
+    def is_complete(self, row: int) -> bool:
+        return is_done(self.states[row][-1])
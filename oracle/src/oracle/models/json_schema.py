@@ -0,0 +1,199 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+"""
+    Character-level automaton for JSON documents of a fixed schema
+    A state is an immutable tuple (a stack of frames), so states can be used as dictionary keys and the set of tokens
+    allowed in a state only has to be computed once. Objects list their properties in order, optional properties can be
+    skipped but not reordered. Whitespace is allowed wherever JSON allows it, also before and after the document.
+    String contents are not tracked, only whether the string is still open.
+"""
+WHITESPACE = " \t\n\r"
+HEX_DIGITS = "0123456789abcdefABCDEF"
+SIMPLE_ESCAPES = "\"\\/bfnrt"
+
+@dataclass(frozen=True)
+class StringSchema:
+    pass
+
+@dataclass(frozen=True)
+class ArraySchema:
+    items: Any
+
+@dataclass(frozen=True)
+class ObjectSchema:
+    # (name, schema, required) in the order the properties have to appear
+    properties: Tuple[Tuple[str, Any, bool], ...]
+
+AIF_NODE_SCHEMA = ObjectSchema((
+    ("nodeID", StringSchema(), True),
+    ("text", StringSchema(), False),
+    ("type", StringSchema(), True),
+))
+AIF_EDGE_SCHEMA = ObjectSchema((
+    ("edgeID", StringSchema(), True),
+    ("fromID", StringSchema(), True),
+    ("toID", StringSchema(), True),
+))
+AIF_SCHEMA = ObjectSchema((
+    ("nodes", ArraySchema(AIF_NODE_SCHEMA), True),
+    ("edges", ArraySchema(AIF_EDGE_SCHEMA), True),
+))
+
+DONE = ("done",)
+
+def initial_state(schema: Any) -> Tuple:
+    return (open_frame(schema),)
+
+def open_frame(schema: Any) -> Tuple:
+    if isinstance(schema, ObjectSchema):
+        return ("object", schema, 0, "open", "")
+    if isinstance(schema, ArraySchema):
+        return ("array", schema, "open")
+    return ("string", "open", 0)
+
+def is_done(state: Optional[Tuple]) -> bool:
+    return state == (DONE,)
+
+def key_candidates(schema: ObjectSchema, index: int) -> List[Tuple[int, str]]:
+    # The next key can be any property up to and including the next required one
+    candidates = []
+    for position in range(index, len(schema.properties)):
+        name, _, required = schema.properties[position]
+        candidates.append((position, name))
+        if required:
+            break
+    return candidates
+
+def can_close(schema: ObjectSchema, index: int) -> bool:
+    return all(not required for _, _, required in schema.properties[index:])
+
+def finish_child(stack: Tuple) -> Tuple:
+    # Pops the completed top frame and moves its parent past the value
+    stack = stack[:-1]
+    if not stack:
+        return (DONE,)
+    parent = stack[-1]
+    if parent[0] == "object":
+        return stack[:-1] + (("object", parent[1], parent[2], "after_value", ""),)
+    return stack[:-1] + (("array", parent[1], "after_item"),)
+
+def step(state: Optional[Tuple], char: str) -> Optional[Tuple]:
+    # Returns the state after `char`, or None when `char` cannot continue a valid document
+    if state is None or not state:
+        return None
+    frame = state[-1]
+    kind = frame[0]
+
+    if kind == "done":
+        return state if char in WHITESPACE else None
+
+    if kind == "string":
+        _, phase, pending = frame
+        if phase == "open":
+            if char in WHITESPACE:
+                return state
+            return state[:-1] + (("string", "in", 0),) if char == '"' else None
+        if phase == "escape":
+            if char in SIMPLE_ESCAPES:
+                return state[:-1] + (("string", "in", 0),)
+            return state[:-1] + (("string", "unicode", 4),) if char == "u" else None
+        if phase == "unicode":
+            if char not in HEX_DIGITS:
+                return None
+            return state[:-1] + (("string", "in", 0) if pending == 1 else ("string", "unicode", pending - 1),)
+        if char == '"':
+            return finish_child(state)
+        if char == "\\":
+            return state[:-1] + (("string", "escape", 0),)
+        return state if ord(char) >= 0x20 else None
+
+    if kind == "array":
+        _, schema, phase = frame
+        if char in WHITESPACE and phase != "item":
+            return state
+        if phase == "open":
+            return state[:-1] + (("array", schema, "first"),) if char == "[" else None
+        if phase == "after_item":
+            if char == ",":
+                return state[:-1] + (("array", schema, "next"),)
+            return finish_child(state) if char == "]" else None
+        if phase == "first" and char == "]":
+            return finish_child(state)
+        # "first" or "next": the character starts the next item
+        return step(state[:-1] + (("array", schema, "item"), open_frame(schema.items)), char)
+
+    _, schema, index, phase, prefix = frame
+    if phase == "key":
+        candidates = key_candidates(schema, index)
+        if char == '"':
+            for position, name in candidates:
+                if name == prefix:
+                    return state[:-1] + (("object", schema, position, "colon", ""),)
+            return None
+        if any(name.startswith(prefix + char) for _, name in candidates):
+            return state[:-1] + (("object", schema, index, "key", prefix + char),)
+        return None
+
+    if char in WHITESPACE:
+        return state
+    if phase == "open":
+        return state[:-1] + (("object", schema, index, "first", ""),) if char == "{" else None
+    if phase in ("first", "next"):
+        if char == '"' and key_candidates(schema, index):
+            return state[:-1] + (("object", schema, index, "key", ""),)
+        if phase == "first" and char == "}" and can_close(schema, index):
+            return finish_child(state)
+        return None
+    if phase == "colon":
+        if char != ":":
+            return None
+        value_schema = schema.properties[index][1]
+        return state[:-1] + (("object", schema, index + 1, "value", ""), open_frame(value_schema))
+    # "after_value"
+    if char == ",":
+        return state[:-1] + (("object", schema, index, "next", ""),) if key_candidates(schema, index) else None
+    if char == "}" and can_close(schema, index):
+        return finish_child(state)
+    return None
+
+def step_text(state: Optional[Tuple], text: str) -> Optional[Tuple]:
+    for char in text:
+        state = step(state, char)
+        if state is None:
+            return None
+    return state
+
+"""
+    Vocabulary index for finding the tokens allowed in a state
+    Tokens are grouped by their first character, a whole group is skipped when its first character is not allowed,
+    which leaves only a few candidates outside of strings. The allowed tokens and the transitions are memoised.
+"""
+class TokenIndex:
+
+    def __init__(self, token_texts: List[str]):
+        self.by_first_char: Dict[str, List[Tuple[int, str]]] = defaultdict(list)
+        for token_id, text in enumerate(token_texts):
+            if text:
+                self.by_first_char[text[0]].append((token_id, text))
+        self.allowed_cache: Dict[Tuple, List[int]] = {}
+        self.transitions: Dict[Tuple[Tuple, str], Optional[Tuple]] = {}
+
+    def allowed_tokens(self, state: Tuple) -> List[int]:
+        allowed = self.allowed_cache.get(state)
+        if allowed is None:
+            allowed = []
+            for first_char, tokens in self.by_first_char.items():
+                after_first = step(state, first_char)
+                if after_first is None:
+                    continue
+                allowed.extend(token_id for token_id, text in tokens if step_text(after_first, text[1:]) is not None)
+            self.allowed_cache[state] = allowed
+        return allowed
+
+    def advance(self, state: Optional[Tuple], text: str) -> Optional[Tuple]:
+        key = (state, text)
+        if key not in self.transitions:
+            self.transitions[key] = step_text(state, text)
+        return self.transitions[key]
@@ -0,0 +1,92 @@
+import json
+from typing import List, Optional
+
+import torch
+from transformers import StoppingCriteria
+
+"""
+    Incremental scanner for the first complete top-level JSON object in generated text
+    Tracks the nesting depth and the string/escape state character by character, so every character is only looked at
+    once. Text outside of an object is ignored, which keeps quotes and braces in prose before the JSON from confusing the
+    state. When a top-level object closes it is parsed, and it counts as complete when it is a dict with all
+    `required_keys`, otherwise the scanner waits for the next object.
+"""
+class JSONObjectTracker:
+
+    def __init__(self, required_keys: Optional[List[str]] = None):
+        self.required_keys = required_keys or []
+        self.buffer: List[str] = []
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.complete = False
+        self.result: Optional[dict] = None
+
+    def feed(self, text: str) -> bool:
+        for char in text:
+            if self.complete:
+                break
+            if self.depth == 0:
+                if char == "{":
+                    self.buffer = [char]
+                    self.depth = 1
+                continue
+
+            self.buffer.append(char)
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.check_object()
+        return self.complete
+
+    def check_object(self) -> None:
+        try:
+            candidate = json.loads("".join(self.buffer))
+        except json.JSONDecodeError:
+            candidate = None
+        if isinstance(candidate, dict) and all(key in candidate for key in self.required_keys):
+            self.complete = True
+            self.result = candidate
+        self.buffer = []
+
+"""
+    Stops the generation of every row once its generated text holds a complete JSON object (see JSONObjectTracker)
+    Only the tokens added since the last call are decoded, one token at a time. `stopped_after[row]` is the number of
+    generated tokens up to and including the one that closed the object.
+"""
+class JSONStoppingCriteria(StoppingCriteria):
+
+    def __init__(self, tokenizer, prompt_length: int, batch_size: int = 1, required_keys: Optional[List[str]] = None):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.trackers = [JSONObjectTracker(required_keys) for _ in range(batch_size)]
+        self.stopped_after: List[Optional[int]] = [None] * batch_size
+        self.seen = 0
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        generated = input_ids.shape[-1] - self.prompt_length
+        for position in range(self.seen, generated):
+            for row, tracker in enumerate(self.trackers):
+                if tracker.complete:
+                    continue
+                token = input_ids[row, self.prompt_length + position].item()
+                if tracker.feed(self.tokenizer.decode([token], skip_special_tokens=True)):
+                    self.stopped_after[row] = position + 1
+        self.seen = generated
+        return torch.tensor([tracker.complete for tracker in self.trackers], device=input_ids.device)
+
+    def unused_token_budget(self, row: int, max_new_tokens: int) -> int:
+        # The part of `max_new_tokens` the row did not need, not tokens that would otherwise have been generated
+        stopped_after = self.stopped_after[row]
+        return max_new_tokens - stopped_after if stopped_after is not None else 0
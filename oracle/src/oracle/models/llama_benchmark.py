@@ -0,0 +1,72 @@
+import time
+from typing import Any, Dict, List
+
+from oracle.models.llama_oracle import load_model_and_tokenizer, make_llama_query_fns, make_prompt_fn
+from oracle.models.oracle_config import INPUT_DIR, OUTPUT_DIR
+from oracle.models.shared import find_input_files
+from shared.parser import extract_last_json, read_txt_file, write_json_file
+
+"""
+    Compares unconstrained and schema-constrained Llama decoding on the files in INPUT_DIR
+    python -m oracle.models.llama_benchmark
+    Reports the generated tokens, the wall time and the share of outputs that do not parse as an AIF graph (a JSON
+    object with `nodes` and `edges` lists) for both modes, and writes them to OUTPUT_DIR/decoding_benchmark.json.
+"""
+def is_valid_aif(parsed: Any) -> bool:
+    return isinstance(parsed, dict) and isinstance(parsed.get("nodes"), list) and isinstance(parsed.get("edges"), list)
+
+def generated_text(tokenizer, prompt: str, message: str) -> str:
+    # The oracle decodes the whole sequence, the example JSON in the prompt must not count as a parsed output
+    prompt_text = tokenizer.decode(tokenizer(prompt)["input_ids"], skip_special_tokens=True)
+    return message[len(prompt_text):] if message.startswith(prompt_text) else message
+
+def benchmark_mode(model, tokenizer, prompts: List[str], constrained: bool) -> Dict[str, Any]:
+    query_fn, _ = make_llama_query_fns(model, tokenizer, constrained=constrained)
+    output_tokens = 0
+    failures = 0
+    start = time.perf_counter()
+    for prompt in prompts:
+        output = query_fn(prompt)
+        if output is None:
+            failures += 1
+            continue
+        output_tokens += output["metadata"]["output_tokens"]
+        if not is_valid_aif(extract_last_json(generated_text(tokenizer, prompt, output["message"]))):
+            failures += 1
+    elapsed = time.perf_counter() - start
+    return {
+        "files": len(prompts),
+        "output_tokens": output_tokens,
+        "average_output_tokens": output_tokens / len(prompts),
+        "elapsed": elapsed,
+        "average_elapsed": elapsed / len(prompts),
+        "parse_failures": failures,
+        "parse_failure_rate": failures / len(prompts),
+    }
+
+def main(argv=None):
+    print("Starting the decoding benchmark with argv=", argv)
+    found = find_input_files(INPUT_DIR, OUTPUT_DIR)
+    if found is None:
+        return
+    txt_files, output_path = found
+    prompts = [make_prompt_fn(text) for text in (read_txt_file(str(path)) for path in txt_files) if text]
+    if not prompts:
+        print("No non-empty input files found")
+        return
+
+    model, tokenizer = load_model_and_tokenizer()
+    results = {}
+    for name, constrained in (("unconstrained", False), ("constrained", True)):
+        print(f"Running {len(prompts)} files {name}...")
+        results[name] = benchmark_mode(model, tokenizer, prompts, constrained)
+        r = results[name]
+        print(f"  {name}: {r['average_output_tokens']:.1f} output tokens, {r['average_elapsed']:.2f} s per file, "
+              f"{r['parse_failures']}/{r['files']} parse failures")
+
+    write_json_file(output_path / "decoding_benchmark.json", results)
+    print(f"Wrote the results to {OUTPUT_DIR}/decoding_benchmark.json")
+    print("Exiting...")
+
+if __name__ == "__main__":
+    main()
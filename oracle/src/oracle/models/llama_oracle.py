@@ -1,11 +1,19 @@
+import copy
+import threading
+import time
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Callable, Dict, List, Tuple
 
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+from transformers import AutoTokenizer, AutoModelForCausalLM, DynamicCache, LogitsProcessorList, StoppingCriteriaList, pipeline
 from transformers.utils.logging import set_verbosity_error, set_verbosity_warning
 from oracle.models.oracle_config import LLAMA_CONFIG, PROMPT_CONFIG_FILE, USE_GPU, ROOT_DIR
-from oracle.models.shared import run_with_query
+from oracle.models.json_constraints import JSONSchemaLogitsProcessor, make_token_index
+from oracle.models.json_schema import AIF_SCHEMA
+from oracle.models.json_stopping import JSONStoppingCriteria
+from oracle.models.response_cache import open_response_cache
+from oracle.models.shared import Oracle
 from shared.parser import read_txt_file
 
 set_verbosity_error()
@@ -13,18 +21,27 @@ set_verbosity_warning()
 
 # Made referencing https://www.llama.com/docs/model-cards-and-prompt-formats/llama3_1/#-instruct-model-prompt-
 def make_prompt_fn(text: str) -> str:
+    return f'''{make_prompt_prefix()}{text}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
+    '''
+
+# The part of the prompt that is the same for every input file
+def make_prompt_prefix() -> str:
+    prompt_config_text = read_prompt_config()
+    return f'''
+        {prompt_config_text} <|start_header_id|>user<|end_header_id|>
+        '''
+
+def read_prompt_config() -> str:
     if ROOT_DIR and ROOT_DIR != "NONE":
         root = Path(ROOT_DIR)
     else:
         root = Path(__file__).resolve().parents[3]
     prompt_config_path = root / PROMPT_CONFIG_FILE
-    prompt_config_text = read_txt_file(prompt_config_path)
-    return f'''
-        {prompt_config_text} <|start_header_id|>user<|end_header_id|>
-        {text}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
-    '''
+    return read_txt_file(prompt_config_path)
 
 def select_device_and_dtype():
+    if not USE_GPU:
+        return torch.device("cpu"), torch.float32
     if torch.cuda.is_available():
         return torch.device("cuda"), torch.float16
     elif torch.backends.mps.is_available():
@@ -32,9 +49,46 @@ def select_device_and_dtype():
     else:
         return torch.device("cpu"), torch.float32
 
-def main(argv=None):
-    print("Starting Llama oracle with argv:", argv)
+"""
+    Key/value cache of the shared prompt prefix (the prompt config), computed once per run
+    Prompts that start with the prefix are tokenized as the cached prefix tokens followed by the tokens of the rest, and
+    generation starts from a copy of the prefix cache, so only the document itself is prefilled. Splitting the tokens at
+    the prefix boundary can tokenize the first characters after it slightly differently than the whole prompt would.
+"""
+class PrefixCache:
+
+    def __init__(self, model, tokenizer, prefix: str):
+        start = time.time()
+        self.prefix = prefix
+        self.input_ids = tokenizer(prefix, return_tensors="pt")["input_ids"].to(model.device)
+        self.cache = DynamicCache()
+        with torch.no_grad():
+            model(input_ids=self.input_ids, past_key_values=self.cache, use_cache=True)
+        self.prefill_time = time.time() - start
+
+    @property
+    def num_tokens(self) -> int:
+        return self.input_ids.shape[-1]
+
+    def build_inputs(self, tokenizer, prompt: str) -> Optional[Tuple[torch.Tensor, DynamicCache]]:
+        if not prompt.startswith(self.prefix):
+            return None
+        rest = tokenizer(prompt[len(self.prefix):], add_special_tokens=False, return_tensors="pt")["input_ids"]
+        input_ids = torch.cat([self.input_ids, rest.to(self.input_ids.device)], dim=-1)
+        return input_ids, copy.deepcopy(self.cache)
 
+def generated_length(generated: torch.Tensor, eos_token_ids: List[int]) -> int:
+    # Rows that finish early are padded with eos up to the longest row of the batch, the first eos is still counted
+    eos_positions = torch.isin(generated, torch.tensor(eos_token_ids, device=generated.device)).nonzero()
+    return int(eos_positions[0][0]) + 1 if len(eos_positions) else generated.shape[-1]
+
+def model_eos_token_ids(model, tokenizer) -> List[int]:
+    eos_token_ids = model.generation_config.eos_token_id
+    if not isinstance(eos_token_ids, list):
+        eos_token_ids = [eos_token_ids if eos_token_ids is not None else tokenizer.eos_token_id]
+    return eos_token_ids
+
+def load_model_and_tokenizer():
     device, dtype = select_device_and_dtype()
     print(f"Using device: {device}")
 
@@ -42,7 +96,7 @@ def main(argv=None):
     model = AutoModelForCausalLM.from_pretrained(
         LLAMA_CONFIG["MODEL_NAME"],
         dtype=dtype,
-        device_map = "auto",
+        device_map = "auto" if USE_GPU else "cpu",
         low_cpu_mem_usage = True
     )
     model.eval()
@@ -54,41 +108,272 @@ def main(argv=None):
     tokenizer.padding_side = "left"
     model.config.pad_token_id = tokenizer.eos_token_id
     print("Successfully loaded the tokenizer")
+    return model, tokenizer
+
+def load_draft_model(model_name: str = LLAMA_CONFIG["DRAFT_MODEL_NAME"]):
+    if not model_name:
+        return None, None
+    _, dtype = select_device_and_dtype()
+    print(f"Loading draft model {model_name} ...")
+    draft_model = AutoModelForCausalLM.from_pretrained(
+        model_name,
+        dtype=dtype,
+        device_map = "auto" if USE_GPU else "cpu",
+        low_cpu_mem_usage = True
+    )
+    draft_model.eval()
+    draft_model.generation_config.num_assistant_tokens = LLAMA_CONFIG["DRAFT_TOKENS"]
+    draft_tokenizer = AutoTokenizer.from_pretrained(model_name)
+    print("Successfully loaded the draft model")
+    return draft_model, draft_tokenizer
+
+"""
+    Counts the forward passes of the target and the draft model during one generate call
+    In assisted generation every target forward verifies the drafted tokens and adds one token of its own, so the
+    accepted draft tokens are the generated tokens minus the target forwards, and every draft forward proposes one token.
+    The hooks are only registered inside the `with` block. They would also count the forwards of other generate calls
+    on the same models, so the callers hold `lock` while counting.
+"""
+class ForwardCounter:
+
+    def __init__(self, model, draft_model):
+        self.model = model
+        self.draft_model = draft_model
+        self.target = 0
+        self.draft = 0
+        self.handles = []
+
+    def __enter__(self) -> "ForwardCounter":
+        self.handles = [
+            self.model.register_forward_pre_hook(lambda *_: self.count("target")),
+            self.draft_model.register_forward_pre_hook(lambda *_: self.count("draft")),
+        ]
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+    def count(self, name: str) -> None:
+        setattr(self, name, getattr(self, name) + 1)
+
+    def acceptance(self, output_tokens: int) -> Dict[str, Any]:
+        accepted = max(0, output_tokens - self.target)
+        return {
+            "draft_tokens_proposed": self.draft,
+            "draft_tokens_accepted": accepted,
+            "draft_acceptance_rate": accepted / self.draft if self.draft else 0.0,
+        }
+
+def make_llama_query_fns(
+    model,
+    tokenizer,
+    constrained: bool = LLAMA_CONFIG["CONSTRAINED_JSON"],
+    draft_model=None,
+    draft_tokenizer=None
+) -> Tuple[Callable[[str], Optional[Dict[str, Any]]], Callable[[List[str]], List[Optional[Dict[str, Any]]]]]:
+    eos_token_ids = model_eos_token_ids(model, tokenizer)
+
+    # Serialises the generate calls, so the forward counts of one call never include the forwards of another
+    generate_lock = threading.Lock()
+    assisted_kwargs: Dict[str, Any] = {}
+    if draft_model is not None:
+        assisted_kwargs["assistant_model"] = draft_model
+        if draft_tokenizer is not None and draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+            # Universal assisted decoding translates the drafted tokens between the two vocabularies
+            assisted_kwargs["tokenizer"] = tokenizer
+            assisted_kwargs["assistant_tokenizer"] = draft_tokenizer
+
+    prefix_cache: Optional[PrefixCache] = None
+    if LLAMA_CONFIG["PREFIX_CACHE"]:
+        prefix_cache = PrefixCache(model, tokenizer, make_prompt_prefix())
+        print(f"Prefilled the {prefix_cache.num_tokens} prompt prefix tokens in {prefix_cache.prefill_time:.2f}s")
+
+    token_index, token_texts, mask_cache = None, None, {}
+    if constrained:
+        start = time.time()
+        token_index, token_texts = make_token_index(tokenizer)
+        print(f"Indexed the vocabulary for constrained decoding in {time.time() - start:.2f}s")
+
+    def generation_kwargs(prompt_length: int, batch_size: int) -> Tuple[Dict[str, Any], Optional[JSONStoppingCriteria], Optional[JSONSchemaLogitsProcessor]]:
+        kwargs: Dict[str, Any] = {
+            "max_new_tokens": LLAMA_CONFIG["MAX_TOKENS"],
+            "do_sample": True,
+            "temperature": LLAMA_CONFIG["TEMPERATURE"],
+            "pad_token_id": tokenizer.eos_token_id,
+        }
+        criteria = None
+        if LLAMA_CONFIG["STOP_AT_JSON_END"]:
+            criteria = JSONStoppingCriteria(tokenizer, prompt_length, batch_size, LLAMA_CONFIG["JSON_REQUIRED_KEYS"])
+            kwargs["stopping_criteria"] = StoppingCriteriaList([criteria])
+        processor = None
+        if constrained:
+            processor = JSONSchemaLogitsProcessor(
+                token_index, token_texts, AIF_SCHEMA, prompt_length, batch_size, eos_token_ids, mask_cache
+            )
+            kwargs["logits_processor"] = LogitsProcessorList([processor])
+        if assisted_kwargs and batch_size == 1:
+            # Assisted generation only supports a single sequence
+            kwargs.update(assisted_kwargs)
+        return kwargs, criteria, processor
+
+    def generation_metadata(
+        criteria: Optional[JSONStoppingCriteria],
+        processor: Optional[JSONSchemaLogitsProcessor],
+        row: int
+    ) -> Dict[str, Any]:
+        metadata: Dict[str, Any] = {}
+        if criteria is not None:
+            metadata["stopped_at_json_end"] = criteria.stopped_after[row] is not None
+            metadata["unused_token_budget"] = criteria.unused_token_budget(row, LLAMA_CONFIG["MAX_TOKENS"])
+        if processor is not None:
+            metadata["constrained_json"] = True
+            metadata["json_complete"] = processor.is_complete(row)
+        return metadata
 
     def llama_query_fn(prompt: str) -> Optional[Dict[str, Any]]:
         try:
-            inputs = tokenizer(prompt, return_tensors="pt")
-            input_ids = inputs["input_ids"].to(model.device)
+            cached_inputs = prefix_cache.build_inputs(tokenizer, prompt) if prefix_cache is not None else None
+            extra_metadata: Dict[str, Any] = {}
+            if cached_inputs is not None:
+                input_ids, past_key_values = cached_inputs
+                attention_mask = torch.ones_like(input_ids)
+                cache_kwargs = {"past_key_values": past_key_values}
+                extra_metadata = {
+                    "prefix_tokens": prefix_cache.num_tokens,
+                    "prefill_time_saved": prefix_cache.prefill_time,
+                }
+            else:
+                inputs = tokenizer(prompt, return_tensors="pt")
+                input_ids = inputs["input_ids"].to(model.device)
+                attention_mask = inputs["attention_mask"].to(model.device)
+                cache_kwargs = {}
             input_tokens = input_ids.shape[-1]
 
-            attention_mask = inputs["attention_mask"].to(model.device)
-
-            outputs = model.generate(
-                input_ids=input_ids,
-                attention_mask=attention_mask,
-                max_new_tokens=LLAMA_CONFIG["MAX_TOKENS"],
-                do_sample=True,
-                temperature=LLAMA_CONFIG["TEMPERATURE"],
-                pad_token_id=tokenizer.eos_token_id,
-            )
+            kwargs, criteria, processor = generation_kwargs(input_tokens, 1)
+            forward_counter = ForwardCounter(model, draft_model) if draft_model is not None else None
+            start = time.time()
+            with generate_lock, forward_counter or nullcontext():
+                outputs = model.generate(
+                    input_ids=input_ids,
+                    attention_mask=attention_mask,
+                    **kwargs,
+                    **cache_kwargs,
+                )
+            generation_time = time.time() - start
 
             message = tokenizer.decode(outputs[0], skip_special_tokens=True)
 
             output_tokens = outputs.shape[-1] - input_tokens
             total_tokens = input_tokens + output_tokens
+            extra_metadata["tokens_per_second"] = output_tokens / generation_time if generation_time > 0 else 0.0
+            if forward_counter is not None:
+                extra_metadata["draft_model"] = LLAMA_CONFIG["DRAFT_MODEL_NAME"]
+                extra_metadata.update(forward_counter.acceptance(output_tokens))
             return {
                 "message": message,
                 "metadata": {
                     "input_tokens": input_tokens,
                     "output_tokens": output_tokens,
                     "total_tokens": total_tokens,
-                    "model": LLAMA_CONFIG["MODEL_NAME"]
+                    "model": LLAMA_CONFIG["MODEL_NAME"],
+                    **extra_metadata,
+                    **generation_metadata(criteria, processor, 0)
                 }
             }
         except Exception as e:
             print("LLama generator error:", e)
             return None
 
-    run_with_query(query_fn=llama_query_fn, make_prompt_fn=make_prompt_fn)
+    def llama_batch_query_fn(prompts: List[str]) -> List[Optional[Dict[str, Any]]]:
+        try:
+            # Left padding (set above) keeps the generated tokens of every row at the end of the sequence. The padding
+            # goes before the prompt prefix, so batches do not use the prefix cache
+            inputs = tokenizer(prompts, return_tensors="pt", padding=True)
+            input_ids = inputs["input_ids"].to(model.device)
+            attention_mask = inputs["attention_mask"].to(model.device)
+            padded_length = input_ids.shape[-1]
+
+            kwargs, criteria, processor = generation_kwargs(padded_length, len(prompts))
+            start = time.time()
+            with generate_lock:
+                outputs = model.generate(
+                    input_ids=input_ids,
+                    attention_mask=attention_mask,
+                    **kwargs,
+                )
+            generation_time = time.time() - start
+
+            results = []
+            for row in range(len(prompts)):
+                input_tokens = int(attention_mask[row].sum())
+                output_tokens = generated_length(outputs[row, padded_length:], eos_token_ids)
+                if criteria is not None and criteria.stopped_after[row] is not None:
+                    # Rows stopped by the criteria are padded afterwards, without an eos of their own
+                    output_tokens = criteria.stopped_after[row]
+                message = tokenizer.decode(outputs[row], skip_special_tokens=True)
+                results.append({
+                    "message": message,
+                    "metadata": {
+                        "input_tokens": input_tokens,
+                        "output_tokens": output_tokens,
+                        "total_tokens": input_tokens + output_tokens,
+                        "model": LLAMA_CONFIG["MODEL_NAME"],
+                        **generation_metadata(criteria, processor, row)
+                    }
+                })
+            # Throughput of the whole batch, the rows are generated together
+            generated = sum(result["metadata"]["output_tokens"] for result in results)
+            for result in results:
+                result["metadata"]["tokens_per_second"] = generated / generation_time if generation_time > 0 else 0.0
+            return results
+        except Exception as e:
+            print("LLama generator error:", e)
+            return [None] * len(prompts)
+
+    return llama_query_fn, llama_batch_query_fn
+
+def llama_run_settings() -> Dict[str, Any]:
+    return {
+        "model": LLAMA_CONFIG["MODEL_NAME"],
+        "prompt_config": read_prompt_config(),
+        "sampling": {
+            "temperature": LLAMA_CONFIG["TEMPERATURE"],
+            "max_tokens": LLAMA_CONFIG["MAX_TOKENS"],
+            "stop_at_json_end": LLAMA_CONFIG["STOP_AT_JSON_END"],
+            "constrained_json": LLAMA_CONFIG["CONSTRAINED_JSON"],
+        },
+    }
+
+def make_oracle() -> Oracle:
+    model, tokenizer = load_model_and_tokenizer()
+    draft_model, draft_tokenizer = load_draft_model()
+    llama_query_fn, llama_batch_query_fn = make_llama_query_fns(
+        model, tokenizer, draft_model=draft_model, draft_tokenizer=draft_tokenizer
+    )
+
+    cache = open_response_cache()
+    run_settings = llama_run_settings()
+    return Oracle(
+        name=LLAMA_CONFIG["MODEL_NAME"],
+        query_fn=cache.wrap(llama_query_fn, **run_settings),
+        make_prompt_fn=make_prompt_fn,
+        batch_query_fn=cache.wrap_batch(llama_batch_query_fn, **run_settings),
+        run_settings=run_settings,
+        batch_size=LLAMA_CONFIG["BATCH_SIZE"],
+        length_fn=lambda prompt: len(tokenizer(prompt)["input_ids"]),
+        max_length_ratio=LLAMA_CONFIG["BATCH_MAX_LENGTH_RATIO"],
+        count_tokens_fn=lambda text: len(tokenizer(text, add_special_tokens=False)["input_ids"]),
+        cache=cache
+    )
+
+def main(argv=None):
+    print("Starting Llama oracle with argv:", argv)
+
+    oracle = make_oracle()
+    oracle.run()
+    oracle.print_summary()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional, Dict, Any, Awaitable, List
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from oracle.models.oracle_config import PROMPT_CONFIG_FILE, OLLAMA_CONFIG, ROOT_DIR, CONCURRENCY, \
+    CONCURRENCY_CONFIGURED
+from oracle.models.response_cache import open_response_cache
+from oracle.models.rate_limiter import RateLimiter, query_with_limits
+from oracle.models.shared import Oracle, clean_json
+from shared.parser import read_txt_file
+
+"""
+    The Ollama servers to send the prompts to, one pooled HTTP session per server
+    Every query goes to the server with the fewest requests in flight (round robin between equally busy ones), so the
+    input files are spread across all servers when the oracle runs with concurrency.
+"""
+class EndpointPool:
+
+    def __init__(self, endpoints: List[str], parallel_per_endpoint: int = 1):
+        if not endpoints:
+            raise ValueError("At least one Ollama endpoint is needed, set ORACLE_OLLAMA_ENDPOINTS")
+        self.endpoints = endpoints
+        self.sessions: Dict[str, requests.Session] = {}
+        for endpoint in endpoints:
+            session = requests.Session()
+            session.mount(endpoint, HTTPAdapter(pool_connections=1, pool_maxsize=max(1, parallel_per_endpoint)))
+            self.sessions[endpoint] = session
+        self.in_flight: Dict[str, int] = {endpoint: 0 for endpoint in endpoints}
+        self.next_index = 0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> str:
+        with self.lock:
+            order = self.endpoints[self.next_index:] + self.endpoints[:self.next_index]
+            endpoint = min(order, key=lambda e: self.in_flight[e])
+            self.in_flight[endpoint] += 1
+            self.next_index = (self.endpoints.index(endpoint) + 1) % len(self.endpoints)
+            return endpoint
+
+    def release(self, endpoint: str) -> None:
+        with self.lock:
+            self.in_flight[endpoint] -= 1
+
+pool = EndpointPool(OLLAMA_CONFIG["ENDPOINTS"], OLLAMA_CONFIG["PARALLEL_PER_ENDPOINT"])
+# Ollama has no rate limits, the limiter is only there for the shared retry loop
+limiter = RateLimiter()
+
+def make_ollama_query(
+    model: str = OLLAMA_CONFIG["MODEL_NAME"],
+    temperature: float = OLLAMA_CONFIG["TEMPERATURE"],
+    retries: int = OLLAMA_CONFIG["MAX_RETRIES"],
+) -> Callable[[str], Optional[Dict[str, Any]]]:
+    config = read_prompt_config()
+
+    def query_fn(prompt_text: str) -> Optional[Dict[str, Any]]:
+        request = make_request(config, prompt_text, model, temperature)
+        return query_with_limits(lambda: send_request(request), limiter, f"{config}\n{prompt_text}", retries, "Ollama oracle")
+    return query_fn
+
+def make_ollama_async_query(
+    model: str = OLLAMA_CONFIG["MODEL_NAME"],
+    temperature: float = OLLAMA_CONFIG["TEMPERATURE"],
+    retries: int = OLLAMA_CONFIG["MAX_RETRIES"],
+) -> Callable[[str], Awaitable[Optional[Dict[str, Any]]]]:
+    query_fn = make_ollama_query(model, temperature, retries)
+
+    async def async_query_fn(prompt_text: str) -> Optional[Dict[str, Any]]:
+        # The streamed response is read in a worker thread, the pool decides which server gets the request
+        return await asyncio.to_thread(query_fn, prompt_text)
+    return async_query_fn
+
+def read_prompt_config() -> str:
+    if ROOT_DIR and ROOT_DIR != "NONE":
+        root = Path(ROOT_DIR)
+    else:
+        root = Path(__file__).resolve().parents[3]
+    prompt_config_path = root / PROMPT_CONFIG_FILE
+    return read_txt_file(prompt_config_path)
+
+def make_request(config: str, prompt_text: str, model: str, temperature: float) -> Dict[str, Any]:
+    return {
+        "model": model,
+        "messages": [
+            {
+                "role": "system",
+                "content": config
+            },
+            {
+                "role": "user",
+                "content": prompt_text,
+            }
+        ],
+        "stream": True,
+        "keep_alive": OLLAMA_CONFIG["KEEP_ALIVE"],
+        "options": {
+            "temperature": temperature,
+            "num_predict": OLLAMA_CONFIG["MAX_TOKENS"],
+            "num_ctx": OLLAMA_CONFIG["CONTEXT_LENGTH"],
+        },
+    }
+
+def send_request(request: Dict[str, Any]) -> Dict[str, Any]:
+    endpoint = pool.acquire()
+    try:
+        start = time.perf_counter()
+        with pool.sessions[endpoint].post(
+            f"{endpoint}/api/chat", json=request, stream=True, timeout=OLLAMA_CONFIG["TIMEOUT"]
+        ) as response:
+            response.raise_for_status()
+            return parse_stream(response.iter_lines(), start, endpoint)
+    finally:
+        pool.release(endpoint)
+
+def parse_stream(lines, start: float, endpoint: str) -> Dict[str, Any]:
+    # Ollama streams one JSON object per line, the last one (done) holds the token counts and durations
+    parts: List[str] = []
+    first_token_time: Optional[float] = None
+    final: Dict[str, Any] = {}
+    for line in lines:
+        if not line:
+            continue
+        chunk = json.loads(line)
+        if "error" in chunk:
+            raise RuntimeError(f"Ollama error from {endpoint}: {chunk['error']}")
+        content = chunk.get("message", {}).get("content", "")
+        if content:
+            if first_token_time is None:
+                first_token_time = time.perf_counter() - start
+            parts.append(content)
+        if chunk.get("done"):
+            final = chunk
+            break
+    if not final:
+        raise RuntimeError(f"The response stream from {endpoint} ended before the generation was done")
+    return parse_response("".join(parts), final, first_token_time, endpoint)
+
+def parse_response(message_text: str, final: Dict[str, Any], first_token_time: Optional[float], endpoint: str) -> Dict[str, Any]:
+    input_tokens = final.get("prompt_eval_count", 0)
+    output_tokens = final.get("eval_count", 0)
+    # Ollama reports durations in nanoseconds
+    eval_duration = final.get("eval_duration", 0) / 1e9
+    metadata = {
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "total_tokens": input_tokens + output_tokens,
+        "model": final.get("model"),
+        "endpoint": endpoint,
+        "time_to_first_token": first_token_time,
+        "load_duration": final.get("load_duration", 0) / 1e9,
+        "prompt_eval_duration": final.get("prompt_eval_duration", 0) / 1e9,
+        "eval_duration": eval_duration,
+        "tokens_per_second": output_tokens / eval_duration if eval_duration > 0 else 0.0,
+        "done_reason": final.get("done_reason"),
+    }
+
+    return {
+        "message": clean_json(message_text),
+        "metadata": metadata
+    }
+
+def make_prompt_fn(text: str) -> str:
+    return text
+
+def make_oracle() -> Oracle:
+    cache = open_response_cache()
+    run_settings = {
+        "model": OLLAMA_CONFIG["MODEL_NAME"],
+        "prompt_config": read_prompt_config(),
+        "sampling": {
+            "temperature": OLLAMA_CONFIG["TEMPERATURE"],
+            "max_tokens": OLLAMA_CONFIG["MAX_TOKENS"],
+            "context_length": OLLAMA_CONFIG["CONTEXT_LENGTH"],
+        },
+    }
+    return Oracle(
+        name=OLLAMA_CONFIG["MODEL_NAME"],
+        query_fn=cache.wrap(make_ollama_query(), **run_settings),
+        make_prompt_fn=make_prompt_fn,
+        async_query_fn=cache.wrap_async(make_ollama_async_query(), **run_settings),
+        run_settings=run_settings,
+        # Without ORACLE_CONCURRENCY every server gets as many files at once as it generates in parallel
+        concurrency=CONCURRENCY if CONCURRENCY_CONFIGURED else len(pool.endpoints) * OLLAMA_CONFIG["PARALLEL_PER_ENDPOINT"],
+        cache=cache
+    )
+
+def main(argv=None):
+    print("Starting Ollama oracle with argv:", argv)
+
+    oracle = make_oracle()
+    oracle.run()
+    oracle.print_summary()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import json
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, Optional
+
+from oracle.models.oracle_config import INPUT_DIR, OUTPUT_DIR, USE_INPUT_DIR, SERVER_URL, SERVER_POLL_INTERVAL
+from oracle.models.shared import resolve_root
+
+"""
+    Submits jobs to a running oracle server (python -m oracle serve -m <model>) instead of loading a model
+    With USE_INPUT_DIR the whole INPUT_DIR is one job, the server writes the outputs to OUTPUT_DIR. Otherwise every
+    entered text is sent as its own job. Both directories are sent as absolute paths, so the server and the client
+    have to share the file system.
+"""
+def request_json(url: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(f"Oracle server returned {e.code}: {e.read().decode('utf-8', 'replace')}") from e
+
+def submit_job(server_url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    return request_json(f"{server_url.rstrip('/')}/jobs", payload)
+
+def wait_for_job(server_url: str, job_id: str, poll_interval: float = SERVER_POLL_INTERVAL) -> Dict[str, Any]:
+    last_position = None
+    while True:
+        job = request_json(f"{server_url.rstrip('/')}/jobs/{job_id}")
+        if job["status"] in ("done", "failed"):
+            return job
+        if job.get("queue_position") is not None and job["queue_position"] != last_position:
+            last_position = job["queue_position"]
+            print(f"  Waiting for {last_position} jobs ahead in the queue...")
+        time.sleep(poll_interval)
+
+def run_job(server_url: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    job = wait_for_job(server_url, submit_job(server_url, payload)["job_id"])
+    if job["status"] == "failed":
+        print(f"Job {job['job_id']} failed with error: {job['error']}")
+        return None
+    return job["result"]
+
+def submit_directory(server_url: str, input_dir: str = INPUT_DIR, output_dir: str = OUTPUT_DIR) -> None:
+    root = resolve_root()
+    payload = {"input_dir": str((root / input_dir).resolve()), "output_dir": str((root / output_dir).resolve())}
+    print(f"Submitting {payload['input_dir']} to the oracle server at {server_url}...")
+    result = run_job(server_url, payload)
+    if result is not None:
+        counts = ", ".join(f"{count} {status}" for status, count in sorted(result["files"].items()))
+        print(f"Outputs written to {payload['output_dir']} ({counts or 'no files'})")
+
+def submit_interactive(server_url: str) -> None:
+    while True:
+        print("Enter text to analyze (or 'exit' to quit):\n")
+        user_input = input("> ")
+        if user_input.lower() in ["exit", "quit"]:
+            break
+
+        print("\nPrompting...\n")
+        try:
+            result = run_job(server_url, {"text": user_input})
+        except Exception as e:
+            print("Prompting failed with error:", e)
+            continue
+        if result is None:
+            continue
+
+        print("\n=== Extracted AIF graph ===\n")
+        print(json.dumps(result["aif"], indent=2, ensure_ascii=False))
+        print("\n----------------------------------------\n")
+
+def main(argv=None, server_url: str = SERVER_URL, model: Optional[str] = None):
+    print("Starting the oracle client with argv:", argv)
+    try:
+        health = request_json(f"{server_url.rstrip('/')}/health")
+    except Exception as e:
+        print(f"No oracle server reachable at {server_url}: {e}")
+        return
+    if model is not None and health.get("model_key") != model:
+        print(f"The oracle server at {server_url} serves {health.get('model_key') or health['model']}, not {model}, "
+              f"start it with `python -m oracle serve -m {model}`")
+        return
+    print(f"Connected to the oracle server for {health['model']} ({health['queued']} jobs queued)")
+
+    if USE_INPUT_DIR:
+        submit_directory(server_url)
+    else:
+        submit_interactive(server_url)
+    print("Exiting...")
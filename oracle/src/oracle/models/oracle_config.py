@@ -17,13 +17,47 @@ OUTPUT_DIR = Path(os.getenv("ORACLE_OUTPUT_DIR", "resources/output"))
 
 PRINT_MODEL_INPUT_AND_OUTPUT_FOR_DEBUG = env_bool("ORACLE_PRINT_MODEL_INPUT_AND_OUTPUT_FOR_DEBUG",False)
 USE_GPU = env_bool("ORACLE_USE_GPU", True)
+CONCURRENCY = int(os.getenv("ORACLE_CONCURRENCY", 1)) # Concurrent queries for the API oracles, 1 = one file at a time
+CONCURRENCY_CONFIGURED = os.getenv("ORACLE_CONCURRENCY") is not None # oracles with their own default keep it otherwise
+BACKOFF_BASE = float(os.getenv("ORACLE_BACKOFF_BASE", 1.0)) # Seconds, doubled on every retry of a failed query
+BACKOFF_MAX = float(os.getenv("ORACLE_BACKOFF_MAX", 60.0))
+RESUME = env_bool("ORACLE_RESUME", True) # skip input files whose output in the manifest is up to date
+MANIFEST_FILE = os.getenv("ORACLE_MANIFEST_FILE", "manifest.json") # written to OUTPUT_DIR
+RESPONSE_CACHE_MODE = os.getenv("ORACLE_RESPONSE_CACHE_MODE", "use") # use = read and write, rebuild = only write, bypass = no cache
+RESPONSE_CACHE_DIR = Path(os.getenv("ORACLE_RESPONSE_CACHE_DIR", "resources/response_cache"))
+RESPONSE_CACHE_MAX_MB = float(os.getenv("ORACLE_RESPONSE_CACHE_MAX_MB", 500))
+RESPONSE_CACHE_MAX_AGE_DAYS = float(os.getenv("ORACLE_RESPONSE_CACHE_MAX_AGE_DAYS", 0)) # 0 = entries never expire
+CHUNK_MAX_TOKENS = int(os.getenv("ORACLE_CHUNK_MAX_TOKENS", 0)) # split longer inputs into windows of this many tokens, 0 = never split
+CHUNK_OVERLAP_TURNS = int(os.getenv("ORACLE_CHUNK_OVERLAP_TURNS", 1)) # turns repeated at the start of the next window
+WATCH = env_bool("ORACLE_WATCH", False) # keep watching INPUT_DIR and process new or modified transcripts as they appear
+WATCH_POLL_INTERVAL = float(os.getenv("ORACLE_WATCH_POLL_INTERVAL", 2.0)) # seconds between scans when watchdog is not installed
+WATCH_DEBOUNCE = float(os.getenv("ORACLE_WATCH_DEBOUNCE", 2.0)) # seconds a file has to stay unchanged before it is processed
+WATCH_QUEUE_SIZE = int(os.getenv("ORACLE_WATCH_QUEUE_SIZE", 20)) # files found but not yet processed, the watcher waits when it is full
+WATCH_IDLE_TIMEOUT = float(os.getenv("ORACLE_WATCH_IDLE_TIMEOUT", 0)) # stop after this many seconds without new files, 0 = never
+RUN_SUMMARY_FILE = os.getenv("ORACLE_RUN_SUMMARY_FILE", "run_summary.json") # stage times and throughput of the run, written to OUTPUT_DIR
+METRICS_FILE = os.getenv("ORACLE_METRICS_FILE", "") # Prometheus textfile, e.g. /var/lib/node_exporter/textfile/oracle.prom, "" = off
+ANALYSE_WORKERS = int(os.getenv("ORACLE_ANALYSE_WORKERS", os.cpu_count() or 1)) # processes reading the metadata files of `oracle analyse`
+ANALYSE_RELATIVE_ACCURACY = float(os.getenv("ORACLE_ANALYSE_RELATIVE_ACCURACY", 0.01)) # max relative error of the reported percentiles
+SERVER_HOST = os.getenv("ORACLE_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("ORACLE_SERVER_PORT", 8765))
+SERVER_URL = os.getenv("ORACLE_SERVER_URL", "") # e.g. http://127.0.0.1:8765, "" = run the model in the CLI process
+SERVER_QUEUE_SIZE = int(os.getenv("ORACLE_SERVER_QUEUE_SIZE", 100)) # jobs waiting for the model, more are rejected
+SERVER_POLL_INTERVAL = float(os.getenv("ORACLE_SERVER_POLL_INTERVAL", 2.0)) # seconds between job status requests of the client
 
 # Specific config parameters
 
 LLAMA_CONFIG = {
     "MODEL_NAME": os.getenv("ORACLE_LLAMA_MODEL_NAME", "meta-llama/Llama-3.1-70B-Instruct"),
     "MAX_TOKENS": int(os.getenv("ORACLE_LLAMA_MAX_TOKENS", 32000)),
-    "TEMPERATURE": float(os.getenv("ORACLE_LLAMA_TEMPERATURE", 0.5))
+    "TEMPERATURE": float(os.getenv("ORACLE_LLAMA_TEMPERATURE", 0.5)),
+    "BATCH_SIZE": int(os.getenv("ORACLE_LLAMA_BATCH_SIZE", 1)), # 1 = one prompt per generate call
+    "BATCH_MAX_LENGTH_RATIO": float(os.getenv("ORACLE_LLAMA_BATCH_MAX_LENGTH_RATIO", 1.5)), # longest / shortest prompt of a batch, 0 = no limit
+    "PREFIX_CACHE": env_bool("ORACLE_LLAMA_PREFIX_CACHE", True), # prefill the prompt config once and reuse its KV cache
+    "STOP_AT_JSON_END": env_bool("ORACLE_LLAMA_STOP_AT_JSON_END", True), # stop generating once a complete JSON object is out
+    "JSON_REQUIRED_KEYS": [k.strip() for k in os.getenv("ORACLE_LLAMA_JSON_REQUIRED_KEYS", "nodes,edges").split(",") if k.strip()],
+    "CONSTRAINED_JSON": env_bool("ORACLE_LLAMA_CONSTRAINED_JSON", False), # only allow tokens that keep the output valid AIF JSON
+    "DRAFT_MODEL_NAME": os.getenv("ORACLE_LLAMA_DRAFT_MODEL_NAME", ""), # small model for assisted generation, "" = disabled
+    "DRAFT_TOKENS": int(os.getenv("ORACLE_LLAMA_DRAFT_TOKENS", 5)) # tokens drafted per step, adapted during generation
 }
 
 GPT_CONFIG = {
@@ -32,11 +66,31 @@ GPT_CONFIG = {
     "TEMPERATURE": float(os.getenv("ORACLE_GPT_TEMPERATURE", 0.3)),
     "PROMPT_ID": os.getenv("ORACLE_GPT_PROMPT_ID", "pmpt_6939bb21e7d881908d12e8f5363c41cf0e8623fe874c1b4d"),
     "PROMPT_VERSION": os.getenv("ORACLE_GPT_PROMPT_VERSION", "2"),
-    "USE_PROMPT": env_bool("ORACLE_GPT_USE_PROMPT", True)
+    "USE_PROMPT": env_bool("ORACLE_GPT_USE_PROMPT", True),
+    "BASE_URL": os.getenv("ORACLE_GPT_BASE_URL"), # None = the default OpenAI endpoint
+    "REQUESTS_PER_MINUTE": int(os.getenv("ORACLE_GPT_REQUESTS_PER_MINUTE", 0)), # 0 = no limit
+    "TOKENS_PER_MINUTE": int(os.getenv("ORACLE_GPT_TOKENS_PER_MINUTE", 0)), # 0 = no limit
+    "MAX_RETRIES": int(os.getenv("ORACLE_GPT_MAX_RETRIES", 6))
 }
 
 UVA_CONFIG = {
     "MODEL_NAME": os.getenv("ORACLE_UVA_MODEL_NAME", "gpt-5.1"),
     "MAX_TOKENS": int(os.getenv("ORACLE_UVA_MAX_TOKENS", 4096)),
-    "TEMPERATURE": float(os.getenv("ORACLE_UVA_TEMPERATURE", 0.3))
+    "TEMPERATURE": float(os.getenv("ORACLE_UVA_TEMPERATURE", 0.3)),
+    "BASE_URL": os.getenv("ORACLE_UVA_BASE_URL", "https://ai-research-proxy.azurewebsites.net"),
+    "REQUESTS_PER_MINUTE": int(os.getenv("ORACLE_UVA_REQUESTS_PER_MINUTE", 0)), # 0 = no limit
+    "TOKENS_PER_MINUTE": int(os.getenv("ORACLE_UVA_TOKENS_PER_MINUTE", 0)), # 0 = no limit
+    "MAX_RETRIES": int(os.getenv("ORACLE_UVA_MAX_RETRIES", 6))
+}
+
+OLLAMA_CONFIG = {
+    "MODEL_NAME": os.getenv("ORACLE_OLLAMA_MODEL_NAME", "llama3.1:70b"),
+    "ENDPOINTS": [e.strip().rstrip("/") for e in os.getenv("ORACLE_OLLAMA_ENDPOINTS", "http://localhost:11434").split(",") if e.strip()],
+    "MAX_TOKENS": int(os.getenv("ORACLE_OLLAMA_MAX_TOKENS", 8192)),
+    "CONTEXT_LENGTH": int(os.getenv("ORACLE_OLLAMA_CONTEXT_LENGTH", 32768)), # Ollama cuts longer prompts, its own default is small
+    "TEMPERATURE": float(os.getenv("ORACLE_OLLAMA_TEMPERATURE", 0.5)),
+    "PARALLEL_PER_ENDPOINT": int(os.getenv("ORACLE_OLLAMA_PARALLEL_PER_ENDPOINT", 1)), # match OLLAMA_NUM_PARALLEL of the servers
+    "KEEP_ALIVE": os.getenv("ORACLE_OLLAMA_KEEP_ALIVE", "30m"), # how long the servers keep the model loaded after a request
+    "TIMEOUT": float(os.getenv("ORACLE_OLLAMA_TIMEOUT", 600)), # seconds without a streamed chunk before a request fails
+    "MAX_RETRIES": int(os.getenv("ORACLE_OLLAMA_MAX_RETRIES", 3))
 }
@@ -0,0 +1,178 @@
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+from oracle.models.oracle_config import SERVER_HOST, SERVER_PORT, SERVER_QUEUE_SIZE, MANIFEST_FILE
+from oracle.models.run_manifest import RunManifest
+from oracle.models.shared import Oracle, resolve_root
+from shared.parser import extract_last_json
+
+JOB_STATUS_QUEUED = "queued"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_DONE = "done"
+JOB_STATUS_FAILED = "failed"
+
+JOB_KIND_TEXT = "text"
+JOB_KIND_DIRECTORY = "directory"
+
+@dataclass
+class OracleJob:
+    job_id: str
+    kind: str
+    payload: Dict[str, Any]
+    status: str = JOB_STATUS_QUEUED
+    submitted: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+"""
+    Keeps one loaded oracle and runs the jobs submitted over HTTP one after another
+    POST /jobs with {"text": ...} extracts the AIF graph of one text, with {"input_dir": ..., "output_dir": ...} it runs
+    the oracle over a directory exactly like `python -m oracle model` (relative directories are resolved against the
+    root of the server). The response holds the job id, GET /jobs/<id> returns the status and, once done, the result.
+    A single worker thread owns the model, so the jobs never run concurrently. When SERVER_QUEUE_SIZE jobs are waiting
+    new jobs are rejected with 503. GET /health returns the served model, `model_key` is its name in the ORACLE_MAP of
+    the command line, which lets clients check that they submit to the model they asked for.
+"""
+class OracleServer:
+
+    def __init__(
+        self,
+        oracle: Oracle,
+        model_key: Optional[str] = None,
+        host: str = SERVER_HOST,
+        port: int = SERVER_PORT,
+        queue_size: int = SERVER_QUEUE_SIZE
+    ):
+        self.oracle = oracle
+        self.model_key = model_key
+        self.jobs: Dict[str, OracleJob] = {}
+        self.queue: "queue.Queue[OracleJob]" = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+        self.worker = threading.Thread(target=self.work, daemon=True)
+
+    @property
+    def address(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def submit(self, payload: Dict[str, Any]) -> OracleJob:
+        if isinstance(payload.get("text"), str):
+            kind = JOB_KIND_TEXT
+        elif payload.get("input_dir") and payload.get("output_dir"):
+            kind = JOB_KIND_DIRECTORY
+        else:
+            raise ValueError("A job needs either `text` or both `input_dir` and `output_dir`")
+        job = OracleJob(job_id=uuid.uuid4().hex, kind=kind, payload=payload)
+        self.queue.put_nowait(job)
+        with self.lock:
+            self.jobs[job.job_id] = job
+        return job
+
+    def work(self) -> None:
+        while True:
+            job = self.queue.get()
+            job.status = JOB_STATUS_RUNNING
+            job.started = time.time()
+            print(f"Running {job.kind} job {job.job_id}")
+            try:
+                job.result = self.run_text(job.payload) if job.kind == JOB_KIND_TEXT else self.run_directory(job.payload)
+                job.status = JOB_STATUS_DONE
+            except Exception as e:
+                print(f"Job {job.job_id} failed with error: {e}")
+                job.error = str(e)
+                job.status = JOB_STATUS_FAILED
+            job.finished = time.time()
+            print(f"Finished job {job.job_id} ({job.status}) in {job.finished - job.started:.2f} s")
+            self.queue.task_done()
+
+    def run_text(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        output = self.oracle.query_text(payload["text"])
+        if output is None:
+            raise RuntimeError("No response returned")
+        return {
+            "aif": extract_last_json(output.get("message", "")),
+            "metadata": {"elapsed_time": time.perf_counter() - start, **(output.get("metadata") or {})},
+        }
+
+    def run_directory(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        # A job has to finish, so the directory is processed once also when ORACLE_WATCH is set
+        self.oracle.run(payload["input_dir"], payload["output_dir"], use_input_dir=True, watch=False)
+        manifest = RunManifest.load(resolve_root() / payload["output_dir"] / MANIFEST_FILE)
+        return {"files": dict(Counter(entry.get("status") for entry in manifest.entries.values()))}
+
+    def queue_position(self, job: OracleJob) -> Optional[int]:
+        if job.status != JOB_STATUS_QUEUED:
+            return None
+        with self.queue.mutex:
+            waiting = list(self.queue.queue)
+        return waiting.index(job) if job in waiting else None
+
+    def describe(self, job: OracleJob) -> Dict[str, Any]:
+        return {**asdict(job), "queue_position": self.queue_position(job)}
+
+    def make_handler(self):
+        server = self
+
+        class OracleRequestHandler(BaseHTTPRequestHandler):
+
+            def send_json(self, status: int, body: Dict[str, Any]) -> None:
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/health":
+                    return self.send_json(200, {
+                        "model": server.oracle.name, "model_key": server.model_key, "queued": server.queue.qsize()
+                    })
+                if self.path.startswith("/jobs/"):
+                    with server.lock:
+                        job = server.jobs.get(self.path[len("/jobs/"):])
+                    if job is None:
+                        return self.send_json(404, {"error": "Unknown job"})
+                    return self.send_json(200, server.describe(job))
+                return self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+            def do_POST(self):
+                if self.path != "/jobs":
+                    return self.send_json(404, {"error": f"Unknown path {self.path}"})
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                    job = server.submit(payload)
+                except (ValueError, AttributeError) as e:
+                    return self.send_json(400, {"error": str(e)})
+                except queue.Full:
+                    return self.send_json(503, {"error": "The job queue is full, try again later"})
+                return self.send_json(202, server.describe(job))
+
+            def log_message(self, format, *args):
+                pass
+
+        return OracleRequestHandler
+
+    def serve_forever(self) -> None:
+        self.worker.start()
+        print(f"Oracle server for {self.oracle.name} listening on {self.address}")
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.httpd.server_close()
+            self.oracle.print_summary()
+            print("Exiting...")
@@ -0,0 +1,174 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from oracle.models.oracle_config import BACKOFF_BASE, BACKOFF_MAX
+
+"""
+    Requests-per-minute and tokens-per-minute budget shared by all queries of an API oracle
+    Every query reserves one request and its estimated tokens before it is sent and sleeps until the budget allows it.
+    The estimate (prompt characters per token and the average completion length) is learned from the `usage` numbers
+    of the responses, and the token bucket is corrected by the difference between the estimate and the actual usage.
+    Failed queries are retried with jittered exponential backoff. A retry-after hint from the server pauses all queries
+    of the limiter, not only the one that got it.
+"""
+CHARS_PER_TOKEN = 4.0
+LEARNING_RATE = 0.2
+NON_RETRYABLE_STATUS = {400, 401, 403, 404, 422}
+
+class TokenBucket:
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        # Takes `amount` right away (the level may go negative) and returns how long to wait before using it
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= amount
+        return -self.level / self.rate if self.level < 0 else 0.0
+
+    def adjust(self, amount: float) -> None:
+        self.level = min(self.capacity, self.level - amount)
+
+class RateLimiter:
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.chars_per_token = CHARS_PER_TOKEN
+        self.output_tokens = 0.0
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def estimate_tokens(self, text: str) -> int:
+        return int(len(text) / self.chars_per_token + self.output_tokens) + 1
+
+    def reserve(self, estimated: int) -> float:
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.paused_until - now)
+            if self.requests is not None:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.reserve(estimated, now))
+            return wait
+
+    def record_usage(self, text: str, estimated: int, metadata: Optional[Dict[str, Any]]) -> None:
+        if not metadata:
+            return
+        input_tokens = metadata.get("input_tokens") or 0
+        output_tokens = metadata.get("output_tokens") or 0
+        total_tokens = metadata.get("total_tokens") or input_tokens + output_tokens
+        with self.lock:
+            if input_tokens > 0 and text:
+                observed = len(text) / input_tokens
+                self.chars_per_token += LEARNING_RATE * (observed - self.chars_per_token)
+            self.output_tokens += LEARNING_RATE * (output_tokens - self.output_tokens)
+            if self.tokens is not None:
+                self.tokens.adjust(total_tokens - estimated)
+
+    def refund(self, estimated: int) -> None:
+        # A rejected query did not use its tokens, the request itself still counts
+        with self.lock:
+            if self.tokens is not None:
+                self.tokens.adjust(-estimated)
+
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+def error_status(error: Exception) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+def retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after") is not None:
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        # HTTP-date values are not worth parsing, the backoff covers them
+        pass
+    return None
+
+def retry_delay(limiter: RateLimiter, error: Exception, attempt: int, retries: int) -> Optional[float]:
+    # Returns how long to wait before the next attempt, None when the query should not be retried
+    if attempt > retries or error_status(error) in NON_RETRYABLE_STATUS:
+        return None
+
+    hint = retry_after(error)
+    if hint is not None:
+        delay = hint + random.uniform(0, BACKOFF_BASE)
+        limiter.pause(delay)
+        return delay
+
+    backoff = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    return backoff / 2 + random.uniform(0, backoff / 2)
+
+def query_with_limits(
+    send: Callable[[], Dict[str, Any]],
+    limiter: RateLimiter,
+    text: str,
+    retries: int,
+    label: str
+) -> Optional[Dict[str, Any]]:
+    attempt = 0
+    while True:
+        estimated = limiter.estimate_tokens(text)
+        wait = limiter.reserve(estimated)
+        if wait > 0:
+            time.sleep(wait)
+        try:
+            result = send()
+            limiter.record_usage(text, estimated, result.get("metadata"))
+            return result
+        except Exception as e:
+            print(e)
+            limiter.refund(estimated)
+            attempt += 1
+            delay = retry_delay(limiter, e, attempt, retries)
+            if delay is None:
+                print(f"{label} error:", e)
+                return None
+            print(f"Retrying in {delay:.1f}s (attempt {attempt}/{retries})")
+            time.sleep(delay)
+
+async def query_with_limits_async(
+    send: Callable[[], Awaitable[Dict[str, Any]]],
+    limiter: RateLimiter,
+    text: str,
+    retries: int,
+    label: str
+) -> Optional[Dict[str, Any]]:
+    attempt = 0
+    while True:
+        estimated = limiter.estimate_tokens(text)
+        wait = limiter.reserve(estimated)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            result = await send()
+            limiter.record_usage(text, estimated, result.get("metadata"))
+            return result
+        except Exception as e:
+            print(e)
+            limiter.refund(estimated)
+            attempt += 1
+            delay = retry_delay(limiter, e, attempt, retries)
+            if delay is None:
+                print(f"{label} error:", e)
+                return None
+            print(f"Retrying in {delay:.1f}s (attempt {attempt}/{retries})")
+            await asyncio.sleep(delay)
@@ -0,0 +1,215 @@
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from oracle.models.oracle_config import RESPONSE_CACHE_MODE, RESPONSE_CACHE_DIR, RESPONSE_CACHE_MAX_MB, \
+    RESPONSE_CACHE_MAX_AGE_DAYS, ROOT_DIR
+from shared.parser import extract_last_json
+
+RESPONSE_CACHE_MODE_USE = "use"
+RESPONSE_CACHE_MODE_REBUILD = "rebuild"
+RESPONSE_CACHE_MODE_BYPASS = "bypass"
+RESPONSE_CACHE_MODES = (RESPONSE_CACHE_MODE_USE, RESPONSE_CACHE_MODE_REBUILD, RESPONSE_CACHE_MODE_BYPASS)
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def response_cache_key(model: str, prompt: str, prompt_config: str, sampling: Dict[str, Any]) -> str:
+    # `prompt_config` is whatever defines the instructions outside of the prompt, e.g. the config file or a stored prompt
+    content = json.dumps({
+        "model": model,
+        "prompt": text_hash(prompt),
+        "prompt_config": text_hash(prompt_config),
+        "sampling": sampling,
+    }, sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+"""
+    On-disk cache of oracle responses, wrapped around the query functions
+    Every response is stored in its own <key>.json file. Reading a response refreshes its modification time, entries
+    older than `max_age` seconds count as misses, and evict() removes expired entries and then the least recently used
+    ones until the cache fits into `max_bytes`. Failed queries (None) are never cached.
+    The metadata of every response gets `cache_hit` and the running `cache_hits` / `cache_misses` counters of the run.
+"""
+class ResponseCache:
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        mode: str = RESPONSE_CACHE_MODE_USE,
+        max_bytes: int = 500 * 1024 * 1024,
+        max_age: Optional[float] = None
+    ):
+        if mode not in RESPONSE_CACHE_MODES:
+            raise ValueError(f"Unknown response cache mode {mode}, expected one of {RESPONSE_CACHE_MODES}")
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != RESPONSE_CACHE_MODE_BYPASS
+
+    def path_for(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def is_expired(self, mtime: float) -> bool:
+        return self.max_age is not None and time.time() - mtime > self.max_age
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.mode != RESPONSE_CACHE_MODE_USE:
+            return None
+        path = self.path_for(key)
+        try:
+            if self.is_expired(path.stat().st_mtime):
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"  Ignoring unreadable response cache entry {path.name}: {e}")
+            return None
+
+    def put(self, key: str, output: Optional[Dict[str, Any]]) -> None:
+        if not self.enabled or output is None:
+            return
+        if set(extract_last_json(output.get("message") or "")) == {"error"}:
+            # A response without JSON is not kept, a resumed run queries the model again
+            return
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(output, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path_for(key))
+        except Exception as e:
+            print(f"  Failed to write response cache entry {key}: {e}")
+
+    def evict(self) -> int:
+        if not self.enabled or not self.cache_dir.exists():
+            return 0
+        entries = []
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for mtime, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes and not self.is_expired(mtime):
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        return evicted
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        cached = self.get(key)
+        if cached is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.annotate(copy.deepcopy(cached), True)
+
+    def store(self, key: str, output: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        self.put(key, output)
+        return self.annotate(output, False)
+
+    def annotate(self, output: Optional[Dict[str, Any]], hit: bool) -> Optional[Dict[str, Any]]:
+        if output is not None and self.enabled and output.get("metadata") is not None:
+            output["metadata"].update({"cache_hit": hit, "cache_hits": self.hits, "cache_misses": self.misses})
+        return output
+
+    def wrap(
+        self,
+        query_fn: Callable[[str], Optional[Dict[str, Any]]],
+        model: str,
+        prompt_config: str,
+        sampling: Dict[str, Any]
+    ) -> Callable[[str], Optional[Dict[str, Any]]]:
+        if not self.enabled:
+            return query_fn
+
+        def cached_query_fn(prompt_text: str) -> Optional[Dict[str, Any]]:
+            key = response_cache_key(model, prompt_text, prompt_config, sampling)
+            cached = self.lookup(key)
+            if cached is not None:
+                return cached
+            return self.store(key, query_fn(prompt_text))
+
+        return cached_query_fn
+
+    def wrap_async(
+        self,
+        async_query_fn: Callable[[str], Awaitable[Optional[Dict[str, Any]]]],
+        model: str,
+        prompt_config: str,
+        sampling: Dict[str, Any]
+    ) -> Callable[[str], Awaitable[Optional[Dict[str, Any]]]]:
+        if not self.enabled:
+            return async_query_fn
+
+        async def cached_query_fn(prompt_text: str) -> Optional[Dict[str, Any]]:
+            key = response_cache_key(model, prompt_text, prompt_config, sampling)
+            cached = self.lookup(key)
+            if cached is not None:
+                return cached
+            return self.store(key, await async_query_fn(prompt_text))
+
+        return cached_query_fn
+
+    def wrap_batch(
+        self,
+        batch_query_fn: Callable[[List[str]], List[Optional[Dict[str, Any]]]],
+        model: str,
+        prompt_config: str,
+        sampling: Dict[str, Any]
+    ) -> Callable[[List[str]], List[Optional[Dict[str, Any]]]]:
+        if not self.enabled:
+            return batch_query_fn
+
+        def cached_batch_query_fn(prompts: List[str]) -> List[Optional[Dict[str, Any]]]:
+            # Only the prompts that are not cached are sent, as one smaller batch
+            keys = [response_cache_key(model, prompt, prompt_config, sampling) for prompt in prompts]
+            outputs = [self.lookup(key) for key in keys]
+            missing = [i for i, output in enumerate(outputs) if output is None]
+            if missing:
+                fresh = batch_query_fn([prompts[i] for i in missing])
+                for i, output in zip(missing, fresh):
+                    outputs[i] = self.store(keys[i], output)
+            return outputs
+
+        return cached_batch_query_fn
+
+    def print_summary(self) -> None:
+        if self.enabled:
+            print(f"Response cache: {self.hits} hits, {self.misses} misses")
+
+def open_response_cache() -> ResponseCache:
+    if ROOT_DIR and ROOT_DIR != "NONE":
+        root = Path(ROOT_DIR)
+    else:
+        root = Path(__file__).resolve().parents[3]
+    max_age = RESPONSE_CACHE_MAX_AGE_DAYS * 24 * 3600 if RESPONSE_CACHE_MAX_AGE_DAYS > 0 else None
+    cache = ResponseCache(root / RESPONSE_CACHE_DIR, RESPONSE_CACHE_MODE, int(RESPONSE_CACHE_MAX_MB * 1024 * 1024), max_age)
+    evicted = cache.evict()
+    if evicted:
+        print(f"Evicted {evicted} entries from the response cache")
+    return cache
@@ -1,53 +1,259 @@
+import argparse
+import json
+import math
 import os
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-from oracle.models.oracle_config import OUTPUT_DIR, ROOT_DIR
+from oracle.models.oracle_config import OUTPUT_DIR, ROOT_DIR, MANIFEST_FILE, ANALYSE_WORKERS, ANALYSE_RELATIVE_ACCURACY, \
+    ORACLE_FILE_POSTFIX, METADATA_FILE_POSTFIX
 from shared.parser import write_json_file, read_json_file
 
-def analyze_metadata_files():
-    sums = defaultdict(float)
-    counts = defaultdict(int)
+PERCENTILES = (50, 95, 99)
+# Files per task of the parallel scan, large enough that the merging costs nothing next to the parsing
+SCAN_CHUNK_SIZE = 500
 
+"""
+    Mergeable quantile sketch with a relative error guarantee (the DDSketch bucketing)
+    Every value goes into the bucket ceil(log_gamma(|value|)), so a quantile is off by at most `relative_accuracy` of its
+    value, whatever the distribution. The buckets of two sketches with the same accuracy simply add up, which lets the
+    files be aggregated in parallel and the results of several output directories be merged. The memory grows with the
+    logarithm of the value range, not with the number of values.
+"""
+class QuantileSketch:
+
+    def __init__(self, relative_accuracy: float = ANALYSE_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive: Dict[int, int] = defaultdict(int)
+        self.negative: Dict[int, int] = defaultdict(int)
+        self.zero = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def bucket(self, value: float) -> int:
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def value_of(self, bucket: int) -> float:
+        return 2 * self.gamma ** bucket / (self.gamma + 1)
+
+    def add(self, value: float) -> None:
+        if value > 0:
+            self.positive[self.bucket(value)] += 1
+        elif value < 0:
+            self.negative[self.bucket(-value)] += 1
+        else:
+            self.zero += 1
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "QuantileSketch") -> None:
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Only sketches with the same relative accuracy can be merged")
+        for bucket, count in other.positive.items():
+            self.positive[bucket] += count
+        for bucket, count in other.negative.items():
+            self.negative[bucket] += count
+        self.zero += other.zero
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def buckets_in_order(self) -> Iterator[Tuple[float, int]]:
+        for bucket in sorted(self.negative, reverse=True):
+            yield -self.value_of(bucket), self.negative[bucket]
+        if self.zero:
+            yield 0.0, self.zero
+        for bucket in sorted(self.positive):
+            yield self.value_of(bucket), self.positive[bucket]
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for value, count in self.buckets_in_order():
+            seen += count
+            if seen > rank:
+                return min(max(value, self.min), self.max)
+        return self.max
+
+"""
+    Streaming statistics of the numeric metadata fields of a group of files
+    Keeps the sums and counts (for the sums and averages of the old analysis) and a QuantileSketch per field. Nested
+    objects such as `stage_times` are flattened to `stage_times.query` etc. Booleans are summed but have no percentiles.
+"""
+class MetadataAggregator:
+
+    def __init__(self, relative_accuracy: float = ANALYSE_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.files = 0
+        self.sums: Dict[str, float] = defaultdict(float)
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.sketches: Dict[str, QuantileSketch] = {}
+
+    def add(self, metadata: Dict[str, Any], prefix: str = "") -> None:
+        if not prefix:
+            self.files += 1
+        for key, value in metadata.items():
+            if key == "model":
+                continue
+            name = f"{prefix}{key}"
+            if isinstance(value, dict):
+                self.add(value, f"{name}.")
+            elif isinstance(value, (int, float)) and not (isinstance(value, float) and math.isnan(value)):
+                self.sums[name] += value
+                self.counts[name] += 1
+                if not isinstance(value, bool):
+                    if name not in self.sketches:
+                        self.sketches[name] = QuantileSketch(self.relative_accuracy)
+                    self.sketches[name].add(value)
+
+    def merge(self, other: "MetadataAggregator") -> None:
+        self.files += other.files
+        for name, value in other.sums.items():
+            self.sums[name] += value
+        for name, count in other.counts.items():
+            self.counts[name] += count
+        for name, sketch in other.sketches.items():
+            if name in self.sketches:
+                self.sketches[name].merge(sketch)
+            else:
+                self.sketches[name] = sketch
+
+    def percentiles(self) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for name, sketch in sorted(self.sketches.items()):
+            result[name] = {f"p{p}": sketch.quantile(p / 100) for p in PERCENTILES}
+            result[name].update({"min": sketch.min, "max": sketch.max, "count": sketch.count})
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "sums": dict(self.sums),
+            "averages": {name: self.sums[name] / self.counts[name] for name in self.sums},
+            "percentiles": self.percentiles(),
+            "files_analysed": self.files,
+        }
+
+"""
+    One MetadataAggregator for all files and one per group of (model, prompt config)
+    The model comes from the metadata, the prompt config hash from the run manifest of the output directory.
+"""
+class GroupedAggregator:
+
+    def __init__(self, relative_accuracy: float = ANALYSE_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.overall = MetadataAggregator(relative_accuracy)
+        self.groups: Dict[Tuple[str, str], MetadataAggregator] = {}
+
+    def add(self, metadata: Dict[str, Any], prompt_config_hash: str) -> None:
+        self.overall.add(metadata)
+        key = (str(metadata.get("model") or "unknown"), prompt_config_hash)
+        if key not in self.groups:
+            self.groups[key] = MetadataAggregator(self.relative_accuracy)
+        self.groups[key].add(metadata)
+
+    def merge(self, other: "GroupedAggregator") -> None:
+        self.overall.merge(other.overall)
+        for key, aggregator in other.groups.items():
+            if key in self.groups:
+                self.groups[key].merge(aggregator)
+            else:
+                self.groups[key] = aggregator
+
+def resolve_output_dir(output_dir: str) -> Path:
     if ROOT_DIR and ROOT_DIR != "NONE":
         root = Path(ROOT_DIR)
     else:
         root = Path(__file__).resolve().parents[3]
-    output_path = root / OUTPUT_DIR
+    return root / output_dir
+
+def find_metadata_files(output_path: Path) -> List[str]:
+    with os.scandir(output_path) as entries:
+        return [entry.path for entry in entries if entry.name.endswith("metadata.json") and entry.is_file()]
 
-    if not output_path.exists():
-        print(f"Output directory {output_path} does not exist")
-        return
+def read_prompt_config_hashes(output_path: Path) -> Dict[str, str]:
+    # Maps the input stem of every file in the run manifest to the (shortened) hash of its prompt config
+    try:
+        with open(output_path / MANIFEST_FILE, "r", encoding="utf-8") as f:
+            entries = json.load(f).get("files", {})
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return {Path(name).stem: entry.get("prompt_config_hash", "")[:12] for name, entry in entries.items()}
 
-    file_counter = 0
-    for file in os.listdir(output_path):
-        if file.endswith("metadata.json"):
-            path = os.path.join(output_path, file)
-            data = read_json_file(path)
-            file_counter += 1
-            for key, value in data.items():
-                if key == "model":
-                    continue
+def input_stem(path: str) -> str:
+    # <stem><ORACLE_FILE_POSTFIX><METADATA_FILE_POSTFIX>.json is the metadata of <stem>.txt
+    name = Path(path).name
+    suffix = f"{ORACLE_FILE_POSTFIX}{METADATA_FILE_POSTFIX}.json"
+    return name[:-len(suffix)] if name.endswith(suffix) else name
 
-                if isinstance(value, (int, float)):
-                    sums[key] += value
-                    counts[key] += 1
+def aggregate_files(paths: List[str], prompt_config_hashes: Dict[str, str], relative_accuracy: float) -> GroupedAggregator:
+    aggregator = GroupedAggregator(relative_accuracy)
+    for path in paths:
+        data = read_json_file(path)
+        if isinstance(data, dict):
+            aggregator.add(data, prompt_config_hashes.get(input_stem(path), "unknown"))
+    return aggregator
 
-    averages = {key: (sums[key] / counts[key]) for key in sums}
+def analyze_metadata_files(
+    output_dirs: Optional[List[str]] = None,
+    analysis_file: Optional[str] = None,
+    workers: int = ANALYSE_WORKERS,
+    relative_accuracy: float = ANALYSE_RELATIVE_ACCURACY
+) -> Optional[Dict[str, Any]]:
+    output_paths = [resolve_output_dir(d) for d in (output_dirs or [str(OUTPUT_DIR)])]
+    tasks = []
+    for output_path in output_paths:
+        if not output_path.exists():
+            print(f"Output directory {output_path} does not exist")
+            return None
+        paths = find_metadata_files(output_path)
+        hashes = read_prompt_config_hashes(output_path)
+        print(f"Found {len(paths)} metadata files in {output_path}")
+        tasks += [(paths[i:i + SCAN_CHUNK_SIZE], hashes) for i in range(0, len(paths), SCAN_CHUNK_SIZE)]
+
+    aggregator = GroupedAggregator(relative_accuracy)
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(aggregate_files, paths, hashes, relative_accuracy) for paths, hashes in tasks]
+            for future in futures:
+                aggregator.merge(future.result())
+    else:
+        for paths, hashes in tasks:
+            aggregator.merge(aggregate_files(paths, hashes, relative_accuracy))
 
-    output = {
-        "sums": dict(sums),
-        "averages": averages,
-        "files_analysed": file_counter
-    }
+    output = aggregator.overall.to_dict()
+    output["output_dirs"] = [str(p) for p in output_paths]
+    output["groups"] = [
+        {"model": model, "prompt_config_hash": prompt_config_hash, **group.to_dict()}
+        for (model, prompt_config_hash), group in sorted(aggregator.groups.items())
+    ]
 
-    output_path = os.path.join(output_path, "analysis.json")
-    write_json_file(output_path, output)
+    analysis_path = Path(analysis_file) if analysis_file else output_paths[0] / "analysis.json"
+    write_json_file(analysis_path, output)
+    print(f"Analysed {output['files_analysed']} files in {len(output['groups'])} groups, wrote {analysis_path}")
+    for group in output["groups"]:
+        elapsed = group["percentiles"].get("elapsed_time")
+        if elapsed:
+            print(f"  {group['model']} ({group['prompt_config_hash']}): {group['files_analysed']} files, elapsed_time "
+                  f"p50 {elapsed['p50']:.2f} s, p95 {elapsed['p95']:.2f} s, p99 {elapsed['p99']:.2f} s")
+    return output
 
 def main(argv=None):
     print("Analysing metadata files...")
-    analyze_metadata_files()
+    parser = argparse.ArgumentParser(prog="oracle analyse", description="Aggregate the oracle metadata files")
+    parser.add_argument("output_dirs", nargs="*", help=f"Output directories to merge (default {OUTPUT_DIR})")
+    parser.add_argument("-o", "--output", default=None, help="Where to write the analysis (default analysis.json in the first directory)")
+    parser.add_argument("-w", "--workers", type=int, default=ANALYSE_WORKERS, help="Processes for the directory scan")
+    args = parser.parse_args(argv or [])
+    analyze_metadata_files(args.output_dirs or None, args.output, args.workers)
     print("Exiting...")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+MANIFEST_STATUS_RUNNING = "running"
+MANIFEST_STATUS_DONE = "done"
+MANIFEST_STATUS_FAILED = "failed"
+MANIFEST_STATUS_EMPTY = "empty"
+
+def file_hash(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+def settings_fingerprint(settings: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    # The prompt config can be a whole file, only its hash goes into the manifest
+    settings = dict(settings or {})
+    prompt_config = settings.pop("prompt_config", "")
+    return {
+        "model": settings.pop("model", None),
+        "prompt_config_hash": hashlib.sha256(prompt_config.encode("utf-8")).hexdigest(),
+        "settings": settings,
+    }
+
+"""
+    Manifest of an oracle run, stored in the output directory
+    Records the input hash, prompt config hash, model and status of every input file. A file is marked as running before
+    it is queried and as done or failed once its output is written, and the manifest is saved after every change, so an
+    interrupted run leaves the files it did not finish as running or missing. The next run skips the files that are done
+    with the same input, prompt config and model, and processes everything else.
+"""
+class RunManifest:
+
+    def __init__(self, path: Path, settings: Optional[Dict[str, Any]] = None):
+        self.path = path
+        self.fingerprint = settings_fingerprint(settings)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.input_hashes: Dict[str, str] = {}
+        # Watch mode marks files from several worker threads
+        self.lock = threading.RLock()
+
+    @classmethod
+    def load(cls, path: Path, settings: Optional[Dict[str, Any]] = None) -> "RunManifest":
+        manifest = cls(path, settings)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                manifest.entries = json.load(f).get("files", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Ignoring unreadable manifest {path.name}: {e}")
+        return manifest
+
+    def input_hash(self, path: Path) -> str:
+        if path.name not in self.input_hashes:
+            self.input_hashes[path.name] = file_hash(path)
+        return self.input_hashes[path.name]
+
+    def is_up_to_date(self, path: Path, output_file: Path) -> bool:
+        entry = self.entries.get(path.name)
+        if entry is None or entry.get("status") not in (MANIFEST_STATUS_DONE, MANIFEST_STATUS_EMPTY):
+            return False
+        if entry.get("input_hash") != self.input_hash(path):
+            return False
+        if any(entry.get(key) != value for key, value in self.fingerprint.items()):
+            return False
+        return entry["status"] == MANIFEST_STATUS_EMPTY or output_file.exists()
+
+    def pending_files(self, paths: List[Path], output_file_for) -> List[Path]:
+        pending = [path for path in paths if not self.is_up_to_date(path, output_file_for(path))]
+        skipped = len(paths) - len(pending)
+        if skipped:
+            print(f"Skipping {skipped} up-to-date files recorded in {self.path.name}")
+        return pending
+
+    def forget_input_hash(self, path: Path) -> None:
+        # The hash is cached per run, a file modified during the run has to be hashed again
+        self.input_hashes.pop(path.name, None)
+
+    def mark(self, path: Path, status: str) -> None:
+        with self.lock:
+            self.entries[path.name] = {
+                "input_hash": self.input_hash(path),
+                **self.fingerprint,
+                "status": status,
+                "updated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            self.save()
+
+    def save(self) -> None:
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"files": self.entries}, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Failed to write manifest {self.path}: {e}")
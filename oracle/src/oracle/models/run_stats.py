@@ -0,0 +1,206 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from oracle.models.oracle_config import RUN_SUMMARY_FILE, METRICS_FILE
+
+STAGE_READ = "read"
+STAGE_PROMPT = "prompt"
+STAGE_QUERY = "query"
+STAGE_PARSE = "parse"
+STAGE_WRITE = "write"
+
+"""
+    Times the stages of one input file: reading it, building the prompt, the query (network or generation), parsing the
+    JSON out of the response and writing the output
+    `ready_at` is when the file was ready to be processed (the start of the run, or when the watcher queued it), the
+    time until started() is the queue wait.
+"""
+class StageTimer:
+
+    def __init__(self, ready_at: Optional[float] = None):
+        self.ready_at = ready_at
+        self.queue_wait: Optional[float] = None
+        self.stages: Dict[str, float] = {}
+
+    def started(self) -> None:
+        if self.ready_at is not None and self.queue_wait is None:
+            self.queue_wait = max(0.0, time.time() - self.ready_at)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def annotate(self, metadata: Dict[str, Any]) -> None:
+        metadata["stage_times"] = dict(self.stages)
+        if self.queue_wait is not None:
+            metadata["queue_wait"] = self.queue_wait
+        # The local oracles measure the generation alone, the query stage also covers the network for the API ones
+        query_time = self.stages.get(STAGE_QUERY, 0.0)
+        if "tokens_per_second" not in metadata and query_time > 0 and isinstance(metadata.get("output_tokens"), (int, float)):
+            metadata["tokens_per_second"] = metadata["output_tokens"] / query_time
+
+def escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+"""
+    Run-level totals of the stage times, token counts, queue waits and file statuses, shared by all files of a run
+    The summary is printed and written to RUN_SUMMARY_FILE in the output directory at the end of the run. With
+    METRICS_FILE set, the same figures are also written in the Prometheus text format after every file, for the
+    textfile collector of the node exporter.
+"""
+class RunStats:
+
+    def __init__(self, model: Optional[str] = None, metrics_file: str = METRICS_FILE):
+        self.model = model or "unknown"
+        self.metrics_file = Path(metrics_file) if metrics_file else None
+        self.started = time.time()
+        self.statuses: Counter = Counter()
+        self.stage_totals: Dict[str, float] = defaultdict(float)
+        self.stage_counts: Dict[str, int] = defaultdict(int)
+        self.stage_max: Dict[str, float] = defaultdict(float)
+        self.tokens: Dict[str, float] = defaultdict(float)
+        self.waits: List[float] = []
+        self.first_token_times: List[float] = []
+        self.lock = threading.Lock()
+
+    def record(self, status: str, timer: Optional[StageTimer] = None, metadata: Optional[Dict[str, Any]] = None) -> None:
+        with self.lock:
+            self.statuses[status] += 1
+            if timer is not None:
+                for name, seconds in timer.stages.items():
+                    self.stage_totals[name] += seconds
+                    self.stage_counts[name] += 1
+                    self.stage_max[name] = max(self.stage_max[name], seconds)
+                if timer.queue_wait is not None:
+                    self.waits.append(timer.queue_wait)
+            for key in ("input_tokens", "output_tokens"):
+                value = (metadata or {}).get(key)
+                if isinstance(value, (int, float)):
+                    self.tokens[key] += value
+            first_token = (metadata or {}).get("time_to_first_token")
+            if isinstance(first_token, (int, float)):
+                self.first_token_times.append(first_token)
+        if self.metrics_file is not None:
+            self.write_metrics()
+
+    def summary(self) -> Dict[str, Any]:
+        with self.lock:
+            duration = time.time() - self.started
+            processed = self.statuses.get("done", 0) + self.statuses.get("failed", 0)
+            return {
+                "model": self.model,
+                "duration": duration,
+                "files": dict(self.statuses),
+                "files_per_minute": processed / duration * 60 if duration > 0 else 0.0,
+                "input_tokens": self.tokens["input_tokens"],
+                "output_tokens": self.tokens["output_tokens"],
+                "output_tokens_per_second": self.tokens["output_tokens"] / duration if duration > 0 else 0.0,
+                "stages": {
+                    name: {
+                        "total": total,
+                        "average": total / self.stage_counts[name],
+                        "max": self.stage_max[name],
+                        "share": total / sum(self.stage_totals.values()) if sum(self.stage_totals.values()) > 0 else 0.0,
+                    }
+                    for name, total in self.stage_totals.items()
+                },
+                "queue_wait": {
+                    "average": sum(self.waits) / len(self.waits) if self.waits else 0.0,
+                    "max": max(self.waits, default=0.0),
+                },
+                "time_to_first_token": {
+                    "average": sum(self.first_token_times) / len(self.first_token_times) if self.first_token_times else None,
+                    "max": max(self.first_token_times, default=None),
+                },
+            }
+
+    def prometheus_text(self) -> str:
+        summary = self.summary()
+        model = f'model="{escape_label(self.model)}"'
+        lines = [
+            "# HELP oracle_files_total Input files handled by the oracle run, by status",
+            "# TYPE oracle_files_total counter",
+        ]
+        lines += [f'oracle_files_total{{{model},status="{escape_label(s)}"}} {n}' for s, n in sorted(summary["files"].items())]
+        lines += [
+            "# HELP oracle_stage_seconds Time spent per processing stage of an input file",
+            "# TYPE oracle_stage_seconds summary",
+        ]
+        with self.lock:
+            for name in sorted(self.stage_totals):
+                labels = f'{model},stage="{escape_label(name)}"'
+                lines.append(f"oracle_stage_seconds_sum{{{labels}}} {self.stage_totals[name]}")
+                lines.append(f"oracle_stage_seconds_count{{{labels}}} {self.stage_counts[name]}")
+            waits, first_tokens = list(self.waits), list(self.first_token_times)
+        lines += [
+            "# HELP oracle_queue_wait_seconds Time input files waited before their processing started",
+            "# TYPE oracle_queue_wait_seconds summary",
+            f"oracle_queue_wait_seconds_sum{{{model}}} {sum(waits)}",
+            f"oracle_queue_wait_seconds_count{{{model}}} {len(waits)}",
+            "# HELP oracle_time_to_first_token_seconds Time until the first streamed token of a response",
+            "# TYPE oracle_time_to_first_token_seconds summary",
+            f"oracle_time_to_first_token_seconds_sum{{{model}}} {sum(first_tokens)}",
+            f"oracle_time_to_first_token_seconds_count{{{model}}} {len(first_tokens)}",
+            "# HELP oracle_tokens_total Tokens sent to and generated by the model",
+            "# TYPE oracle_tokens_total counter",
+            f'oracle_tokens_total{{{model},kind="input"}} {summary["input_tokens"]}',
+            f'oracle_tokens_total{{{model},kind="output"}} {summary["output_tokens"]}',
+            "# HELP oracle_output_tokens_per_second Generated tokens per second of run time",
+            "# TYPE oracle_output_tokens_per_second gauge",
+            f"oracle_output_tokens_per_second{{{model}}} {summary['output_tokens_per_second']}",
+            "# HELP oracle_run_duration_seconds Time since the oracle run started",
+            "# TYPE oracle_run_duration_seconds gauge",
+            f"oracle_run_duration_seconds{{{model}}} {summary['duration']}",
+            "# HELP oracle_last_update_timestamp_seconds When these metrics were written",
+            "# TYPE oracle_last_update_timestamp_seconds gauge",
+            f"oracle_last_update_timestamp_seconds{{{model}}} {time.time()}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self) -> None:
+        # Written atomically, the collector must never read a half written file
+        try:
+            self.metrics_file.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.metrics_file.parent, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp_path, self.metrics_file)
+        except Exception as e:
+            print(f"Failed to write metrics file {self.metrics_file}: {e}")
+
+    def finish(self, output_path: Path) -> Dict[str, Any]:
+        summary = self.summary()
+        try:
+            with open(output_path / RUN_SUMMARY_FILE, "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=2, ensure_ascii=False)
+        except Exception as e:
+            print(f"Failed to write run summary {RUN_SUMMARY_FILE}: {e}")
+        if self.metrics_file is not None:
+            self.write_metrics()
+        self.print_summary(summary)
+        return summary
+
+    @staticmethod
+    def print_summary(summary: Dict[str, Any]) -> None:
+        files = ", ".join(f"{count} {status}" for status, count in sorted(summary["files"].items())) or "no files"
+        print(f"\nRun summary: {files} in {summary['duration']:.1f} s "
+              f"({summary['files_per_minute']:.1f} files/min, {summary['output_tokens_per_second']:.1f} output tokens/s)")
+        for name, stage in sorted(summary["stages"].items(), key=lambda item: -item[1]["total"]):
+            print(f"  {name:<7} {stage['total']:9.2f} s total, {stage['average']:8.3f} s average, {stage['share']:6.1%}")
+        print(f"  queue wait {summary['queue_wait']['average']:.2f} s average, {summary['queue_wait']['max']:.2f} s max")
+        if summary["time_to_first_token"]["average"] is not None:
+            print(f"  time to first token {summary['time_to_first_token']['average']:.2f} s average")
@@ -1,10 +1,19 @@
+import asyncio
 import time
+from dataclasses import dataclass
 from pathlib import Path
 
 from oracle.models.oracle_config import ORACLE_FILE_POSTFIX, OUTPUT_DIR, INPUT_DIR, USE_INPUT_DIR, \
-    PRINT_MODEL_INPUT_AND_OUTPUT_FOR_DEBUG, METADATA_FILE_POSTFIX, ROOT_DIR
+    PRINT_MODEL_INPUT_AND_OUTPUT_FOR_DEBUG, METADATA_FILE_POSTFIX, ROOT_DIR, CONCURRENCY, RESUME, MANIFEST_FILE, \
+    CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TURNS, WATCH
+from oracle.models.chunking import query_chunked, estimate_tokens
+from oracle.models.input_watcher import watch_input_dir
+from oracle.models.run_stats import RunStats, StageTimer, STAGE_READ, STAGE_PROMPT, STAGE_QUERY, STAGE_PARSE, \
+    STAGE_WRITE
+from oracle.models.run_manifest import RunManifest, MANIFEST_STATUS_RUNNING, MANIFEST_STATUS_DONE, \
+    MANIFEST_STATUS_FAILED, MANIFEST_STATUS_EMPTY
 from shared.parser import read_txt_file, extract_last_json_or_error, extract_last_json, write_json_file
-from typing import Callable, Optional, Dict, Any
+from typing import Callable, Optional, Dict, Any, Awaitable, List, Tuple
 import json
 
 def run_with_query(
@@ -13,91 +22,493 @@ def run_with_query(
     input_dir: str = INPUT_DIR,
     output_dir: str = OUTPUT_DIR,
     use_input_dir: bool = USE_INPUT_DIR,
+    async_query_fn: Optional[Callable[[str], Awaitable[Optional[Dict[str, Any]]]]] = None,
+    concurrency: int = CONCURRENCY,
+    run_settings: Optional[Dict[str, Any]] = None,
+    resume: bool = RESUME,
+    batch_query_fn: Optional[Callable[[List[str]], List[Optional[Dict[str, Any]]]]] = None,
+    batch_size: int = 1,
+    length_fn: Callable[[str], int] = len,
+    max_length_ratio: float = 0.0,
+    chunk_max_tokens: int = CHUNK_MAX_TOKENS,
+    count_tokens_fn: Callable[[str], int] = estimate_tokens,
+    watch: bool = WATCH,
 ) -> None:
-    if ROOT_DIR and ROOT_DIR != "NONE":
-        root = Path(ROOT_DIR)
-    else:
-        root = Path(__file__).resolve().parents[3]
-
-    if use_input_dir:
-        input_path = root / input_dir
-        output_path = root / output_dir
-        output_path.mkdir(parents=True, exist_ok=True)
+    if use_input_dir and watch:
+        watch_files(
+            query_fn, make_prompt_fn, input_dir, output_dir, concurrency, run_settings, resume, chunk_max_tokens, count_tokens_fn
+        )
+        print("Exiting...")
 
-        if not input_path.exists():
-            print(f"Input directory {input_path} does not exist. Exiting.")
+    elif use_input_dir:
+        found = find_input_files(input_dir, output_dir)
+        if found is None:
             return
+        txt_files, output_path = found
 
-        txt_files = sorted([p for p in input_path.iterdir() if p.is_file() and p.suffix.lower() == ".txt"])
-        if not txt_files:
-            print(f"No .txt files found in {input_path}. Exiting.")
-            return
+        # `run_settings` (model, prompt_config, sampling) decide together with the input whether an output is up to date
+        manifest = RunManifest.load(output_path / MANIFEST_FILE, chunk_run_settings(run_settings, chunk_max_tokens))
+        if resume:
+            txt_files = manifest.pending_files(txt_files, lambda p: oracle_output_file(p, output_path))
+        stats = RunStats((run_settings or {}).get("model"))
+        ready_at = time.time()
 
-        for in_path in txt_files:
-            process_file(
-                path=in_path,
-                output_path=output_path,
-                query_fn=query_fn,
-                make_prompt_fn=make_prompt_fn,
+        if chunk_max_tokens > 0:
+            # Files are processed one after another, the windows of a long file run concurrently
+            for in_path in txt_files:
+                process_file_chunked(
+                    in_path, output_path, query_fn, make_prompt_fn, chunk_max_tokens, concurrency, count_tokens_fn, manifest,
+                    stats, ready_at
+                )
+        elif batch_query_fn is not None and batch_size > 1:
+            process_files_batched(
+                txt_files, output_path, batch_query_fn, make_prompt_fn, batch_size, length_fn, max_length_ratio, manifest,
+                stats, ready_at
             )
+        elif async_query_fn is not None and concurrency > 1:
+            asyncio.run(process_files_async(
+                txt_files, output_path, async_query_fn, make_prompt_fn, concurrency, manifest, stats, ready_at
+            ))
+        else:
+            for in_path in txt_files:
+                process_file(
+                    path=in_path,
+                    output_path=output_path,
+                    query_fn=query_fn,
+                    make_prompt_fn=make_prompt_fn,
+                    manifest=manifest,
+                    stats=stats,
+                    ready_at=ready_at,
+                )
 
+        stats.finish(output_path)
         print("\nAll files processed. Exiting...")
 
     else:
         interactive_mode(query_fn, make_prompt_fn)
         print("Exiting...")
 
-def process_file(path: Path, output_path: Path, query_fn: Callable[[str], Optional[Dict[str, Any]]], make_prompt_fn: Callable[[str], str]) -> None:
+"""
+    A loaded oracle with everything run_with_query needs, so that the model is loaded once and can be reused for several
+    runs, e.g. by the oracle server. Built by make_oracle() of every oracle module.
+"""
+@dataclass
+class Oracle:
+
+    name: str
+    query_fn: Callable[[str], Optional[Dict[str, Any]]]
+    make_prompt_fn: Callable[[str], str]
+    async_query_fn: Optional[Callable[[str], Awaitable[Optional[Dict[str, Any]]]]] = None
+    batch_query_fn: Optional[Callable[[List[str]], List[Optional[Dict[str, Any]]]]] = None
+    run_settings: Optional[Dict[str, Any]] = None
+    batch_size: int = 1
+    length_fn: Callable[[str], int] = len
+    max_length_ratio: float = 0.0
+    concurrency: int = CONCURRENCY
+    count_tokens_fn: Callable[[str], int] = estimate_tokens
+    cache: Any = None
+
+    def run(
+        self,
+        input_dir: str = INPUT_DIR,
+        output_dir: str = OUTPUT_DIR,
+        use_input_dir: bool = USE_INPUT_DIR,
+        watch: bool = WATCH
+    ) -> None:
+        run_with_query(
+            query_fn=self.query_fn,
+            make_prompt_fn=self.make_prompt_fn,
+            input_dir=input_dir,
+            output_dir=output_dir,
+            use_input_dir=use_input_dir,
+            async_query_fn=self.async_query_fn,
+            concurrency=self.concurrency,
+            run_settings=self.run_settings,
+            batch_query_fn=self.batch_query_fn,
+            batch_size=self.batch_size,
+            length_fn=self.length_fn,
+            max_length_ratio=self.max_length_ratio,
+            count_tokens_fn=self.count_tokens_fn,
+            watch=watch,
+        )
+
+    def query_text(self, text: str) -> Optional[Dict[str, Any]]:
+        return self.query_fn(self.make_prompt_fn(text))
+
+    def print_summary(self) -> None:
+        if self.cache is not None:
+            self.cache.print_summary()
+
+"""
+    Watch mode of run_with_query: processes the transcripts in `input_dir` as they appear or change (see input_watcher)
+    The files already in the directory are processed first, files with an up-to-date output in the manifest are skipped.
+    Up to `concurrency` files are processed at once, each like in process_file (or process_file_chunked).
+"""
+def watch_files(
+    query_fn: Callable[[str], Optional[Dict[str, Any]]],
+    make_prompt_fn: Callable[[str], str],
+    input_dir: str,
+    output_dir: str,
+    concurrency: int = CONCURRENCY,
+    run_settings: Optional[Dict[str, Any]] = None,
+    resume: bool = RESUME,
+    chunk_max_tokens: int = CHUNK_MAX_TOKENS,
+    count_tokens_fn: Callable[[str], int] = estimate_tokens,
+) -> None:
+    root = resolve_root()
+    input_path = root / input_dir
+    output_path = root / output_dir
+    if not input_path.exists():
+        print(f"Input directory {input_path} does not exist. Exiting.")
+        return
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    manifest = RunManifest.load(output_path / MANIFEST_FILE, chunk_run_settings(run_settings, chunk_max_tokens))
+    stats = RunStats((run_settings or {}).get("model"))
+
+    def process_path(path: Path, queued_at: float) -> None:
+        manifest.forget_input_hash(path)
+        if resume and manifest.is_up_to_date(path, oracle_output_file(path, output_path)):
+            print(f"Skipping {path.name}, its output is up to date")
+            return
+        if chunk_max_tokens > 0:
+            process_file_chunked(
+                path, output_path, query_fn, make_prompt_fn, chunk_max_tokens, 1, count_tokens_fn, manifest, stats, queued_at
+            )
+        else:
+            process_file(
+                path=path, output_path=output_path, query_fn=query_fn, make_prompt_fn=make_prompt_fn, manifest=manifest,
+                stats=stats, ready_at=queued_at
+            )
+
+    watch_input_dir(input_path, process_path, workers=concurrency)
+    stats.finish(output_path)
+
+def chunk_run_settings(run_settings: Optional[Dict[str, Any]], chunk_max_tokens: int) -> Optional[Dict[str, Any]]:
+    # Chunked outputs differ from whole-file ones, so the chunk settings are part of the manifest fingerprint
+    if chunk_max_tokens <= 0:
+        return run_settings
+    return {**(run_settings or {}), "chunking": {"max_tokens": chunk_max_tokens, "overlap_turns": CHUNK_OVERLAP_TURNS}}
+
+def resolve_root() -> Path:
+    if ROOT_DIR and ROOT_DIR != "NONE":
+        return Path(ROOT_DIR)
+    return Path(__file__).resolve().parents[3]
+
+def find_input_files(input_dir: str, output_dir: str) -> Optional[Tuple[List[Path], Path]]:
+    root = resolve_root()
+    input_path = root / input_dir
+    output_path = root / output_dir
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    if not input_path.exists():
+        print(f"Input directory {input_path} does not exist. Exiting.")
+        return None
+
+    txt_files = sorted([p for p in input_path.iterdir() if p.is_file() and p.suffix.lower() == ".txt"])
+    if not txt_files:
+        print(f"No .txt files found in {input_path}. Exiting.")
+        return None
+    return txt_files, output_path
+
+def process_file(
+    path: Path,
+    output_path: Path,
+    query_fn: Callable[[str], Optional[Dict[str, Any]]],
+    make_prompt_fn: Callable[[str], str],
+    manifest: Optional[RunManifest] = None,
+    stats: Optional[RunStats] = None,
+    ready_at: Optional[float] = None,
+) -> None:
+    timer = StageTimer(ready_at)
+    timer.started()
+    prompt = build_prompt(path, make_prompt_fn, timer)
+    if prompt is None:
+        record_status(manifest, path, MANIFEST_STATUS_EMPTY, stats)
+        return
+
+    record_status(manifest, path, MANIFEST_STATUS_RUNNING)
+
+    output: Optional[Dict[str, Any]] = None
+    elapsed_time = 0
+    try:
+        print("Querying...")
+        start = time.time()
+        with timer.stage(STAGE_QUERY):
+            output = query_fn(prompt)
+        elapsed_time = time.time() - start
+        print("The query was successful" if output is not None else "No response returned")
+    except Exception as e:
+        print("Querying failed with error: ", e)
+        output = None
+
+    written = write_output(path, output_path, output, elapsed_time, timer)
+    record_status(manifest, path, MANIFEST_STATUS_DONE if written else MANIFEST_STATUS_FAILED, stats, timer, output)
+
+"""
+    Processes a file like process_file, but a text longer than `max_tokens` is split into overlapping windows at the
+    turns of the discussion and the AIF graphs of the windows are merged (see chunking.query_chunked)
+    Shorter texts are sent in one query as usual.
+"""
+def process_file_chunked(
+    path: Path,
+    output_path: Path,
+    query_fn: Callable[[str], Optional[Dict[str, Any]]],
+    make_prompt_fn: Callable[[str], str],
+    max_tokens: int,
+    concurrency: int = 1,
+    count_tokens_fn: Callable[[str], int] = estimate_tokens,
+    manifest: Optional[RunManifest] = None,
+    stats: Optional[RunStats] = None,
+    ready_at: Optional[float] = None,
+) -> None:
+    timer = StageTimer(ready_at)
+    timer.started()
     print(f"Processing file: {path.name}")
-    text = read_txt_file(str(path))
+    with timer.stage(STAGE_READ):
+        text = read_txt_file(str(path))
     if not text:
         print(f" - Skipping {path.name}: empty or unreadable.")
+        record_status(manifest, path, MANIFEST_STATUS_EMPTY, stats)
         return
 
-    prompt = make_prompt_fn(text)
-
-    if PRINT_MODEL_INPUT_AND_OUTPUT_FOR_DEBUG:
-        print("Model input:")
-        print(prompt)
+    record_status(manifest, path, MANIFEST_STATUS_RUNNING)
 
     output: Optional[Dict[str, Any]] = None
     elapsed_time = 0
     try:
-        print("Querying...")
         start = time.time()
-        output = query_fn(prompt)
+        if count_tokens_fn(text) > max_tokens:
+            # Building the window prompts and merging the fragments are part of the query stage here
+            with timer.stage(STAGE_QUERY):
+                output = query_chunked(text, query_fn, make_prompt_fn, max_tokens, CHUNK_OVERLAP_TURNS, concurrency, count_tokens_fn)
+        else:
+            print("Querying...")
+            with timer.stage(STAGE_PROMPT):
+                prompt = make_prompt_fn(text)
+            with timer.stage(STAGE_QUERY):
+                output = query_fn(prompt)
         elapsed_time = time.time() - start
         print("The query was successful" if output is not None else "No response returned")
     except Exception as e:
         print("Querying failed with error: ", e)
         output = None
 
+    written = write_output(path, output_path, output, elapsed_time, timer)
+    record_status(manifest, path, MANIFEST_STATUS_DONE if written else MANIFEST_STATUS_FAILED, stats, timer, output)
+
+"""
+    Processes the files concurrently with at most `concurrency` queries in flight
+    The outputs are written per file exactly like in process_file, elapsed_time excludes the time spent waiting for a slot
+"""
+async def process_files_async(
+    paths: List[Path],
+    output_path: Path,
+    async_query_fn: Callable[[str], Awaitable[Optional[Dict[str, Any]]]],
+    make_prompt_fn: Callable[[str], str],
+    concurrency: int,
+    manifest: Optional[RunManifest] = None,
+    stats: Optional[RunStats] = None,
+    ready_at: Optional[float] = None,
+) -> None:
+    print(f"Processing {len(paths)} files with up to {concurrency} concurrent queries")
+    semaphore = asyncio.Semaphore(concurrency)
+    await asyncio.gather(*(
+        process_file_async(path, output_path, async_query_fn, make_prompt_fn, semaphore, manifest, stats, ready_at)
+        for path in paths
+    ))
+
+async def process_file_async(
+    path: Path,
+    output_path: Path,
+    async_query_fn: Callable[[str], Awaitable[Optional[Dict[str, Any]]]],
+    make_prompt_fn: Callable[[str], str],
+    semaphore: asyncio.Semaphore,
+    manifest: Optional[RunManifest] = None,
+    stats: Optional[RunStats] = None,
+    ready_at: Optional[float] = None,
+) -> None:
+    timer = StageTimer(ready_at if ready_at is not None else time.time())
+    async with semaphore:
+        timer.started()
+        prompt = build_prompt(path, make_prompt_fn, timer)
+        if prompt is None:
+            record_status(manifest, path, MANIFEST_STATUS_EMPTY, stats)
+            return
+
+        record_status(manifest, path, MANIFEST_STATUS_RUNNING)
+
+        output: Optional[Dict[str, Any]] = None
+        elapsed_time = 0
+        try:
+            start = time.time()
+            with timer.stage(STAGE_QUERY):
+                output = await async_query_fn(prompt)
+            elapsed_time = time.time() - start
+            print(f"The query for {path.name} was successful" if output is not None else f"No response returned for {path.name}")
+        except Exception as e:
+            print(f"Querying {path.name} failed with error: ", e)
+            output = None
+
+    written = write_output(path, output_path, output, elapsed_time, timer)
+    record_status(manifest, path, MANIFEST_STATUS_DONE if written else MANIFEST_STATUS_FAILED, stats, timer, output)
+
+"""
+    Processes the files in batches, one batch_query_fn call per batch
+    The prompts are sorted by length_fn and split into batches of up to `batch_size` prompts, a batch is also closed when
+    its longest prompt would be more than `max_length_ratio` times its shortest one (0 = no limit), which keeps the
+    padding of each batch small. elapsed_time is the batch time split evenly between its files.
+"""
+def process_files_batched(
+    paths: List[Path],
+    output_path: Path,
+    batch_query_fn: Callable[[List[str]], List[Optional[Dict[str, Any]]]],
+    make_prompt_fn: Callable[[str], str],
+    batch_size: int,
+    length_fn: Callable[[str], int] = len,
+    max_length_ratio: float = 0.0,
+    manifest: Optional[RunManifest] = None,
+    stats: Optional[RunStats] = None,
+    ready_at: Optional[float] = None,
+) -> None:
+    prompts: List[Tuple[Path, str]] = []
+    timers: Dict[Path, StageTimer] = {}
+    for path in paths:
+        timers[path] = StageTimer(ready_at)
+        prompt = build_prompt(path, make_prompt_fn, timers[path])
+        if prompt is None:
+            record_status(manifest, path, MANIFEST_STATUS_EMPTY, stats)
+        else:
+            prompts.append((path, prompt))
+
+    batches = make_batches(prompts, batch_size, lambda item: length_fn(item[1]), max_length_ratio)
+    print(f"Processing {len(prompts)} files in {len(batches)} batches of up to {batch_size}")
+    for number, batch in enumerate(batches, start=1):
+        for path, _ in batch:
+            timers[path].started()
+            record_status(manifest, path, MANIFEST_STATUS_RUNNING)
+
+        outputs: List[Optional[Dict[str, Any]]] = [None] * len(batch)
+        elapsed_time = 0
+        try:
+            print(f"Querying batch {number}/{len(batches)} ({len(batch)} files)...")
+            start = time.time()
+            outputs = batch_query_fn([prompt for _, prompt in batch])
+            elapsed_time = time.time() - start
+        except Exception as e:
+            print("Querying failed with error: ", e)
+
+        for (path, _), output in zip(batch, outputs):
+            if output is not None and output.get("metadata") is not None:
+                output["metadata"]["batch_size"] = len(batch)
+                output["metadata"]["batch_elapsed_time"] = elapsed_time
+            timer = timers[path]
+            timer.add(STAGE_QUERY, elapsed_time / len(batch))
+            written = write_output(path, output_path, output, elapsed_time / len(batch), timer)
+            record_status(manifest, path, MANIFEST_STATUS_DONE if written else MANIFEST_STATUS_FAILED, stats, timer, output)
+
+def make_batches(items: List[Any], batch_size: int, length_fn: Callable[[Any], int], max_length_ratio: float = 0.0) -> List[List[Any]]:
+    batches: List[List[Any]] = []
+    batch: List[Any] = []
+    shortest = 0
+    for item, length in sorted(((item, length_fn(item)) for item in items), key=lambda pair: pair[1]):
+        too_long = max_length_ratio > 0 and batch and length > max_length_ratio * max(shortest, 1)
+        if len(batch) >= batch_size or too_long:
+            batches.append(batch)
+            batch = []
+        if not batch:
+            shortest = length
+        batch.append(item)
+    if batch:
+        batches.append(batch)
+    return batches
+
+def record_status(
+    manifest: Optional[RunManifest],
+    path: Path,
+    status: str,
+    stats: Optional[RunStats] = None,
+    timer: Optional[StageTimer] = None,
+    output: Optional[Dict[str, Any]] = None
+) -> None:
+    if manifest is not None:
+        manifest.mark(path, status)
+    if stats is not None and status != MANIFEST_STATUS_RUNNING:
+        stats.record(status, timer, (output or {}).get("metadata"))
+
+def oracle_output_file(path: Path, output_path: Path) -> Path:
+    return output_path / f"{path.stem}{ORACLE_FILE_POSTFIX}.json"
+
+def build_prompt(path: Path, make_prompt_fn: Callable[[str], str], timer: Optional[StageTimer] = None) -> Optional[str]:
+    timer = timer or StageTimer()
+    print(f"Processing file: {path.name}")
+    with timer.stage(STAGE_READ):
+        text = read_txt_file(str(path))
+    if not text:
+        print(f" - Skipping {path.name}: empty or unreadable.")
+        return None
+
+    with timer.stage(STAGE_PROMPT):
+        prompt = make_prompt_fn(text)
+
+    if PRINT_MODEL_INPUT_AND_OUTPUT_FOR_DEBUG:
+        print("Model input:")
+        print(prompt)
+    return prompt
+
+def write_output(
+    path: Path,
+    output_path: Path,
+    output: Optional[Dict[str, Any]],
+    elapsed_time: float,
+    timer: Optional[StageTimer] = None
+) -> bool:
     if PRINT_MODEL_INPUT_AND_OUTPUT_FOR_DEBUG:
         print("Model output:")
         print(output)
 
+    if output is None:
+        print(f" - No output written for {path.name}")
+        return False
+
+    timer = timer or StageTimer()
     message = output.get("message")
     metadata = output.get("metadata")
-    parsed_message = extract_last_json(message)
+    with timer.stage(STAGE_PARSE):
+        parsed_message = extract_last_json(message)
 
     if PRINT_MODEL_INPUT_AND_OUTPUT_FOR_DEBUG:
         print("Parsed model output as JSON:")
         print(parsed_message)
 
     base_name = path.stem
+    message_out_path = oracle_output_file(path, output_path)
+    message_out_name = message_out_path.name
     try:
-        message_out_name = f"{base_name}{ORACLE_FILE_POSTFIX}.json"
-        message_out_path = output_path / message_out_name
-        write_json_file(message_out_path, parsed_message)
+        with timer.stage(STAGE_WRITE):
+            write_json_file(message_out_path, parsed_message)
 
         if metadata is not None:
             metadata["elapsed_time"] = elapsed_time
+            # The metadata file itself is written after its stage times are known
+            timer.annotate(metadata)
             meta_out_name = f"{base_name}{ORACLE_FILE_POSTFIX}{METADATA_FILE_POSTFIX}.json"
             meta_out_path = output_path / meta_out_name
             write_json_file(meta_out_path, metadata)
         print(f"Wrote output to {OUTPUT_DIR}")
     except Exception as e:
         print(f"Failed to write output to file {OUTPUT_DIR}/{message_out_name}: {e}")
+        return False
+
+    # The error is written for inspection, but the file failed and is queried again on resume
+    if is_parse_error(parsed_message):
+        print(f" - No JSON found in the output for {path.name}")
+        return False
+    return True
+
+def is_parse_error(parsed_message: Any) -> bool:
+    # extract_last_json returns {"error": ...} instead of raising when the message holds no JSON
+    return isinstance(parsed_message, dict) and set(parsed_message) == {"error"}
 
 def interactive_mode(query_fn: Callable[[str], Optional[Dict[str, Any]]], make_prompt_fn: Callable[[str], str]) -> None:
     while True:
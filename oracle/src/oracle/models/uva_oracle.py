@@ -1,14 +1,15 @@
 import os
-import time
 from pathlib import Path
 
 import openai
 import sys
 from dotenv import load_dotenv
-from typing import Callable, Optional, Dict, Any
+from typing import Callable, Optional, Dict, Any, Awaitable
 
 from oracle.models.oracle_config import PROMPT_CONFIG_FILE, UVA_CONFIG, ROOT_DIR
-from oracle.models.shared import run_with_query, clean_json
+from oracle.models.response_cache import open_response_cache
+from oracle.models.rate_limiter import RateLimiter, query_with_limits, query_with_limits_async
+from oracle.models.shared import Oracle, clean_json
 from shared.parser import read_txt_file
 
 load_dotenv()
@@ -18,73 +19,113 @@ if not API_KEY:
     print("UVA_AI_API_KEY environment variable is not set. Make sure the API key is in the .env file.")
     sys.exit(1)
 
+# Retries are done by query_with_limits, so that they go through the shared rate limiter
 client = openai.OpenAI(
     api_key=API_KEY,
-    base_url="https://ai-research-proxy.azurewebsites.net"
+    base_url=UVA_CONFIG["BASE_URL"],
+    max_retries=0
 )
+async_client = openai.AsyncOpenAI(
+    api_key=API_KEY,
+    base_url=UVA_CONFIG["BASE_URL"],
+    max_retries=0
+)
+limiter = RateLimiter(UVA_CONFIG["REQUESTS_PER_MINUTE"], UVA_CONFIG["TOKENS_PER_MINUTE"])
 
 def make_uva_query(
     model: str = UVA_CONFIG["MODEL_NAME"],
     temperature: float = UVA_CONFIG["TEMPERATURE"],
-    retries: int = 2,
+    retries: int = UVA_CONFIG["MAX_RETRIES"],
 ) -> Callable[[str], Optional[str]]:
 
     def query_fn(prompt_text: str) -> Optional[Dict[str, Any]]:
-        attempt = 0
-        if ROOT_DIR and ROOT_DIR != "NONE":
-            root = Path(ROOT_DIR)
-        else:
-            root = Path(__file__).resolve().parents[3]
-        prompt_config_path = root / PROMPT_CONFIG_FILE
-        config = read_txt_file(prompt_config_path)
-
-        while attempt <= retries:
-            try:
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {
-                            "role": "developer",
-                            "content": config
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt_text,
-                        }
-                    ],
-                    temperature=temperature,
-                )
-
-                message_text = response.choices[0].message.content
-                metadata = {
-                    "input_tokens": response.usage.prompt_tokens,
-                    "output_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens,
-                    "model": response.model
-                }
-
-                return {
-                    "message": clean_json(message_text),
-                    "metadata": metadata
-                }
-            except Exception as e:
-                print(e)
-                attempt += 1
-                if attempt > retries:
-                    print("UvA oracle error:", e)
-                    return None
-                time.sleep(1 + attempt)
-        return None
+        config = read_prompt_config()
+        request = make_request(config, prompt_text, model, temperature)
+        return query_with_limits(
+            lambda: parse_response(client.chat.completions.create(**request)),
+            limiter, f"{config}\n{prompt_text}", retries, "UvA oracle"
+        )
+    return query_fn
+
+def make_uva_async_query(
+    model: str = UVA_CONFIG["MODEL_NAME"],
+    temperature: float = UVA_CONFIG["TEMPERATURE"],
+    retries: int = UVA_CONFIG["MAX_RETRIES"],
+) -> Callable[[str], Awaitable[Optional[Dict[str, Any]]]]:
+    config = read_prompt_config()
+
+    async def query_fn(prompt_text: str) -> Optional[Dict[str, Any]]:
+        request = make_request(config, prompt_text, model, temperature)
+
+        async def send() -> Dict[str, Any]:
+            return parse_response(await async_client.chat.completions.create(**request))
+
+        return await query_with_limits_async(send, limiter, f"{config}\n{prompt_text}", retries, "UvA oracle")
     return query_fn
 
+def read_prompt_config() -> str:
+    if ROOT_DIR and ROOT_DIR != "NONE":
+        root = Path(ROOT_DIR)
+    else:
+        root = Path(__file__).resolve().parents[3]
+    prompt_config_path = root / PROMPT_CONFIG_FILE
+    return read_txt_file(prompt_config_path)
+
+def make_request(config: str, prompt_text: str, model: str, temperature: float) -> Dict[str, Any]:
+    return {
+        "model": model,
+        "messages": [
+            {
+                "role": "developer",
+                "content": config
+            },
+            {
+                "role": "user",
+                "content": prompt_text,
+            }
+        ],
+        "temperature": temperature,
+    }
+
+def parse_response(response) -> Dict[str, Any]:
+    message_text = response.choices[0].message.content
+    metadata = {
+        "input_tokens": response.usage.prompt_tokens,
+        "output_tokens": response.usage.completion_tokens,
+        "total_tokens": response.usage.total_tokens,
+        "model": response.model
+    }
+
+    return {
+        "message": clean_json(message_text),
+        "metadata": metadata
+    }
+
 def make_prompt_fn(text: str) -> str:
     return text
 
+def make_oracle() -> Oracle:
+    cache = open_response_cache()
+    run_settings = {
+        "model": UVA_CONFIG["MODEL_NAME"],
+        "prompt_config": read_prompt_config(),
+        "sampling": {"temperature": UVA_CONFIG["TEMPERATURE"]},
+    }
+    return Oracle(
+        name=UVA_CONFIG["MODEL_NAME"],
+        query_fn=cache.wrap(make_uva_query(), **run_settings),
+        make_prompt_fn=make_prompt_fn,
+        async_query_fn=cache.wrap_async(make_uva_async_query(), **run_settings),
+        run_settings=run_settings,
+        cache=cache
+    )
+
 def main(argv=None):
     print("Starting UvA oracle with argv:", argv)
 
-    query_fn = make_uva_query()
-    run_with_query(query_fn=query_fn, make_prompt_fn=make_prompt_fn)
+    oracle = make_oracle()
+    oracle.run()
+    oracle.print_summary()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,129 @@
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import networkx as nx
+
+from .dataset_parser import get_aif_graph_from_path, find_pairs
+from .ged_calculator import node_subst_cost, make_node_subst_lookup, compute_ged, compute_approximate_ged
+from .similarity_metrics import alignment_scores, wl_kernel_similarity
+from .test_config import ROOT_DIR, RESOURCES_DIR, GED_TIMEOUT, ORACLE_FILE_POSTFIX, NODE_MATCH_THRESHOLD
+
+"""
+    Micro-benchmarks for the GED cost model and the similarity metrics, run on the pairs in RESOURCES_DIR
+    python -m oracle.test.benchmark
+"""
+def load_graph_pairs(resources_dir: Path) -> List[Tuple[str, nx.DiGraph, nx.DiGraph]]:
+    graph_pairs = []
+    for bench_path, oracle_path in find_pairs(resources_dir):
+        graph_a = get_aif_graph_from_path(str(bench_path))
+        graph_b = get_aif_graph_from_path(str(oracle_path))
+        if graph_a is None or graph_b is None:
+            continue
+        graph_pairs.append((bench_path.name, graph_a.to_networkx(attach_objects=True), graph_b.to_networkx(attach_objects=True)))
+    return graph_pairs
+
+def benchmark_node_subst(graph_1: nx.DiGraph, graph_2: nx.DiGraph, repeats: int = 5) -> Dict[str, Any]:
+    # Every node pair is evaluated `repeats` times, as the exact GED search evaluates the same pairs again and again
+    attrs_1 = [graph_1.nodes[u] for u in graph_1.nodes]
+    attrs_2 = [graph_2.nodes[v] for v in graph_2.nodes]
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        direct = [[node_subst_cost(a1, a2) for a2 in attrs_2] for a1 in attrs_1]
+    direct_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lookup = make_node_subst_lookup(graph_1, graph_2)
+    precompute_elapsed = time.perf_counter() - start
+    for _ in range(repeats):
+        looked_up = [[lookup(a1, a2) for a2 in attrs_2] for a1 in attrs_1]
+    lookup_elapsed = time.perf_counter() - start
+
+    max_difference = max(
+        (abs(d - l) for row_d, row_l in zip(direct, looked_up) for d, l in zip(row_d, row_l)),
+        default=0.0
+    )
+    return {
+        "node_pairs": len(attrs_1) * len(attrs_2),
+        "direct": direct_elapsed,
+        "precompute": precompute_elapsed,
+        "lookup": lookup_elapsed,
+        "speedup": direct_elapsed / lookup_elapsed if lookup_elapsed > 0 else float("inf"),
+        "max_difference": max_difference,
+    }
+
+def benchmark_exact_ged(graph_1: nx.DiGraph, graph_2: nx.DiGraph, timeout: float) -> Dict[str, Any]:
+    ged_direct, direct_elapsed = compute_ged(graph_1, graph_2, timeout=timeout)
+    start = time.perf_counter()
+    lookup = make_node_subst_lookup(graph_1, graph_2)
+    ged_lookup, _ = compute_ged(graph_1, graph_2, timeout=timeout, node_subst=lookup)
+    lookup_elapsed = time.perf_counter() - start
+    return {
+        "ged_direct": ged_direct,
+        "ged_lookup": ged_lookup,
+        "direct": direct_elapsed,
+        "lookup": lookup_elapsed,
+        "speedup": direct_elapsed / lookup_elapsed if lookup_elapsed > 0 else float("inf"),
+    }
+
+def benchmark_metrics(graph_1: nx.DiGraph, graph_2: nx.DiGraph, timeout: float) -> Dict[str, Any]:
+    # Runtime of every metric on the same pair, the graphs are copied so that no metric profits from another's attributes
+    timings = {}
+    runs = {
+        "exact_ged": lambda g1, g2: compute_ged(g1, g2, timeout=timeout, node_subst=make_node_subst_lookup(g1, g2)),
+        "bipartite_ged": lambda g1, g2: compute_approximate_ged(g1, g2, node_subst=make_node_subst_lookup(g1, g2)),
+        "alignment": lambda g1, g2: alignment_scores(g1, g2, NODE_MATCH_THRESHOLD),
+        "wl": wl_kernel_similarity,
+    }
+    for name, run in runs.items():
+        g1, g2 = graph_1.copy(), graph_2.copy()
+        start = time.perf_counter()
+        run(g1, g2)
+        timings[name] = time.perf_counter() - start
+    return timings
+
+def run_benchmarks(resources_dir: Path, timeout: float = GED_TIMEOUT) -> None:
+    graph_pairs = load_graph_pairs(resources_dir)
+    if not graph_pairs:
+        print(f"No AIF graph pairs found in {resources_dir} directory (expected <name>.json and <name>{ORACLE_FILE_POSTFIX}.json).")
+        return
+
+    print("node_subst_cost: direct calls vs precomputed matrix lookup")
+    for name, graph_1, graph_2 in graph_pairs:
+        r = benchmark_node_subst(graph_1, graph_2)
+        print(f"  {name}: {r['node_pairs']} node pairs, direct {r['direct'] * 1000:.2f} ms, "
+              f"precompute + lookup {r['lookup'] * 1000:.2f} ms (precompute {r['precompute'] * 1000:.2f} ms), "
+              f"speedup x{r['speedup']:.1f}, max difference {r['max_difference']:.2g}")
+
+    print("Exact GED: direct node_subst_cost vs precomputed matrix lookup")
+    for name, graph_1, graph_2 in graph_pairs:
+        r = benchmark_exact_ged(graph_1, graph_2, timeout)
+        print(f"  {name}: GED {r['ged_direct']} / {r['ged_lookup']}, direct {r['direct']:.3f} s, "
+              f"lookup {r['lookup']:.3f} s, speedup x{r['speedup']:.1f}")
+
+    print("Metric runtime on the same pairs")
+    totals: Dict[str, float] = {}
+    for name, graph_1, graph_2 in graph_pairs:
+        timings = benchmark_metrics(graph_1, graph_2, timeout)
+        for metric, elapsed in timings.items():
+            totals[metric] = totals.get(metric, 0.0) + elapsed
+        print(f"  {name}: " + ", ".join(f"{metric} {elapsed * 1000:.2f} ms" for metric, elapsed in timings.items()))
+    print("  total: " + ", ".join(f"{metric} {elapsed:.3f} s" for metric, elapsed in totals.items()))
+
+def main(argv=None):
+    print("Starting the GED benchmark with argv=", argv)
+    if ROOT_DIR and ROOT_DIR != "NONE":
+        root = Path(ROOT_DIR)
+    else:
+        root = Path(__file__).resolve().parents[3]
+    resources_dir = root / RESOURCES_DIR
+
+    if not resources_dir.exists():
+        print(f"Resources directory {RESOURCES_DIR} not found")
+        return
+    run_benchmarks(resources_dir)
+    print("Exiting...")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .dataset_parser import parse_aif_json
+from .models import CompactAIFGraph
+from .test_config import ROOT_DIR, RESOURCES_DIR, CORPUS_FILE, ORACLE_FILE_POSTFIX, NODES_KEY, EDGES_KEY
+
+"""
+    Binary corpus of pre-parsed benchmark graphs
+    Layout: header (magic, index offset, index length), one record per JSON file, JSON index at the end.
+    A record holds the int32 edge and CSR adjacency arrays followed by the string columns as JSON. The arrays are loaded as
+    read-only views into the memory-mapped file, graphs are only decoded when they are requested.
+    Node texts are interned in one string table per corpus, records store their positions in it.
+    The index keeps the mtime, size and SHA-256 of every source file, so compiling again only re-parses changed files.
+    It also keeps the node and edge keys the files were parsed with, changing them re-parses everything.
+"""
+CORPUS_MAGIC = b"AIFCORP2"
+HEADER = struct.Struct("<8sQQ")
+ARRAY_NAMES = ("sources", "targets", "out_offsets", "out_edges", "in_offsets", "in_edges")
+ALIGNMENT = 8
+
+class Corpus:
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_offset, index_length = HEADER.unpack_from(self._mmap, 0)
+        if magic != CORPUS_MAGIC:
+            raise ValueError(f"{path} is not an AIF corpus file")
+        header = json.loads(self._mmap[index_offset:index_offset + index_length])
+        self.keys: List[str] = header["keys"]
+        self.strings: List[str] = header["strings"]
+        self.index: Dict[str, Dict[str, Any]] = header["files"]
+
+    def names(self) -> List[str]:
+        return sorted(self.index)
+
+    def record_bytes(self, name: str) -> bytes:
+        entry = self.index[name]
+        return self._mmap[entry["offset"]:entry["offset"] + entry["length"]]
+
+    def get_graph(self, name: str) -> Optional[CompactAIFGraph]:
+        entry = self.index.get(name)
+        if entry is None or not entry["valid"]:
+            return None
+
+        offset = entry["offset"]
+        arrays = {}
+        for array_name, (relative_offset, count) in zip(ARRAY_NAMES, entry["arrays"]):
+            arrays[array_name] = np.frombuffer(self._mmap, dtype=np.int32, count=count, offset=offset + relative_offset)
+        meta_offset = offset + entry["meta_offset"]
+        meta = json.loads(self._mmap[meta_offset:meta_offset + entry["meta_length"]])
+
+        return CompactAIFGraph(
+            node_ids=meta["node_ids"],
+            texts=[self.strings[position] for position in meta["texts"]],
+            types=meta["types"],
+            timestamps=meta["timestamps"],
+            schemes=meta["schemes"],
+            scheme_ids=meta["scheme_ids"],
+            node_extras={index: extras for index, extras in meta["node_extras"]},
+            num_nodes=meta["num_nodes"],
+            edge_ids=meta["edge_ids"],
+            sources=arrays["sources"],
+            targets=arrays["targets"],
+            form_edge_ids=meta["form_edge_ids"],
+            edge_extras={index: extras for index, extras in meta["edge_extras"]},
+            adjacency=(arrays["out_offsets"], arrays["out_edges"], arrays["in_offsets"], arrays["in_edges"]),
+        )
+
+    def find_pairs(self, resources_dir: Path) -> List[Tuple[Path, Path]]:
+        # Same pairs as dataset_parser.find_pairs, from the index instead of a directory scan
+        pairs: List[Tuple[Path, Path]] = []
+        for name in self.names():
+            if name.endswith(f"{ORACLE_FILE_POSTFIX}.json"):
+                continue
+            oracle_name = f"{Path(name).stem}{ORACLE_FILE_POSTFIX}.json"
+            if oracle_name in self.index:
+                pairs.append((resources_dir / name, resources_dir / oracle_name))
+        return pairs
+
+    def close(self) -> None:
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Graphs handed out still reference the mapping, it is released with them
+            pass
+        self._file.close()
+
+@lru_cache(maxsize=4)
+def open_corpus(path: str) -> Corpus:
+    # One mapping per corpus file and process, shared by all graphs loaded from it
+    return Corpus(Path(path))
+
+class StringTable:
+    # Append-only, so records copied from the previous corpus keep pointing at the same positions
+
+    def __init__(self, strings: Optional[List[str]] = None):
+        self.strings: List[str] = list(strings or [])
+        self.positions: Dict[str, int] = {text: position for position, text in enumerate(self.strings)}
+
+    def intern(self, text: str) -> int:
+        position = self.positions.get(text)
+        if position is None:
+            position = len(self.strings)
+            self.positions[text] = position
+            self.strings.append(text)
+        return position
+
+def encode_graph(graph: Optional[CompactAIFGraph], strings: StringTable) -> Tuple[bytes, Dict[str, Any]]:
+    if graph is None:
+        return b"", {"valid": False, "arrays": [], "meta_offset": 0, "meta_length": 0}
+
+    arrays = (graph.sources, graph.targets, graph.out_offsets, graph.out_edges, graph.in_offsets, graph.in_edges)
+    blob = bytearray()
+    layout = []
+    for array in arrays:
+        data = np.ascontiguousarray(array, dtype=np.int32).tobytes()
+        layout.append([len(blob), len(data) // 4])
+        blob += data
+        blob += b"\0" * (-len(blob) % ALIGNMENT)
+
+    meta = json.dumps({
+        "node_ids": graph.node_ids,
+        "texts": [strings.intern(text) for text in graph.texts],
+        "types": graph.types,
+        "timestamps": graph.timestamps,
+        "schemes": graph.schemes,
+        "scheme_ids": graph.scheme_ids,
+        "node_extras": sorted(graph.node_extras.items()),
+        "num_nodes": graph.num_nodes,
+        "edge_ids": graph.edge_ids,
+        "form_edge_ids": graph.form_edge_ids,
+        "edge_extras": sorted(graph.edge_extras.items()),
+    }, ensure_ascii=False).encode("utf-8")
+    entry = {"valid": True, "arrays": layout, "meta_offset": len(blob), "meta_length": len(meta)}
+    blob += meta
+    blob += b"\0" * (-len(blob) % ALIGNMENT)
+    return bytes(blob), entry
+
+def parse_source_file(content: bytes) -> Optional[CompactAIFGraph]:
+    # Mirrors get_aif_graph_from_path, where unreadable JSON is parsed as an empty object
+    try:
+        obj = json.loads(content.decode("utf-8"))
+    except Exception as e:
+        print(f"  Failed parsing JSON: {e}")
+        obj = {}
+    return parse_aif_json(obj, compact=True)
+
+def load_existing_corpus(corpus_path: Path) -> Optional[Corpus]:
+    if not corpus_path.exists():
+        return None
+    try:
+        return Corpus(corpus_path)
+    except Exception as e:
+        print(f"Ignoring unreadable corpus {corpus_path}: {e}")
+        return None
+
+def compile_corpus(resources_dir: Path, corpus_path: Path) -> Corpus:
+    existing = load_existing_corpus(corpus_path)
+    keys = [NODES_KEY, EDGES_KEY]
+    if existing is not None and existing.keys != keys:
+        print(f"Corpus {corpus_path.name} was parsed with keys {existing.keys}, re-parsing with {keys}")
+        existing.close()
+        existing = None
+    old_index = existing.index if existing is not None else {}
+    strings = StringTable(existing.strings if existing is not None else None)
+
+    records: List[Tuple[str, Dict[str, Any], Optional[bytes]]] = []
+    changed = 0
+    for source in sorted(resources_dir.glob("*.json")):
+        stat = source.stat()
+        old = old_index.get(source.name)
+        if old is not None and old["mtime_ns"] == stat.st_mtime_ns and old["size"] == stat.st_size:
+            records.append((source.name, old, None))
+            continue
+
+        content = source.read_bytes()
+        digest = hashlib.sha256(content).hexdigest()
+        if old is not None and old["sha256"] == digest:
+            # Touched but not changed
+            records.append((source.name, dict(old, mtime_ns=stat.st_mtime_ns, size=stat.st_size), None))
+            changed += 1
+            continue
+
+        blob, entry = encode_graph(parse_source_file(content), strings)
+        entry.update({"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": digest})
+        records.append((source.name, entry, blob))
+        changed += 1
+
+    removed = len(old_index.keys() - {name for name, _, _ in records})
+    if existing is not None and changed == 0 and removed == 0:
+        print(f"Corpus {corpus_path.name} is up to date ({len(records)} files)")
+        return existing
+
+    corpus_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = corpus_path.with_suffix(corpus_path.suffix + ".tmp")
+    index: Dict[str, Dict[str, Any]] = {}
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * HEADER.size)
+        f.write(b"\0" * (-HEADER.size % ALIGNMENT))
+        for name, entry, blob in records:
+            if blob is None:
+                blob = existing.record_bytes(name)
+            entry = dict(entry, offset=f.tell(), length=len(blob))
+            f.write(blob)
+            index[name] = entry
+
+        header = {"keys": keys, "strings": strings.strings, "files": index}
+        index_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        index_offset = f.tell()
+        f.write(index_bytes)
+        f.seek(0)
+        f.write(HEADER.pack(CORPUS_MAGIC, index_offset, len(index_bytes)))
+
+    if existing is not None:
+        existing.close()
+    os.replace(tmp_path, corpus_path)
+    open_corpus.cache_clear()
+    print(f"Compiled corpus {corpus_path.name}: {len(records)} files, {changed} re-parsed or refreshed, {removed} removed")
+    return Corpus(corpus_path)
+
+def main(argv=None):
+    print("Compiling the benchmark corpus with argv=", argv)
+    if ROOT_DIR and ROOT_DIR != "NONE":
+        root = Path(ROOT_DIR)
+    else:
+        root = Path(__file__).resolve().parents[3]
+    resources_dir = root / RESOURCES_DIR
+
+    if not resources_dir.exists():
+        print(f"Resources directory {RESOURCES_DIR} not found")
+        return
+    compile_corpus(resources_dir, root / CORPUS_FILE)
+    print("Exiting...")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 from pathlib import Path
-from typing import Dict, Any, List, Tuple, Optional
+from typing import Dict, Any, List, Tuple, Optional, Union
 
-from .models import AIFNode, AIFEdge, AIFGraph
+from .models import AIFNode, AIFEdge, AIFGraph, CompactAIFGraph
 from .test_config import NODES_KEY, EDGES_KEY, ORACLE_FILE_POSTFIX
 from shared.parser import read_json_file
 
@@ -18,7 +18,7 @@ def extract_edges(aif_json: Dict[str, Any]) -> List[Dict[str, Any]]:
     edges = aif_json.get(EDGES_KEY, [])
     return edges if isinstance(edges, list) else []
 
-def parse_aif_json(aif_json: Any) -> Optional[AIFGraph]:
+def parse_aif_json(aif_json: Any, compact: bool = False) -> Optional[Union[AIFGraph, CompactAIFGraph]]:
     try:
         if not isinstance(aif_json, dict):
             return None
@@ -31,6 +31,9 @@ def parse_aif_json(aif_json: Any) -> Optional[AIFGraph]:
         if not all(isinstance(e, dict) for e in raw_edges):
             return None
 
+        if compact:
+            return CompactAIFGraph.from_dict_lists(raw_nodes, raw_edges)
+
         nodes = [AIFNode.from_dict(d) for d in raw_nodes]
         edges = [AIFEdge.from_dict(d) for d in raw_edges]
 
@@ -40,9 +43,9 @@ def parse_aif_json(aif_json: Any) -> Optional[AIFGraph]:
         print("Failed to parse AIF JSON: %s", e)
         return None
 
-def get_aif_graph_from_path(path: str) -> AIFGraph:
+def get_aif_graph_from_path(path: str, compact: bool = False) -> Union[AIFGraph, CompactAIFGraph]:
     obj = read_json_file(path)
-    return parse_aif_json(obj)
+    return parse_aif_json(obj, compact=compact)
 
 def find_pairs(resources_dir: Path) -> List[Tuple[Path, Path]]:
     pairs: List[Tuple[Path, Path]] = []
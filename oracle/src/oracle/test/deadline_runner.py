@@ -0,0 +1,146 @@
+import multiprocessing
+import time
+from dataclasses import dataclass
+from multiprocessing.connection import Connection, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+"""
+    Runs jobs in their own processes and kills them at their deadline
+    Every job gets a hard time limit (`max_time`) and, with a global `budget`, a share of the remaining budget relative
+    to its weight. A job calls `report(payload)` for intermediate values; the last reported value is kept when the job
+    is killed. Jobs that cannot start before the budget runs out are skipped.
+"""
+SOFT_TIMEOUT_SHARE = 0.9
+KILL_GRACE = 0.5
+
+@dataclass
+class DeadlineJob:
+
+    target: Callable[..., Any]
+    args: Tuple[Any, ...]
+    weight: float = 1.0
+    max_time: Optional[float] = None
+
+@dataclass
+class DeadlineOutcome:
+
+    result: Any = None
+    progress: Any = None
+    allotted: float = 0.0
+    elapsed: float = 0.0
+    killed: bool = False
+    skipped: bool = False
+    error: Optional[str] = None
+
+def run_job(connection: Connection, target: Callable[..., Any], args: Tuple[Any, ...], soft_timeout: Optional[float]) -> None:
+    # Entry point of the job process, `target` is called as target(*args, soft_timeout, report)
+    def report(payload: Any) -> None:
+        connection.send(("progress", payload))
+
+    try:
+        connection.send(("result", target(*args, soft_timeout, report)))
+    except Exception as e:
+        connection.send(("error", repr(e)))
+    finally:
+        connection.close()
+
+def allot_time(job: DeadlineJob, budget_left: Optional[float], pending_weight: float, workers: int) -> Optional[float]:
+    if budget_left is None:
+        return job.max_time
+    share = budget_left * workers * job.weight / pending_weight if pending_weight > 0 else budget_left
+    allotted = min(share, budget_left)
+    return min(allotted, job.max_time) if job.max_time is not None else allotted
+
+def run_with_deadlines(
+    jobs: List[DeadlineJob],
+    workers: int,
+    budget: Optional[float] = None,
+    merge_progress: Callable[[Any, Any], Any] = lambda previous, payload: payload,
+    on_done: Optional[Callable[[int, DeadlineOutcome], None]] = None
+) -> List[DeadlineOutcome]:
+    context = multiprocessing.get_context()
+    outcomes: List[Optional[DeadlineOutcome]] = [None] * len(jobs)
+    pending = list(range(len(jobs)))
+    pending_weight = sum(job.weight for job in jobs)
+    running: Dict[int, Dict[str, Any]] = {}
+    start = time.time()
+
+    def finish(index: int, outcome: DeadlineOutcome) -> None:
+        outcomes[index] = outcome
+        if on_done is not None:
+            on_done(index, outcome)
+
+    def drain(state: Dict[str, Any]) -> None:
+        connection = state["connection"]
+        try:
+            while connection.poll():
+                kind, payload = connection.recv()
+                if kind == "progress":
+                    state["outcome"].progress = merge_progress(state["outcome"].progress, payload)
+                elif kind == "result":
+                    state["outcome"].result = payload
+                else:
+                    state["outcome"].error = payload
+        except (EOFError, OSError):
+            pass
+
+    while pending or running:
+        while pending and len(running) < workers:
+            index = pending.pop(0)
+            job = jobs[index]
+            budget_left = budget - (time.time() - start) if budget is not None else None
+            allotted = allot_time(job, budget_left, pending_weight, workers)
+            pending_weight -= job.weight
+            if allotted is not None and allotted <= 0:
+                finish(index, DeadlineOutcome(skipped=True))
+                continue
+
+            receiver, sender = context.Pipe(duplex=False)
+            soft_timeout = allotted * SOFT_TIMEOUT_SHARE if allotted is not None else None
+            # Not a daemon, so that a job can start its own worker processes (e.g. per connected component)
+            process = context.Process(target=run_job, args=(sender, job.target, job.args, soft_timeout), daemon=False)
+            process.start()
+            sender.close()
+            now = time.time()
+            running[index] = {
+                "process": process,
+                "connection": receiver,
+                "started": now,
+                "deadline": now + allotted if allotted is not None else None,
+                "outcome": DeadlineOutcome(allotted=allotted or 0.0),
+            }
+
+        if not running:
+            continue
+
+        deadlines = [state["deadline"] for state in running.values() if state["deadline"] is not None]
+        wait_for = max(0.0, min(deadlines) - time.time()) if deadlines else None
+        wait([state["connection"] for state in running.values()] + [state["process"].sentinel for state in running.values()],
+             timeout=wait_for)
+
+        now = time.time()
+        for index in list(running):
+            state = running[index]
+            drain(state)
+            process = state["process"]
+            expired = state["deadline"] is not None and now >= state["deadline"]
+            if process.is_alive() and expired and state["outcome"].result is None:
+                process.terminate()
+                process.join(KILL_GRACE)
+                if process.is_alive():
+                    process.kill()
+                state["outcome"].killed = True
+            if process.is_alive():
+                continue
+
+            process.join()
+            drain(state)
+            state["connection"].close()
+            outcome = state["outcome"]
+            outcome.elapsed = time.time() - state["started"]
+            if outcome.result is None and not outcome.killed and outcome.error is None:
+                outcome.error = f"Worker exited with code {process.exitcode}"
+            del running[index]
+            finish(index, outcome)
+
+    return outcomes
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import tempfile
+from dataclasses import asdict
+from pathlib import Path
+from typing import Optional, Dict, Any, Union
+
+from .ged_calculator import GEDResult, cost_model_fingerprint
+from .models import AIFGraph, CompactAIFGraph
+
+GED_CACHE_MODE_USE = "use"
+GED_CACHE_MODE_REBUILD = "rebuild"
+GED_CACHE_MODE_BYPASS = "bypass"
+GED_CACHE_MODES = (GED_CACHE_MODE_USE, GED_CACHE_MODE_REBUILD, GED_CACHE_MODE_BYPASS)
+
+def ged_cache_key(
+    graph_a: Union[AIFGraph, CompactAIFGraph],
+    graph_b: Union[AIFGraph, CompactAIFGraph],
+    settings: Dict[str, Any]
+) -> str:
+    # `settings` holds every comparison parameter that can change the result, e.g. timeout, rounding and engine
+    content = json.dumps({
+        "benchmark_graph": graph_a.canonical_hash(),
+        "oracle_graph": graph_b.canonical_hash(),
+        "cost_model": cost_model_fingerprint(),
+        "settings": settings,
+    }, sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+"""
+    Content-addressed on-disk cache of GED results
+    Every result is stored in its own <key>.json file so that worker processes can write to the cache concurrently.
+    Reading a result refreshes its modification time, evict() removes the least recently used results first.
+"""
+class GEDCache:
+
+    def __init__(self, cache_dir: Path, mode: str = GED_CACHE_MODE_USE, max_bytes: int = 100 * 1024 * 1024):
+        if mode not in GED_CACHE_MODES:
+            raise ValueError(f"Unknown GED cache mode {mode}, expected one of {GED_CACHE_MODES}")
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != GED_CACHE_MODE_BYPASS
+
+    def path_for(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> Optional[GEDResult]:
+        if self.mode != GED_CACHE_MODE_USE:
+            return None
+        path = self.path_for(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            os.utime(path)
+            return GEDResult(**data)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"  Ignoring unreadable GED cache entry {path.name}: {e}")
+            return None
+
+    def put(self, key: str, result: GEDResult) -> None:
+        if not self.enabled or result.ged == -1.0:
+            return
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(asdict(result), f)
+            os.replace(tmp_path, self.path_for(key))
+        except Exception as e:
+            print(f"  Failed to write GED cache entry {key}: {e}")
+
+    def evict(self) -> int:
+        if not self.enabled or not self.cache_dir.exists():
+            return 0
+        entries = []
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        return evicted
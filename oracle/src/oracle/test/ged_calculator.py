@@ -1,9 +1,22 @@
-from typing import Dict, Any, Optional
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+import hashlib
+import json
+from typing import Dict, Any, Optional, List, Callable, Union
 import time
+import warnings
 import networkx as nx
+import numpy as np
 from difflib import SequenceMatcher
+from scipy.optimize import linear_sum_assignment
 
-from .models import AIFNode, AIFEdge, AIFGraph
+from .models import AIFNode, AIFEdge, AIFGraph, CompactAIFGraph
+
+TEXT_SIMILARITY_THRESHOLD = 0.95
+# Part of the GED cache keys, bump it when the cost functions, the bounds or the text normalisation change
+COST_MODEL_VERSION = 1
 
 """
     Implementation inspired by: https://networkx.org/documentation/stable/reference/algorithms/generated/networkx.algorithms.similarity.graph_edit_distance.html
@@ -20,7 +33,7 @@ def node_subst_cost(attr1: Dict[str, Any], attr2: Dict[str, Any]) -> float:
     type2, text2 = extract_type_text(attr2)
 
     sim = text_similarity_ratio(text1, text2)
-    text_similar = sim > 0.95
+    text_similar = sim > TEXT_SIMILARITY_THRESHOLD
     types_match = (type1 and type2 and type1 == type2)
 
     if text_similar and types_match:
@@ -62,11 +75,155 @@ def edge_ins_cost(attr: Dict[str, Any]) -> float:
 def edge_del_cost(attr: Dict[str, Any]) -> float:
     return 0.5
 
-def compute_ged_from_aif_graphs(aif1: AIFGraph, aif2: AIFGraph, timeout: float, round_digits: int) -> tuple[
-    float, float]:
+NODE_INDEX_ATTR = "cost_index"
+
+"""
+    Computes the node_subst_cost of every graph_1 x graph_2 node pair at once
+    Every node is normalised once, identical texts are only compared once and the cost rules of node_subst_cost are
+    applied to the whole similarity matrix with NumPy
+"""
+def build_node_subst_matrix(graph_1: nx.DiGraph, graph_2: nx.DiGraph) -> np.ndarray:
+    type_text_1 = [extract_type_text(graph_1.nodes[u]) for u in graph_1.nodes]
+    type_text_2 = [extract_type_text(graph_2.nodes[v]) for v in graph_2.nodes]
+
+    texts_1, text_codes_1 = unique_codes([text for _, text in type_text_1])
+    texts_2, text_codes_2 = unique_codes([text for _, text in type_text_2])
+    similarity = text_similarity_matrix(texts_1, texts_2)[np.ix_(text_codes_1, text_codes_2)]
+
+    types, type_codes = unique_codes([t for t, _ in type_text_1] + [t for t, _ in type_text_2])
+    type_codes_1 = type_codes[:len(type_text_1)]
+    type_codes_2 = type_codes[len(type_text_1):]
+    empty_type = types.index("") if "" in types else -1
+    types_match = (type_codes_1[:, None] == type_codes_2[None, :]) & (type_codes_1[:, None] != empty_type)
+
+    text_similar = similarity > TEXT_SIMILARITY_THRESHOLD
+    return np.where(
+        text_similar & types_match,
+        0.0,
+        np.where(text_similar | types_match, 1.0 - similarity, 1.0)
+    )
+
+def text_similarity_matrix(texts_1: List[str], texts_2: List[str]) -> np.ndarray:
+    similarity = np.zeros((len(texts_1), len(texts_2)))
+    matcher = SequenceMatcher(None)
+    for j, b in enumerate(texts_2):
+        if not b:
+            continue
+        # SequenceMatcher caches its analysis of the second sequence, so every column is only analysed once
+        matcher.set_seq2(b)
+        for i, a in enumerate(texts_1):
+            if a:
+                matcher.set_seq1(a)
+                similarity[i, j] = matcher.ratio()
+    return similarity
+
+def unique_codes(values: List[str]) -> tuple[List[str], np.ndarray]:
+    codes: Dict[str, int] = {}
+    indices = [codes.setdefault(value, len(codes)) for value in values]
+    return list(codes), np.array(indices, dtype=np.intp)
+
+"""
+    Returns a node_subst callback that looks the cost up in a precomputed matrix
+    The nodes of both graphs get their row/column index stored under NODE_INDEX_ATTR
+"""
+def make_node_subst_lookup(graph_1: nx.DiGraph, graph_2: nx.DiGraph) -> Callable[[Dict[str, Any], Dict[str, Any]], float]:
+    for index, u in enumerate(graph_1.nodes):
+        graph_1.nodes[u][NODE_INDEX_ATTR] = index
+    for index, v in enumerate(graph_2.nodes):
+        graph_2.nodes[v][NODE_INDEX_ATTR] = index
+
+    matrix = build_node_subst_matrix(graph_1, graph_2).tolist()
+
+    def node_subst_lookup(attr1: Dict[str, Any], attr2: Dict[str, Any]) -> float:
+        return matrix[attr1[NODE_INDEX_ATTR]][attr2[NODE_INDEX_ATTR]]
+
+    return node_subst_lookup
+
+GED_ENGINE_EXACT = "exact"
+GED_ENGINE_BIPARTITE = "bipartite"
+GED_ENGINES = (GED_ENGINE_EXACT, GED_ENGINE_BIPARTITE)
+
+"""
+    Result of a single graph comparison
+    `ged` is the value reported as the distance. The bounds are None when they are not known
+"""
+@dataclass
+class GEDResult:
+
+    ged: float
+    elapsed: float
+    lower_bound: Optional[float] = None
+    upper_bound: Optional[float] = None
+    shortcut: Optional[str] = None
+    components: Optional[int] = None
+
+def compute_ged_from_aif_graphs(
+    aif1: Union[AIFGraph, CompactAIFGraph],
+    aif2: Union[AIFGraph, CompactAIFGraph],
+    timeout: float,
+    round_digits: int,
+    engine: str = GED_ENGINE_EXACT,
+    shortcuts: bool = True,
+    shortcut_size_ratio: float = 0.0,
+    decompose: bool = False,
+    component_workers: int = 1,
+    progress: Optional[Callable[[float, Optional[float]], None]] = None
+) -> GEDResult:
+    start = time.time()
     graph_1 = aif1.to_networkx(attach_objects=True)
     graph_2 = aif2.to_networkx(attach_objects=True)
-    return compute_ged(graph_1, graph_2, timeout=timeout, round_digits=round_digits)
+    node_subst = make_node_subst_lookup(graph_1, graph_2)
+
+    if shortcuts:
+        shortcut_result = compute_shortcut_ged(graph_1, graph_2, node_subst, round_digits, shortcut_size_ratio)
+        if shortcut_result is not None:
+            shortcut_result.elapsed = time.time() - start
+            return shortcut_result
+
+    if decompose:
+        components_1 = weakly_connected_subgraphs(graph_1)
+        components_2 = weakly_connected_subgraphs(graph_2)
+        if len(components_1) > 1 or len(components_2) > 1:
+            result = compute_decomposed_ged(
+                graph_1, graph_2, components_1, components_2, node_subst, engine, timeout, round_digits,
+                component_workers
+            )
+            result.elapsed = time.time() - start
+            return result
+
+    if progress is not None and engine == GED_ENGINE_EXACT:
+        # The bipartite bounds take milliseconds and are the best-so-far values until the search improves on them
+        upper, lower, _ = compute_approximate_ged(graph_1, graph_2, node_subst=node_subst, round_digits=round_digits)
+        progress(upper, lower)
+
+    return run_ged_engine(graph_1, graph_2, node_subst, engine, timeout, round_digits, progress)
+
+def run_ged_engine(
+    graph_1: nx.DiGraph,
+    graph_2: nx.DiGraph,
+    node_subst: Callable,
+    engine: str,
+    timeout: float,
+    round_digits: int,
+    progress: Optional[Callable[[float, Optional[float]], None]] = None
+) -> GEDResult:
+    if engine == GED_ENGINE_BIPARTITE:
+        upper, lower, elapsed = compute_approximate_ged(
+            graph_1, graph_2, node_subst=node_subst, round_digits=round_digits
+        )
+        return GEDResult(ged=upper, elapsed=elapsed, lower_bound=lower, upper_bound=upper)
+
+    if engine != GED_ENGINE_EXACT:
+        raise ValueError(f"Unknown GED engine {engine}, expected one of {GED_ENGINES}")
+
+    ged_value, elapsed = compute_ged(
+        graph_1, graph_2, timeout=timeout, node_subst=node_subst, round_digits=round_digits, progress=progress
+    )
+    if ged_value == -1.0:
+        return GEDResult(ged=ged_value, elapsed=elapsed)
+    # networkx returns the best distance found so far when the timeout is hit, so it is only exact if the search finished
+    lower_bound = ged_value if timeout is None or elapsed < timeout else None
+    return GEDResult(ged=ged_value, elapsed=elapsed, lower_bound=lower_bound, upper_bound=ged_value)
 
 def compute_ged(
     graph_1: nx.DiGraph,
@@ -79,24 +236,42 @@ def compute_ged(
     edge_subst=edge_subst_cost,
     edge_ins=edge_ins_cost,
     edge_del=edge_del_cost,
-    round_digits: int = 2
+    round_digits: int = 2,
+    progress: Optional[Callable[[float, Optional[float]], None]] = None
 ) -> tuple[float, float]:
 
     start = time.time()
     ged_result = None
 
     try:
-        ged_result = nx.graph_edit_distance(
-            graph_1,
-            graph_2,
-            node_subst_cost=node_subst,
-            node_ins_cost=node_ins,
-            node_del_cost=node_del,
-            edge_subst_cost=edge_subst,
-            edge_ins_cost=edge_ins,
-            edge_del_cost=edge_del,
-            timeout=timeout,
-        )
+        if progress is None:
+            ged_result = nx.graph_edit_distance(
+                graph_1,
+                graph_2,
+                node_subst_cost=node_subst,
+                node_ins_cost=node_ins,
+                node_del_cost=node_del,
+                edge_subst_cost=edge_subst,
+                edge_ins_cost=edge_ins,
+                edge_del_cost=edge_del,
+                timeout=timeout,
+            )
+        else:
+            # Same search as graph_edit_distance, reporting every improved edit path as a best-so-far upper bound
+            for _, _, cost in nx.optimize_edit_paths(
+                graph_1,
+                graph_2,
+                node_subst_cost=node_subst,
+                node_ins_cost=node_ins,
+                node_del_cost=node_del,
+                edge_subst_cost=edge_subst,
+                edge_ins_cost=edge_ins,
+                edge_del_cost=edge_del,
+                strictly_decreasing=True,
+                timeout=timeout,
+            ):
+                ged_result = cost
+                progress(round(float(cost), round_digits), None)
     except Exception as ex:
         print("  An exception occured when calculating the GED:", ex)
 
@@ -104,3 +279,391 @@ def compute_ged(
     if ged_result is None:
         return -1.0, elapsed
     return round(float(ged_result), round_digits), elapsed
+
+SHORTCUT_EMPTY = "empty graph"
+SHORTCUT_IDENTICAL = "identical structure"
+SHORTCUT_SIZE_MISMATCH = "size mismatch"
+WL_ITERATIONS = 3
+WL_LABEL_ATTR = "wl_label"
+
+"""
+    Decides in near-linear time whether the expensive GED search can be skipped
+    - empty graph: one of the graphs is empty, so the only edit path inserts or deletes everything
+    - identical structure: node/edge counts and Weisfeiler-Lehman hashes over normalised type and text match and the
+      WL node labels give a mapping that is verified to be an isomorphism with zero node substitution costs. The cost of
+      that edit path is exact for this cost model, as every edge is substituted at its cheapest cost
+    - size mismatch: the node counts differ by more than `size_ratio` times (disabled when 0). The pair is trivially far
+      apart, so the bipartite bounds are reported instead of running the search
+    Returns None when the search is still needed
+"""
+def compute_shortcut_ged(
+    graph_1: nx.DiGraph,
+    graph_2: nx.DiGraph,
+    node_subst: Callable,
+    round_digits: int,
+    size_ratio: float = 0.0
+) -> Optional[GEDResult]:
+    n, m = graph_1.number_of_nodes(), graph_2.number_of_nodes()
+
+    if n == 0 or m == 0:
+        cost = induced_edit_path_cost(
+            graph_1, graph_2, {}, node_subst, node_ins_cost, node_del_cost, edge_subst_cost, edge_ins_cost, edge_del_cost
+        )
+        cost = round(cost, round_digits)
+        return GEDResult(ged=cost, elapsed=0.0, lower_bound=cost, upper_bound=cost, shortcut=SHORTCUT_EMPTY)
+
+    if n == m and graph_1.number_of_edges() == graph_2.number_of_edges():
+        mapping = find_identical_structure_mapping(graph_1, graph_2, node_subst)
+        if mapping is not None:
+            cost = induced_edit_path_cost(
+                graph_1, graph_2, mapping, node_subst, node_ins_cost, node_del_cost, edge_subst_cost, edge_ins_cost,
+                edge_del_cost
+            )
+            cost = round(cost, round_digits)
+            return GEDResult(ged=cost, elapsed=0.0, lower_bound=cost, upper_bound=cost, shortcut=SHORTCUT_IDENTICAL)
+
+    if size_ratio > 0 and max(n, m) > size_ratio * min(n, m):
+        upper, lower, _ = compute_approximate_ged(graph_1, graph_2, node_subst=node_subst, round_digits=round_digits)
+        return GEDResult(ged=upper, elapsed=0.0, lower_bound=lower, upper_bound=upper, shortcut=SHORTCUT_SIZE_MISMATCH)
+
+    return None
+
+def find_identical_structure_mapping(graph_1: nx.DiGraph, graph_2: nx.DiGraph, node_subst: Callable) -> Optional[Dict[Any, Any]]:
+    for graph in (graph_1, graph_2):
+        for u in graph.nodes:
+            node_type, text = extract_type_text(graph.nodes[u])
+            graph.nodes[u][WL_LABEL_ATTR] = f"{node_type}|{text}"
+
+    # networkx >= 3.5 warns on every directed hash that the hashes differ from older versions, both sides use the same one
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        hash_1 = nx.weisfeiler_lehman_graph_hash(graph_1, node_attr=WL_LABEL_ATTR, iterations=WL_ITERATIONS)
+        hash_2 = nx.weisfeiler_lehman_graph_hash(graph_2, node_attr=WL_LABEL_ATTR, iterations=WL_ITERATIONS)
+        if hash_1 != hash_2:
+            return None
+
+        # The WL node labels determine the mapping when every node of a graph ends up with a distinct label.
+        # Otherwise (e.g. repeated scheme nodes) a VF2 search restricted to nodes with equal WL labels finds it
+        labels_1 = wl_node_labels(graph_1)
+        labels_2 = wl_node_labels(graph_2)
+    by_label_2 = {label: v for v, label in labels_2.items()}
+    if len(set(labels_1.values())) == len(labels_1) and len(by_label_2) == len(labels_2):
+        if any(label not in by_label_2 for label in labels_1.values()):
+            return None
+        mapping = {u: by_label_2[label] for u, label in labels_1.items()}
+    else:
+        for graph, labels in ((graph_1, labels_1), (graph_2, labels_2)):
+            for u, label in labels.items():
+                graph.nodes[u][WL_LABEL_ATTR] = label
+        matcher = nx.algorithms.isomorphism.DiGraphMatcher(
+            graph_1, graph_2, node_match=lambda a1, a2: a1[WL_LABEL_ATTR] == a2[WL_LABEL_ATTR]
+        )
+        mapping = next(matcher.isomorphisms_iter(), None)
+        if mapping is None:
+            return None
+
+    for a, b in graph_1.edges:
+        if not graph_2.has_edge(mapping[a], mapping[b]):
+            return None
+    for u, v in mapping.items():
+        if node_subst(graph_1.nodes[u], graph_2.nodes[v]) != 0.0:
+            return None
+    return mapping
+
+def wl_node_labels(graph: nx.DiGraph) -> Dict[Any, str]:
+    # Both directions are included, as the networkx subgraph hashes of a DiGraph only follow the successors
+    successors = nx.weisfeiler_lehman_subgraph_hashes(graph, node_attr=WL_LABEL_ATTR, iterations=WL_ITERATIONS)
+    predecessors = nx.weisfeiler_lehman_subgraph_hashes(
+        graph.reverse(copy=False), node_attr=WL_LABEL_ATTR, iterations=WL_ITERATIONS
+    )
+    return {
+        u: f"{graph.nodes[u][WL_LABEL_ATTR]}|{successors[u][-1]}|{predecessors[u][-1]}"
+        for u in graph.nodes
+    }
+
+def weakly_connected_subgraphs(graph: nx.DiGraph) -> List[nx.DiGraph]:
+    # Copies, so that every component has its own attribute dicts and can be sent to a worker process
+    return [graph.subgraph(nodes).copy() for nodes in nx.weakly_connected_components(graph)]
+
+def component_size(graph: nx.DiGraph) -> int:
+    return graph.number_of_nodes() + graph.number_of_edges()
+
+def component_signature_distance(graph_1: nx.DiGraph, graph_2: nx.DiGraph) -> float:
+    # Cheap estimate of how many nodes and edges have to be edited, from node type counts and edge counts
+    types_1 = Counter(extract_type_text(graph_1.nodes[u])[0] for u in graph_1.nodes)
+    types_2 = Counter(extract_type_text(graph_2.nodes[v])[0] for v in graph_2.nodes)
+    type_difference = sum(abs(types_1[t] - types_2[t]) for t in types_1.keys() | types_2.keys())
+    return type_difference + abs(graph_1.number_of_edges() - graph_2.number_of_edges())
+
+def match_components(components_1: List[nx.DiGraph], components_2: List[nx.DiGraph]) -> List[tuple[Optional[int], Optional[int]]]:
+    # Assigns components to each other or to deletion/insertion by their signatures
+    k1, k2 = len(components_1), len(components_2)
+    cost = np.full((k1 + k2, k1 + k2), np.inf)
+    cost[k1:, k2:] = 0.0
+    for i, c1 in enumerate(components_1):
+        for j, c2 in enumerate(components_2):
+            cost[i, j] = component_signature_distance(c1, c2)
+        cost[i, k2 + i] = component_size(c1)
+    for j, c2 in enumerate(components_2):
+        cost[k1 + j, j] = component_size(c2)
+
+    rows, cols = linear_sum_assignment(cost)
+    matches = []
+    for r, c in zip(rows, cols):
+        if r < k1 and c < k2:
+            matches.append((r, c))
+        elif r < k1:
+            matches.append((r, None))
+        elif c < k2:
+            matches.append((None, c))
+    return matches
+
+def compute_component_pair_ged(
+    component_1: nx.DiGraph,
+    component_2: nx.DiGraph,
+    engine: str,
+    timeout: Optional[float],
+    round_digits: int
+) -> GEDResult:
+    node_subst = make_node_subst_lookup(component_1, component_2)
+    if timeout is not None and timeout <= 0:
+        engine = GED_ENGINE_BIPARTITE
+    result = run_ged_engine(component_1, component_2, node_subst, engine, timeout, round_digits)
+    if result.ged == -1.0 and engine != GED_ENGINE_BIPARTITE:
+        # No edit path found within the share of the timeout
+        result = run_ged_engine(component_1, component_2, node_subst, GED_ENGINE_BIPARTITE, timeout, round_digits)
+    return result
+
+"""
+    GED over weakly connected components
+    Components are matched by cheap signatures and the GED is computed per matched pair, unmatched components are
+    deleted/inserted as a whole. Joining the edit paths of the pairs gives an edit path of the whole graphs, so the sum of
+    the component upper bounds is an upper bound on the GED. An optimal edit path may map nodes across components, so
+    the component results do not bound the GED from below; the lower bound is the bipartite lower bound of the whole graphs.
+    The pairs share the timeout in proportion to their size (like allot_time of the deadline runner), sequentially every
+    pair gets its share of the time that is left, so the whole decomposition stays within the timeout. A pair whose
+    share is used up, or whose search finds no edit path in time, falls back to the bipartite upper bound.
+"""
+def compute_decomposed_ged(
+    graph_1: nx.DiGraph,
+    graph_2: nx.DiGraph,
+    components_1: List[nx.DiGraph],
+    components_2: List[nx.DiGraph],
+    node_subst: Callable,
+    engine: str,
+    timeout: float,
+    round_digits: int,
+    workers: int = 1
+) -> GEDResult:
+    matches = match_components(components_1, components_2)
+    matched = [(components_1[i], components_2[j]) for i, j in matches if i is not None and j is not None]
+
+    upper = 0.0
+    for i, j in matches:
+        if j is None:
+            upper += induced_edit_path_cost(components_1[i], nx.DiGraph(), {}, node_subst_cost, node_ins_cost,
+                                            node_del_cost, edge_subst_cost, edge_ins_cost, edge_del_cost)
+        elif i is None:
+            upper += induced_edit_path_cost(nx.DiGraph(), components_2[j], {}, node_subst_cost, node_ins_cost,
+                                            node_del_cost, edge_subst_cost, edge_ins_cost, edge_del_cost)
+
+    weights = [component_size(c1) + component_size(c2) for c1, c2 in matched]
+    if workers > 1 and len(matched) > 1:
+        workers = min(workers, len(matched))
+        shares = [
+            None if timeout is None else min(timeout, timeout * workers * weight / max(1, sum(weights)))
+            for weight in weights
+        ]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(compute_component_pair_ged, c1, c2, engine, share, round_digits)
+                for (c1, c2), share in zip(matched, shares)
+            ]
+            component_results = [future.result() for future in futures]
+    else:
+        deadline = time.time() + timeout if timeout is not None else None
+        pending_weight = sum(weights)
+        component_results = []
+        for (c1, c2), weight in zip(matched, weights):
+            share = None
+            if deadline is not None:
+                share = max(0.0, deadline - time.time()) * weight / max(1, pending_weight)
+            component_results.append(compute_component_pair_ged(c1, c2, engine, share, round_digits))
+            pending_weight -= weight
+
+    for result in component_results:
+        if result.ged == -1.0:
+            return GEDResult(ged=-1.0, elapsed=0.0, components=len(matches))
+        upper += result.upper_bound
+
+    whole_upper, whole_lower, _ = compute_approximate_ged(
+        graph_1, graph_2, node_subst=node_subst, round_digits=round_digits
+    )
+    upper = round(min(upper, whole_upper), round_digits)
+    return GEDResult(ged=upper, elapsed=0.0, lower_bound=whole_lower, upper_bound=upper, components=len(matches))
+
+"""
+    Bipartite GED approximation, see: https://doi.org/10.1016/j.imavis.2008.04.004
+    Every node of one graph is assigned to a node of the other graph or to deletion/insertion by solving a linear sum
+    assignment over node costs plus the optimal assignment cost of the incident edges.
+    With the edge part halved (every edge is shared by two nodes) the optimal assignment cost is a lower bound on the GED.
+    The cost of the complete edit path induced by the node assignment is an upper bound.
+"""
+def compute_approximate_ged(
+    graph_1: nx.DiGraph,
+    graph_2: nx.DiGraph,
+    *,
+    node_subst=node_subst_cost,
+    node_ins=node_ins_cost,
+    node_del=node_del_cost,
+    edge_subst=edge_subst_cost,
+    edge_ins=edge_ins_cost,
+    edge_del=edge_del_cost,
+    round_digits: int = 2
+) -> tuple[float, float, float]:
+
+    start = time.time()
+    nodes_1 = list(graph_1.nodes)
+    nodes_2 = list(graph_2.nodes)
+    n, m = len(nodes_1), len(nodes_2)
+
+    if n + m == 0:
+        return 0.0, 0.0, time.time() - start
+
+    edge_subst_matrix, edge_del_costs, edge_ins_costs, edge_index_1, edge_index_2 = edge_cost_tables(
+        graph_1, graph_2, edge_subst, edge_ins, edge_del
+    )
+
+    out_1 = [[edge_index_1[e] for e in graph_1.out_edges(u)] for u in nodes_1]
+    in_1 = [[edge_index_1[e] for e in graph_1.in_edges(u)] for u in nodes_1]
+    out_2 = [[edge_index_2[e] for e in graph_2.out_edges(v)] for v in nodes_2]
+    in_2 = [[edge_index_2[e] for e in graph_2.in_edges(v)] for v in nodes_2]
+
+    cost = np.full((n + m, n + m), np.inf)
+    cost[n:, m:] = 0.0
+    for i, u in enumerate(nodes_1):
+        for j, v in enumerate(nodes_2):
+            local_edges = (
+                edge_assignment_cost(out_1[i], out_2[j], edge_subst_matrix, edge_del_costs, edge_ins_costs)
+                + edge_assignment_cost(in_1[i], in_2[j], edge_subst_matrix, edge_del_costs, edge_ins_costs)
+            )
+            cost[i, j] = node_subst(graph_1.nodes[u], graph_2.nodes[v]) + local_edges / 2
+        incident = edge_del_costs[out_1[i]].sum() + edge_del_costs[in_1[i]].sum()
+        cost[i, m + i] = node_del(graph_1.nodes[u]) + incident / 2
+    for j, v in enumerate(nodes_2):
+        incident = edge_ins_costs[out_2[j]].sum() + edge_ins_costs[in_2[j]].sum()
+        cost[n + j, j] = node_ins(graph_2.nodes[v]) + incident / 2
+
+    rows, cols = linear_sum_assignment(cost)
+    lower_bound = float(cost[rows, cols].sum())
+
+    mapping: Dict[Any, Any] = {}
+    for r, c in zip(rows, cols):
+        if r < n and c < m:
+            mapping[nodes_1[r]] = nodes_2[c]
+
+    upper_bound = induced_edit_path_cost(
+        graph_1, graph_2, mapping, node_subst, node_ins, node_del, edge_subst, edge_ins, edge_del
+    )
+
+    elapsed = time.time() - start
+    return round(upper_bound, round_digits), round(lower_bound, round_digits), elapsed
+
+def edge_cost_tables(
+    graph_1: nx.DiGraph,
+    graph_2: nx.DiGraph,
+    edge_subst: Callable,
+    edge_ins: Callable,
+    edge_del: Callable
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, Dict[Any, int], Dict[Any, int]]:
+    edges_1 = list(graph_1.edges)
+    edges_2 = list(graph_2.edges)
+    attrs_1 = [graph_1.edges[e] for e in edges_1]
+    attrs_2 = [graph_2.edges[e] for e in edges_2]
+
+    subst_matrix = np.array(
+        [[edge_subst(a1, a2) for a2 in attrs_2] for a1 in attrs_1], dtype=float
+    ).reshape(len(edges_1), len(edges_2))
+    del_costs = np.array([edge_del(a) for a in attrs_1], dtype=float)
+    ins_costs = np.array([edge_ins(a) for a in attrs_2], dtype=float)
+
+    edge_index_1 = {e: k for k, e in enumerate(edges_1)}
+    edge_index_2 = {e: k for k, e in enumerate(edges_2)}
+    return subst_matrix, del_costs, ins_costs, edge_index_1, edge_index_2
+
+def edge_assignment_cost(
+    edges_1: List[int],
+    edges_2: List[int],
+    subst_matrix: np.ndarray,
+    del_costs: np.ndarray,
+    ins_costs: np.ndarray
+) -> float:
+    # Optimal cost of turning one set of incident edges into the other
+    if not edges_1:
+        return float(ins_costs[edges_2].sum())
+    if not edges_2:
+        return float(del_costs[edges_1].sum())
+    if len(edges_1) == 1 and len(edges_2) == 1:
+        a, b = edges_1[0], edges_2[0]
+        return float(min(subst_matrix[a, b], del_costs[a] + ins_costs[b]))
+
+    k1, k2 = len(edges_1), len(edges_2)
+    cost = np.full((k1 + k2, k1 + k2), np.inf)
+    cost[:k1, :k2] = subst_matrix[np.ix_(edges_1, edges_2)]
+    cost[k1:, k2:] = 0.0
+    cost[np.arange(k1), k2 + np.arange(k1)] = del_costs[edges_1]
+    cost[k1 + np.arange(k2), np.arange(k2)] = ins_costs[edges_2]
+    rows, cols = linear_sum_assignment(cost)
+    return float(cost[rows, cols].sum())
+
+def induced_edit_path_cost(
+    graph_1: nx.DiGraph,
+    graph_2: nx.DiGraph,
+    mapping: Dict[Any, Any],
+    node_subst: Callable,
+    node_ins: Callable,
+    node_del: Callable,
+    edge_subst: Callable,
+    edge_ins: Callable,
+    edge_del: Callable
+) -> float:
+    total = 0.0
+    for u in graph_1.nodes:
+        if u in mapping:
+            total += node_subst(graph_1.nodes[u], graph_2.nodes[mapping[u]])
+        else:
+            total += node_del(graph_1.nodes[u])
+    mapped_2 = set(mapping.values())
+    for v in graph_2.nodes:
+        if v not in mapped_2:
+            total += node_ins(graph_2.nodes[v])
+
+    matched_edges_2 = set()
+    for a, b in graph_1.edges:
+        target = (mapping.get(a), mapping.get(b))
+        if target[0] is not None and target[1] is not None and graph_2.has_edge(*target):
+            total += edge_subst(graph_1.edges[a, b], graph_2.edges[target])
+            matched_edges_2.add(target)
+        else:
+            total += edge_del(graph_1.edges[a, b])
+    for e in graph_2.edges:
+        if e not in matched_edges_2:
+            total += edge_ins(graph_2.edges[e])
+    return total
+
+"""
+    Fingerprint of everything that determines a GED value apart from the graphs and the call parameters
+    Bump COST_MODEL_VERSION when a change to the costs or the engines should invalidate cached results
+"""
+@lru_cache(maxsize=1)
+def cost_model_fingerprint() -> str:
+    # Explicit values instead of the source code, so that edits to comments or formatting keep the cached results
+    return json.dumps({
+        "version": COST_MODEL_VERSION,
+        "text_similarity_threshold": TEXT_SIMILARITY_THRESHOLD,
+        "node_ins": node_ins_cost({}),
+        "node_del": node_del_cost({}),
+        "edge_subst": edge_subst_cost({}, {}),
+        "edge_ins": edge_ins_cost({}),
+        "edge_del": edge_del_cost({}),
+    }, sort_keys=True)
@@ -1,15 +1,23 @@
 import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from statistics import mean
 
 from shared.parser import write_json_file
 from .dataset_parser import get_aif_graph_from_path, find_pairs
-from .ged_calculator import compute_ged_from_aif_graphs
+from .ged_calculator import compute_ged_from_aif_graphs, GED_ENGINES, GEDResult
+from .ged_cache import GEDCache, GED_CACHE_MODES, ged_cache_key
+from .corpus import compile_corpus, open_corpus
+from .deadline_runner import DeadlineJob, DeadlineOutcome, run_with_deadlines
+from .similarity_metrics import compute_similarity_metrics, metric_columns, METRICS as KNOWN_METRICS, METRIC_GED
 from .test_config import GED_TIMEOUT, GED_ROUND_FLOAT_TO, PRINT_RESULT, SAVE_AS_CSV, ORACLE_FILE_POSTFIX, RESOURCES_DIR, \
-    RESULT_FILE_PREFIX, ADD_DATE_TO_RESULTS_FILE_POSTFIX, ROOT_DIR
+    RESULT_FILE_PREFIX, ADD_DATE_TO_RESULTS_FILE_POSTFIX, ROOT_DIR, GED_WORKERS, GED_ENGINE, GED_CACHE_MODE, GED_CACHE_DIR, GED_CACHE_MAX_MB, \
+    GED_SHORTCUTS, GED_SHORTCUT_SIZE_RATIO, GED_DECOMPOSE, GED_COMPONENT_WORKERS, COMPACT_GRAPHS, \
+    USE_CORPUS, CORPUS_FILE, METRICS, NODE_MATCH_THRESHOLD, GED_HARD_TIMEOUT, GED_TIME_BUDGET
 from shared.helper import format_elapsed_time
 import csv
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional
 
 """
     Uses benchmark_tester_config and resources folder to measure GED between pairs of AIF graphs
@@ -25,13 +33,37 @@ def calculate_ged():
         print(f"Resources directory {RESOURCES_DIR} not found")
         return None
 
-    pairs = find_pairs(resources_dir)
+    unknown_metrics = [m for m in METRICS if m not in KNOWN_METRICS]
+    if unknown_metrics or not METRICS:
+        print(f"Unknown metrics {unknown_metrics}, expected a comma separated list of {KNOWN_METRICS}")
+        return None
+
+    if GED_ENGINE not in GED_ENGINES:
+        print(f"Unknown GED engine {GED_ENGINE}, expected one of {GED_ENGINES}")
+        return None
+
+    if GED_CACHE_MODE not in GED_CACHE_MODES:
+        print(f"Unknown GED cache mode {GED_CACHE_MODE}, expected one of {GED_CACHE_MODES}")
+        return None
+    cache = GEDCache(root / GED_CACHE_DIR, mode=GED_CACHE_MODE, max_bytes=int(GED_CACHE_MAX_MB * 1024 * 1024))
+
+    corpus_path = None
+    if USE_CORPUS:
+        corpus = compile_corpus(resources_dir, root / CORPUS_FILE)
+        corpus_path = str(corpus.path)
+        pairs = corpus.find_pairs(resources_dir)
+    else:
+        pairs = find_pairs(resources_dir)
     if not pairs:
         print(f"No AIF graph pairs found in {RESOURCES_DIR} directory (expected <name>.json and <name>{ORACLE_FILE_POSTFIX}.json).")
         return None
 
     print(f"Starting the comparison of all the pairs in {RESOURCES_DIR} directory...")
-    results: List[Dict[str, Any]] = compute_pair_results(pairs)
+    results: List[Dict[str, Any]] = compute_pair_results(pairs, cache=cache, corpus_path=corpus_path)
+
+    evicted = cache.evict()
+    if evicted and PRINT_RESULT:
+        print(f"Evicted {evicted} entries from the GED cache")
 
     if SAVE_AS_CSV:
         postfix = f"_{datetime.datetime.now().strftime('%Y_%m_%d_%H_%M_%S')}" if ADD_DATE_TO_RESULTS_FILE_POSTFIX else ""
@@ -40,15 +72,11 @@ def calculate_ged():
 
         with out_csv.open("w", newline="", encoding="utf-8") as fh:
             writer = csv.writer(fh)
-            writer.writerow(["benchmark_graph", "oracle_graph", "ged", "elapsed", "notes"])
+            columns = ["benchmark_graph", "oracle_graph", "ged", "ged_lower_bound", "ged_upper_bound", "elapsed", "notes"]
+            columns += metric_columns(METRICS)
+            writer.writerow(columns)
             for r in results:
-                writer.writerow([
-                    r["benchmark_graph"],
-                    r["oracle_graph"],
-                    r["ged"],
-                    r["elapsed"],
-                    r["notes"],
-                ])
+                writer.writerow([r.get(column) for column in columns])
         write_results_summary_json(results, resources_dir)
         if PRINT_RESULT:
             print(f"\nSaved results to ged_results/{RESULT_FILE_PREFIX}{postfix}.csv successfully...")
@@ -56,41 +84,236 @@ def calculate_ged():
     print("Finished the comparison...")
     return results
 
-def compute_pair_results(pairs) -> List[Dict[str, Any]]:
-    results: List[Dict[str, Any]] = []
-
-    for bench_path, oracle_path in pairs:
-        graph_a = get_aif_graph_from_path(str(bench_path))
-        graph_b = get_aif_graph_from_path(str(oracle_path))
-
-        if graph_a is None or graph_b is None:
-            ged_value = -1
-            elapsed = -1
-            notes = "Corrupt json"
-        else:
-            ged_value, elapsed = compute_ged_from_aif_graphs(
-                graph_a,
-                graph_b,
-                timeout=GED_TIMEOUT,
-                round_digits=GED_ROUND_FLOAT_TO
-            )
-            notes = "Success"
-
-        results.append({
-            "benchmark_graph": bench_path.name,
-            "oracle_graph": oracle_path.name,
-            "ged": ged_value,
-            "elapsed": elapsed,
-            "notes": notes
-        })
+def compute_pair_results(
+    pairs,
+    workers: int = GED_WORKERS,
+    cache: Optional[GEDCache] = None,
+    corpus_path: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    if workers == 0:
+        workers = os.cpu_count() or 1
 
-        if PRINT_RESULT:
-            print(f"\nComparing {bench_path.name} with {oracle_path.name}")
-            if ged_value != -1.0:
-                print("  GED:", ged_value)
-                print("  Elapsed:", format_elapsed_time(elapsed))
+    if GED_HARD_TIMEOUT or GED_TIME_BUDGET > 0:
+        return compute_pair_results_with_deadlines(pairs, workers, cache, corpus_path)
+
+    if workers <= 1 or len(pairs) <= 1:
+        results: List[Dict[str, Any]] = []
+        for index, (bench_path, oracle_path) in enumerate(pairs):
+            result = compute_pair_result(bench_path, oracle_path, cache, corpus_path)
+            results.append(result)
+            print_pair_result(result, index + 1, len(pairs))
+        return results
+
+    # Results are collected by the index of the pair so that the output order does not depend on completion order
+    print(f"Comparing {len(pairs)} pairs using {workers} worker processes...")
+    ordered: List[Optional[Dict[str, Any]]] = [None] * len(pairs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(compute_pair_result, bench_path, oracle_path, cache, corpus_path): index
+            for index, (bench_path, oracle_path) in enumerate(pairs)
+        }
+        for completed, future in enumerate(as_completed(futures), start=1):
+            index = futures[future]
+            bench_path, oracle_path = pairs[index]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"  Comparison of {bench_path.name} with {oracle_path.name} failed in the worker: {e}")
+                result = make_pair_result(bench_path, oracle_path, -1, -1, "Worker failed")
+            ordered[index] = result
+            print_pair_result(result, completed, len(pairs))
+    return ordered
+
+"""
+    Every pair runs in its own process that is killed at its deadline: GED_TIMEOUT per pair and, with GED_TIME_BUDGET,
+    a share of the remaining budget proportional to the size of the pair's JSON files.
+    Killed pairs keep the best GED found so far, pairs that do not start before the budget runs out are skipped
+"""
+def compute_pair_results_with_deadlines(
+    pairs,
+    workers: int,
+    cache: Optional[GEDCache] = None,
+    corpus_path: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    budget = GED_TIME_BUDGET if GED_TIME_BUDGET > 0 else None
+    print(f"Comparing {len(pairs)} pairs using {workers} killable worker processes"
+          + (f" within a {budget:.0f} s time budget..." if budget else "..."))
+
+    jobs = [
+        DeadlineJob(
+            target=compute_pair_result_with_deadline,
+            args=(bench_path, oracle_path, cache, corpus_path),
+            weight=max(1, bench_path.stat().st_size + oracle_path.stat().st_size),
+            max_time=GED_TIMEOUT
+        )
+        for bench_path, oracle_path in pairs
+    ]
+    results: List[Optional[Dict[str, Any]]] = [None] * len(pairs)
+    completed = 0
+
+    def on_done(index: int, outcome: DeadlineOutcome) -> None:
+        nonlocal completed
+        completed += 1
+        bench_path, oracle_path = pairs[index]
+        results[index] = pair_result_from_outcome(bench_path, oracle_path, outcome)
+        print_pair_result(results[index], completed, len(pairs))
+
+    run_with_deadlines(jobs, workers, budget=budget, merge_progress=merge_ged_progress, on_done=on_done)
     return results
 
+def compute_pair_result_with_deadline(
+    bench_path: Path,
+    oracle_path: Path,
+    cache: Optional[GEDCache],
+    corpus_path: Optional[str],
+    timeout: float,
+    report: Callable[[Any], None]
+) -> Dict[str, Any]:
+    def progress(upper: float, lower: Optional[float]) -> None:
+        report((upper, lower))
+
+    return compute_pair_result(bench_path, oracle_path, cache, corpus_path, timeout=timeout, progress=progress)
+
+def merge_ged_progress(previous: Optional[tuple], payload: tuple) -> tuple:
+    # Keeps the smallest upper bound and the largest lower bound reported so far
+    if previous is None:
+        return payload
+    upper = min(previous[0], payload[0])
+    lowers = [value for value in (previous[1], payload[1]) if value is not None]
+    return upper, max(lowers) if lowers else None
+
+def pair_result_from_outcome(bench_path: Path, oracle_path: Path, outcome: DeadlineOutcome) -> Dict[str, Any]:
+    if outcome.result is not None:
+        result = outcome.result
+        if result.get("ged_lower_bound") is None and outcome.progress is not None and outcome.progress[1] is not None:
+            # The search was cut short by its soft timeout, the bipartite lower bound still holds
+            result["ged_lower_bound"] = outcome.progress[1]
+        return result
+    if outcome.skipped:
+        return make_pair_result(bench_path, oracle_path, -1, -1, "Skipped, time budget exhausted")
+    if outcome.killed and outcome.progress is not None:
+        upper, lower = outcome.progress
+        return make_pair_result(bench_path, oracle_path, upper, outcome.elapsed, "Killed at deadline (best so far)",
+                                lower_bound=lower, upper_bound=upper)
+    if outcome.killed:
+        return make_pair_result(bench_path, oracle_path, -1, outcome.elapsed, "Killed at deadline")
+    print(f"  Comparison of {bench_path.name} with {oracle_path.name} failed in the worker: {outcome.error}")
+    return make_pair_result(bench_path, oracle_path, -1, -1, "Worker failed")
+
+def compute_pair_result(
+    bench_path: Path,
+    oracle_path: Path,
+    cache: Optional[GEDCache] = None,
+    corpus_path: Optional[str] = None,
+    timeout: float = GED_TIMEOUT,
+    progress: Optional[Callable[[float, Optional[float]], None]] = None
+) -> Dict[str, Any]:
+    if corpus_path is not None:
+        corpus = open_corpus(corpus_path)
+        graph_a = corpus.get_graph(bench_path.name)
+        graph_b = corpus.get_graph(oracle_path.name)
+    else:
+        graph_a = get_aif_graph_from_path(str(bench_path), compact=COMPACT_GRAPHS)
+        graph_b = get_aif_graph_from_path(str(oracle_path), compact=COMPACT_GRAPHS)
+
+    if graph_a is None or graph_b is None:
+        return make_pair_result(bench_path, oracle_path, -1, -1, "Corrupt json")
+
+    if METRIC_GED in METRICS:
+        result = compute_pair_ged_result(bench_path, oracle_path, graph_a, graph_b, cache, timeout, progress)
+    else:
+        result = make_pair_result(bench_path, oracle_path, None, None, "Success")
+    result.update(compute_similarity_metrics(graph_a, graph_b, METRICS, NODE_MATCH_THRESHOLD, GED_ROUND_FLOAT_TO))
+    return result
+
+def compute_pair_ged_result(
+    bench_path: Path,
+    oracle_path: Path,
+    graph_a,
+    graph_b,
+    cache: Optional[GEDCache],
+    timeout: float = GED_TIMEOUT,
+    progress: Optional[Callable[[float, Optional[float]], None]] = None
+) -> Dict[str, Any]:
+    # The key holds the configured timeout, not the share of the time budget a job was allotted, which changes with
+    # every run. A finished search does not depend on the timeout at all and is found under a key without it
+    exact_key = timeout_key = None
+    if cache is not None and cache.enabled:
+        exact_key = ged_cache_key(graph_a, graph_b, comparison_settings(None))
+        timeout_key = ged_cache_key(graph_a, graph_b, comparison_settings(GED_TIMEOUT))
+        cached = cache.get(exact_key) or cache.get(timeout_key)
+        if cached is not None:
+            return make_pair_result_from_ged(bench_path, oracle_path, cached, cached=True)
+
+    ged_result = compute_ged_from_aif_graphs(
+        graph_a, graph_b, component_workers=GED_COMPONENT_WORKERS, progress=progress, **comparison_settings(timeout)
+    )
+    if exact_key is not None:
+        if ged_result.lower_bound is not None and ged_result.lower_bound == ged_result.upper_bound:
+            cache.put(exact_key, ged_result)
+        elif timeout >= GED_TIMEOUT:
+            # A search cut short by a smaller allotted timeout must not stand in for one with the configured timeout
+            cache.put(timeout_key, ged_result)
+    return make_pair_result_from_ged(bench_path, oracle_path, ged_result)
+
+def comparison_settings(timeout: Optional[float] = GED_TIMEOUT) -> Dict[str, Any]:
+    return {
+        "timeout": timeout,
+        "round_digits": GED_ROUND_FLOAT_TO,
+        "engine": GED_ENGINE,
+        "shortcuts": GED_SHORTCUTS,
+        "shortcut_size_ratio": GED_SHORTCUT_SIZE_RATIO,
+        "decompose": GED_DECOMPOSE,
+    }
+
+def make_pair_result_from_ged(bench_path: Path, oracle_path: Path, ged_result: GEDResult, cached: bool = False) -> Dict[str, Any]:
+    details = []
+    if cached:
+        details.append("cached")
+    if ged_result.shortcut:
+        details.append(f"shortcut: {ged_result.shortcut}")
+    if ged_result.components:
+        details.append(f"{ged_result.components} component pairs")
+    notes = f"Success ({', '.join(details)})" if details else "Success"
+    return make_pair_result(
+        bench_path,
+        oracle_path,
+        ged_result.ged,
+        ged_result.elapsed,
+        notes,
+        lower_bound=ged_result.lower_bound,
+        upper_bound=ged_result.upper_bound
+    )
+
+def make_pair_result(
+    bench_path: Path,
+    oracle_path: Path,
+    ged_value: float,
+    elapsed: float,
+    notes: str,
+    lower_bound: Optional[float] = None,
+    upper_bound: Optional[float] = None
+) -> Dict[str, Any]:
+    return {
+        "benchmark_graph": bench_path.name,
+        "oracle_graph": oracle_path.name,
+        "ged": ged_value,
+        "ged_lower_bound": lower_bound,
+        "ged_upper_bound": upper_bound,
+        "elapsed": elapsed,
+        "notes": notes
+    }
+
+def print_pair_result(result: Dict[str, Any], completed: int, total: int) -> None:
+    if PRINT_RESULT:
+        print(f"\n[{completed}/{total}] Comparing {result['benchmark_graph']} with {result['oracle_graph']}")
+        if result["ged"] is not None and result["ged"] != -1.0:
+            print("  GED:", result["ged"])
+            print("  Elapsed:", format_elapsed_time(result["elapsed"]))
+        for column in metric_columns(METRICS):
+            if column in result and column != "metrics_elapsed":
+                print(f"  {column}:", result[column])
+
 def write_results_summary_json(results, resources_dir):
     total_comparisons = len(results)
 
@@ -102,16 +325,20 @@ def write_results_summary_json(results, resources_dir):
     failed_comparisons = total_comparisons - len(successful)
     successful_comparisons = len(successful)
 
-    if successful_comparisons > 0:
-        average_ged = mean(r["ged"] for r in successful)
-        average_elapsed = mean(r["elapsed"] for r in successful)
-        total_elapsed = sum(r["elapsed"] for r in successful)
+    # GED values are None when only the cheaper metrics were selected
+    ged_results = [r for r in successful if r.get("ged") is not None]
+    if ged_results:
+        average_ged = mean(r["ged"] for r in ged_results)
+        average_elapsed = mean(r["elapsed"] for r in ged_results)
+        total_elapsed = sum(r["elapsed"] for r in ged_results)
     else:
         average_ged = 0.0
         average_elapsed = 0.0
         total_elapsed = 0.0
 
     summary = {
+        "ged_engine": GED_ENGINE,
+        "metrics": METRICS,
         "average_ged": average_ged,
         "average_elapsed": average_elapsed,
         "total_elapsed": total_elapsed,
@@ -119,6 +346,9 @@ def write_results_summary_json(results, resources_dir):
         "successful_comparisons": successful_comparisons,
         "failed_comparisons": failed_comparisons,
     }
+    for column in metric_columns(METRICS):
+        values = [r[column] for r in successful if r.get(column) is not None]
+        summary[f"average_{column}"] = mean(values) if values else 0.0
 
     postfix = f"_{datetime.datetime.now().strftime('%Y_%m_%d_%H_%M_%S')}" if ADD_DATE_TO_RESULTS_FILE_POSTFIX else ""
     out_json = resources_dir / "ged_results" / f"{RESULT_FILE_PREFIX}{postfix}.json"
@@ -1,7 +1,11 @@
 from __future__ import annotations
 from dataclasses import dataclass, field, asdict
 from typing import Optional, Dict, Any, List
+import hashlib
+import json
+import sys
 import networkx as nx
+import numpy as np
 
 
 """
@@ -126,6 +130,16 @@ class AIFGraph:
     def get_node(self, node_id: str) -> Optional[AIFNode]:
         return self.nodes.get(node_id)
 
+    def canonical_hash(self) -> str:
+        # Independent of the order of the nodes and edges in the source JSON
+        nodes = sorted((n.to_dict() for n in self.nodes.values()), key=lambda d: str(d["node_id"]))
+        edges = sorted(
+            (e.to_dict() for e in self.edges),
+            key=lambda d: (str(d["from_id"]), str(d["to_id"]), str(d["edge_id"]))
+        )
+        content = json.dumps({"nodes": nodes, "edges": edges}, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
     def to_networkx(self, attach_objects: bool = True) -> nx.DiGraph:
         graph = nx.DiGraph()
         for nid, node in self.nodes.items():
@@ -140,4 +154,244 @@ class AIFGraph:
             else:
                 graph.add_edge(edge.from_id, edge.to_id, **edge.to_dict())
 
-        return graph
\ No newline at end of file
+        return graph
+
+NODE_FIELDS = {
+    "nodeID": "node_id",
+    "text": "text",
+    "type": "type",
+    "timestamp": "timestamp",
+    "scheme": "scheme",
+    "schemeID": "scheme_id",
+}
+
+EDGE_FIELDS = {
+    "edgeID": "edge_id",
+    "fromID": "from_id",
+    "toID": "to_id",
+    "formEdgeID": "form_edge_id",
+}
+
+def intern_optional(value: Any) -> Any:
+    return sys.intern(value) if isinstance(value, str) else value
+
+"""
+    Column-oriented, array-backed AIF graph for large corpora
+    Nodes are addressed by integer indices, the node attributes are stored in parallel lists with interned type strings
+    and `extras` only kept for the nodes/edges that have any. Edges are stored as source/target index arrays in their
+    original order plus CSR adjacency (offsets and edge indices) in both directions.
+    Edges may reference node IDs that are not in the node list (as in AIFGraph), these are appended after the
+    `num_nodes` real nodes so that the conversion to and from AIFGraph is lossless.
+"""
+class CompactAIFGraph:
+
+    __slots__ = (
+        "node_ids", "texts", "types", "timestamps", "schemes", "scheme_ids", "node_extras", "num_nodes",
+        "edge_ids", "sources", "targets", "form_edge_ids", "edge_extras",
+        "out_offsets", "out_edges", "in_offsets", "in_edges", "_index",
+    )
+
+    def __init__(
+        self,
+        node_ids: List[Any],
+        texts: List[Optional[str]],
+        types: List[Optional[str]],
+        timestamps: List[Optional[str]],
+        schemes: List[Optional[str]],
+        scheme_ids: List[Optional[str]],
+        node_extras: Dict[int, Dict[str, Any]],
+        num_nodes: int,
+        edge_ids: List[Any],
+        sources: np.ndarray,
+        targets: np.ndarray,
+        form_edge_ids: List[Optional[str]],
+        edge_extras: Dict[int, Dict[str, Any]],
+        adjacency: Optional[tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = None,
+    ):
+        self.node_ids = node_ids
+        self.texts = texts
+        self.types = types
+        self.timestamps = timestamps
+        self.schemes = schemes
+        self.scheme_ids = scheme_ids
+        self.node_extras = node_extras
+        self.num_nodes = num_nodes
+        self.edge_ids = edge_ids
+        self.sources = sources
+        self.targets = targets
+        self.form_edge_ids = form_edge_ids
+        self.edge_extras = edge_extras
+        self._index: Optional[Dict[Any, int]] = None
+        # Precomputed (out_offsets, out_edges, in_offsets, in_edges), e.g. views into a memory-mapped corpus
+        if adjacency is not None:
+            self.out_offsets, self.out_edges, self.in_offsets, self.in_edges = adjacency
+        else:
+            self.out_offsets, self.out_edges = csr_adjacency(sources, len(node_ids))
+            self.in_offsets, self.in_edges = csr_adjacency(targets, len(node_ids))
+
+    @classmethod
+    def from_dict_lists(cls, nodes_list: List[Dict[str, Any]], edges_list: List[Dict[str, Any]]) -> CompactAIFGraph:
+        # Same semantics as AIFGraph.from_dict_lists without creating AIFNode/AIFEdge objects
+        positions: Dict[Any, int] = {}
+        columns: Dict[str, List[Any]] = {field_name: [] for field_name in NODE_FIELDS.values()}
+        node_extras: Dict[int, Dict[str, Any]] = {}
+        for d in nodes_list:
+            node_id = d["nodeID"]
+            values = {field_name: d.get(json_key) for json_key, field_name in NODE_FIELDS.items()}
+            values["type"] = intern_optional(values["type"])
+            extras = {k: v for k, v in d.items() if k not in NODE_FIELDS}
+            # A repeated node ID replaces the earlier node but keeps its position, like the dict in AIFGraph
+            position = positions.setdefault(node_id, len(positions))
+            if position == len(columns["node_id"]):
+                for field_name, value in values.items():
+                    columns[field_name].append(value)
+            else:
+                for field_name, value in values.items():
+                    columns[field_name][position] = value
+                node_extras.pop(position, None)
+            if extras:
+                node_extras[position] = extras
+
+        return cls.from_columns(columns, node_extras, edges_list)
+
+    @classmethod
+    def from_aif_graph(cls, graph: AIFGraph) -> CompactAIFGraph:
+        columns: Dict[str, List[Any]] = {field_name: [] for field_name in NODE_FIELDS.values()}
+        node_extras: Dict[int, Dict[str, Any]] = {}
+        for position, node in enumerate(graph.nodes.values()):
+            for field_name in NODE_FIELDS.values():
+                columns[field_name].append(getattr(node, field_name))
+            columns["type"][-1] = intern_optional(node.type)
+            if node.extras:
+                node_extras[position] = dict(node.extras)
+
+        edges_list = []
+        for edge in graph.edges:
+            d = {json_key: getattr(edge, field_name) for json_key, field_name in EDGE_FIELDS.items()}
+            d.update(edge.extras)
+            edges_list.append(d)
+        return cls.from_columns(columns, node_extras, edges_list)
+
+    @classmethod
+    def from_columns(
+        cls,
+        columns: Dict[str, List[Any]],
+        node_extras: Dict[int, Dict[str, Any]],
+        edges_list: List[Dict[str, Any]]
+    ) -> CompactAIFGraph:
+        node_ids = columns["node_id"]
+        num_nodes = len(node_ids)
+        positions = {node_id: position for position, node_id in enumerate(node_ids)}
+
+        def position_of(node_id: Any) -> int:
+            if node_id not in positions:
+                positions[node_id] = len(node_ids)
+                node_ids.append(node_id)
+            return positions[node_id]
+
+        edge_ids, form_edge_ids, sources, targets = [], [], [], []
+        edge_extras: Dict[int, Dict[str, Any]] = {}
+        for position, d in enumerate(edges_list):
+            edge_ids.append(d["edgeID"])
+            sources.append(position_of(d["fromID"]))
+            targets.append(position_of(d["toID"]))
+            form_edge_ids.append(d.get("formEdgeID"))
+            extras = {k: v for k, v in d.items() if k not in EDGE_FIELDS}
+            if extras:
+                edge_extras[position] = extras
+
+        return cls(
+            node_ids=node_ids,
+            texts=columns["text"],
+            types=columns["type"],
+            timestamps=columns["timestamp"],
+            schemes=columns["scheme"],
+            scheme_ids=columns["scheme_id"],
+            node_extras=node_extras,
+            num_nodes=num_nodes,
+            edge_ids=edge_ids,
+            sources=np.array(sources, dtype=np.int32),
+            targets=np.array(targets, dtype=np.int32),
+            form_edge_ids=form_edge_ids,
+            edge_extras=edge_extras,
+        )
+
+    def to_aif_graph(self) -> AIFGraph:
+        nodes = [self.get_node(i) for i in range(self.num_nodes)]
+        edges = [self.get_edge(k) for k in range(self.num_edges)]
+        return AIFGraph(nodes=nodes, edges=edges)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.edge_ids)
+
+    def index_of(self, node_id: Any) -> Optional[int]:
+        if self._index is None:
+            self._index = {nid: i for i, nid in enumerate(self.node_ids)}
+        return self._index.get(node_id)
+
+    def get_node(self, index: int) -> AIFNode:
+        return AIFNode(
+            node_id=self.node_ids[index],
+            text=self.texts[index],
+            type=self.types[index],
+            timestamp=self.timestamps[index],
+            scheme=self.schemes[index],
+            scheme_id=self.scheme_ids[index],
+            extras=dict(self.node_extras.get(index, {})),
+        )
+
+    def get_edge(self, index: int) -> AIFEdge:
+        return AIFEdge(
+            edge_id=self.edge_ids[index],
+            from_id=self.node_ids[self.sources[index]],
+            to_id=self.node_ids[self.targets[index]],
+            form_edge_id=self.form_edge_ids[index],
+            extras=dict(self.edge_extras.get(index, {})),
+        )
+
+    def successors(self, index: int) -> np.ndarray:
+        return self.targets[self.out_edges[self.out_offsets[index]:self.out_offsets[index + 1]]]
+
+    def predecessors(self, index: int) -> np.ndarray:
+        return self.sources[self.in_edges[self.in_offsets[index]:self.in_offsets[index + 1]]]
+
+    def out_degrees(self) -> np.ndarray:
+        return np.diff(self.out_offsets)
+
+    def in_degrees(self) -> np.ndarray:
+        return np.diff(self.in_offsets)
+
+    def normalised_texts(self) -> List[str]:
+        return [" ".join(text.strip().lower().split()) if text else "" for text in self.texts]
+
+    def canonical_hash(self) -> str:
+        return self.to_aif_graph().canonical_hash()
+
+    def to_networkx(self, attach_objects: bool = True) -> nx.DiGraph:
+        # Nodes are keyed by their ID like in AIFGraph.to_networkx. With attach_objects the nodes only carry the
+        # normalised type and text the GED cost model needs instead of an AIFNode
+        graph = nx.DiGraph()
+        if attach_objects:
+            texts = self.normalised_texts()
+            graph.add_nodes_from(
+                (self.node_ids[i], {"type": self.types[i], "text": texts[i]}) for i in range(self.num_nodes)
+            )
+            graph.add_edges_from(
+                (self.node_ids[a], self.node_ids[b]) for a, b in zip(self.sources.tolist(), self.targets.tolist())
+            )
+        else:
+            for i in range(self.num_nodes):
+                graph.add_node(self.node_ids[i], **self.get_node(i).to_dict())
+            for k in range(self.num_edges):
+                edge = self.get_edge(k)
+                graph.add_edge(edge.from_id, edge.to_id, **edge.to_dict())
+        return graph
+
+def csr_adjacency(endpoints: np.ndarray, num_nodes: int) -> tuple[np.ndarray, np.ndarray]:
+    # Offsets into the edge indices grouped by endpoint, edges keep their original order within a group
+    order = np.argsort(endpoints, kind="stable").astype(np.int32)
+    counts = np.bincount(endpoints, minlength=num_nodes) if len(endpoints) else np.zeros(num_nodes, dtype=np.int64)
+    offsets = np.zeros(num_nodes + 1, dtype=np.int32)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets, order
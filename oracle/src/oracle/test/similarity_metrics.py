@@ -0,0 +1,252 @@
+import math
+import time
+import warnings
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Union
+
+import networkx as nx
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from .ged_calculator import build_node_subst_matrix, extract_type_text, unique_codes, WL_ITERATIONS, \
+    TEXT_SIMILARITY_THRESHOLD
+from .models import AIFGraph, CompactAIFGraph
+
+"""
+    Structural similarity metrics that are much cheaper than the GED
+    - alignment: nodes are aligned by an optimal assignment on the node_subst_cost of the pairs with a cost up to the
+      match threshold, which count as matches (see candidate_costs and refined_assignment). Ties between equal nodes (e.g. scheme nodes) are broken by a few
+      refinement rounds that reward pairs whose neighbours are aligned to each other. Precision is relative to the
+      oracle graph (graph 2), recall to the benchmark graph (graph 1). An edge matches when its aligned endpoints are
+      connected in the same direction.
+    - wl: normalised Weisfeiler-Lehman subtree kernel over node types
+"""
+METRIC_GED = "ged"
+METRIC_ALIGNMENT = "alignment"
+METRIC_WL = "wl"
+METRICS = (METRIC_GED, METRIC_ALIGNMENT, METRIC_WL)
+
+METRIC_COLUMNS = {
+    METRIC_ALIGNMENT: ["node_precision", "node_recall", "node_f1", "edge_precision", "edge_recall", "edge_f1"],
+    METRIC_WL: ["wl_similarity"],
+}
+WL_TYPE_ATTR = "wl_type"
+ALIGNMENT_REFINEMENTS = 2
+ALIGNMENT_EDGE_WEIGHT = 0.25
+
+def metric_columns(metrics: List[str]) -> List[str]:
+    columns = []
+    for metric in metrics:
+        columns.extend(METRIC_COLUMNS.get(metric, []))
+    if columns:
+        columns.append("metrics_elapsed")
+    return columns
+
+def compute_similarity_metrics(
+    aif1: Union[AIFGraph, CompactAIFGraph],
+    aif2: Union[AIFGraph, CompactAIFGraph],
+    metrics: List[str],
+    match_threshold: float,
+    round_digits: int
+) -> Dict[str, Any]:
+    if not any(metric in METRIC_COLUMNS for metric in metrics):
+        return {}
+
+    start = time.time()
+    graph_1 = aif1.to_networkx(attach_objects=True)
+    graph_2 = aif2.to_networkx(attach_objects=True)
+
+    values: Dict[str, Any] = {}
+    if METRIC_ALIGNMENT in metrics:
+        values.update(alignment_scores(graph_1, graph_2, match_threshold))
+    if METRIC_WL in metrics:
+        values["wl_similarity"] = wl_kernel_similarity(graph_1, graph_2)
+
+    values = {key: round(value, round_digits) for key, value in values.items()}
+    values["metrics_elapsed"] = time.time() - start
+    return values
+
+def precision_recall_f1(matches: int, predicted: int, expected: int) -> tuple[float, float, float]:
+    precision = matches / predicted if predicted else (1.0 if expected == 0 else 0.0)
+    recall = matches / expected if expected else (1.0 if predicted == 0 else 0.0)
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+    return precision, recall, f1
+
+def alignment_scores(graph_1: nx.DiGraph, graph_2: nx.DiGraph, match_threshold: float) -> Dict[str, float]:
+    nodes_1 = list(graph_1.nodes)
+    nodes_2 = list(graph_2.nodes)
+
+    mapping: Dict[Any, Any] = {}
+    if nodes_1 and nodes_2:
+        rows, cols, costs = candidate_costs(graph_1, graph_2, match_threshold)
+        aligned = refined_assignment(graph_1, graph_2, rows, cols, costs)
+        mapping = {nodes_1[r]: nodes_2[c] for r, c in aligned.items()}
+
+    edge_matches = sum(
+        1 for a, b in graph_1.edges
+        if a in mapping and b in mapping and graph_2.has_edge(mapping[a], mapping[b])
+    )
+
+    node_precision, node_recall, node_f1 = precision_recall_f1(len(mapping), len(nodes_2), len(nodes_1))
+    edge_precision, edge_recall, edge_f1 = precision_recall_f1(
+        edge_matches, graph_2.number_of_edges(), graph_1.number_of_edges()
+    )
+    return {
+        "node_precision": node_precision,
+        "node_recall": node_recall,
+        "node_f1": node_f1,
+        "edge_precision": edge_precision,
+        "edge_recall": edge_recall,
+        "edge_f1": edge_f1,
+    }
+
+def char_counts(texts: List[str]) -> np.ndarray:
+    # Characters beyond ASCII share the last column, which only loosens the bound of candidate_costs
+    counts = np.zeros((len(texts), 128), dtype=np.int32)
+    for i, text in enumerate(texts):
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        counts[i] = np.bincount(np.minimum(codes, 127), minlength=128)
+    return counts
+
+"""
+    The node pairs with a node_subst_cost of at most `match_threshold`, as (rows, cols, costs)
+    Only these pairs can match, so the text similarity is only computed where it can reach the similarity they need:
+    the unique texts are compared once, and a pair is skipped when the shared character counts (an upper bound of the
+    SequenceMatcher ratio, vectorised over all texts of the other graph) cannot reach it. Nodes with the same text share
+    the result. Without a threshold below 1 every pair is a candidate and the full cost matrix is used.
+"""
+def candidate_costs(
+    graph_1: nx.DiGraph,
+    graph_2: nx.DiGraph,
+    match_threshold: float
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    min_similarity = min(1.0 - match_threshold, TEXT_SIMILARITY_THRESHOLD)
+    if min_similarity <= 0:
+        cost = build_node_subst_matrix(graph_1, graph_2)
+        rows, cols = np.nonzero(cost <= match_threshold)
+        return rows, cols, cost[rows, cols]
+
+    type_text_1 = [extract_type_text(graph_1.nodes[u]) for u in graph_1.nodes]
+    type_text_2 = [extract_type_text(graph_2.nodes[v]) for v in graph_2.nodes]
+    texts_1, text_codes_1 = unique_codes([text for _, text in type_text_1])
+    texts_2, text_codes_2 = unique_codes([text for _, text in type_text_2])
+    lengths_1 = np.array([len(text) for text in texts_1])
+    counts_1 = char_counts(texts_1)
+    counts_2 = char_counts(texts_2)
+
+    similar: Dict[tuple[int, int], float] = {}
+    matcher = SequenceMatcher(None)
+    for j, b in enumerate(texts_2):
+        if not b:
+            continue
+        bound = 2 * np.minimum(counts_1, counts_2[j]).sum(axis=1) / (lengths_1 + len(b))
+        candidates = np.nonzero((lengths_1 > 0) & (bound >= min_similarity))[0]
+        if len(candidates) == 0:
+            continue
+        matcher.set_seq2(b)
+        for i in candidates.tolist():
+            matcher.set_seq1(texts_1[i])
+            similarity = matcher.ratio()
+            if similarity >= min_similarity:
+                similar[(i, j)] = similarity
+
+    nodes_by_text_1: Dict[int, List[int]] = defaultdict(list)
+    nodes_by_text_2: Dict[int, List[int]] = defaultdict(list)
+    for r, code in enumerate(text_codes_1.tolist()):
+        nodes_by_text_1[code].append(r)
+    for c, code in enumerate(text_codes_2.tolist()):
+        nodes_by_text_2[code].append(c)
+
+    rows, cols, costs = [], [], []
+    for (i, j), similarity in similar.items():
+        text_similar = similarity > TEXT_SIMILARITY_THRESHOLD
+        for r in nodes_by_text_1[i]:
+            for c in nodes_by_text_2[j]:
+                types_match = type_text_1[r][0] == type_text_2[c][0] and type_text_1[r][0] != ""
+                # Same cost as build_node_subst_matrix
+                cost = 0.0 if text_similar and types_match else (1.0 - similarity if text_similar or types_match else 1.0)
+                if cost <= match_threshold:
+                    rows.append(r)
+                    cols.append(c)
+                    costs.append(cost)
+    return np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp), np.array(costs)
+
+"""
+    Assignment of the nodes on the candidate pairs of candidate_costs, returned as {row: col}
+    The candidate pairs split the nodes into independent blocks (connected components of the bipartite candidate graph,
+    e.g. the RA nodes with the same scheme text), and every block is assigned on its own, with 1.0 for the pairs in a
+    block that cannot match. Assigned pairs that are no candidates are left out. The refinement rounds reward a
+    candidate pair for every successor/predecessor of the one node whose aligned node is a successor/predecessor of the
+    other, so only the neighbours of the candidate pairs are looked at.
+"""
+def refined_assignment(
+    graph_1: nx.DiGraph,
+    graph_2: nx.DiGraph,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    costs: np.ndarray
+) -> Dict[int, int]:
+    if len(rows) == 0:
+        return {}
+    n, m = graph_1.number_of_nodes(), graph_2.number_of_nodes()
+    bipartite = csr_matrix((np.ones(len(rows)), (rows, n + cols)), shape=(n + m, n + m))
+    _, labels = connected_components(bipartite, directed=False)
+    blocks: Dict[int, List[tuple[int, int, float]]] = defaultdict(list)
+    for r, c, cost in zip(rows.tolist(), cols.tolist(), costs.tolist()):
+        blocks[labels[r]].append((r, c, cost))
+
+    index_1 = {u: i for i, u in enumerate(graph_1.nodes)}
+    index_2 = {v: j for j, v in enumerate(graph_2.nodes)}
+    successors_1 = [[index_1[s] for s in graph_1.successors(u)] for u in graph_1.nodes]
+    predecessors_1 = [[index_1[p] for p in graph_1.predecessors(u)] for u in graph_1.nodes]
+    successors_2 = [{index_2[s] for s in graph_2.successors(v)} for v in graph_2.nodes]
+    predecessors_2 = [{index_2[p] for p in graph_2.predecessors(v)} for v in graph_2.nodes]
+
+    def agreeing(r: int, c: int, aligned: Dict[int, int]) -> int:
+        return sum(1 for s in successors_1[r] if aligned.get(s) in successors_2[c]) \
+            + sum(1 for p in predecessors_1[r] if aligned.get(p) in predecessors_2[c])
+
+    aligned: Dict[int, int] = {}
+    for refinement in range(ALIGNMENT_REFINEMENTS + 1):
+        next_aligned: Dict[int, int] = {}
+        for pairs in blocks.values():
+            block_rows = sorted({r for r, _, _ in pairs})
+            block_cols = sorted({c for _, c, _ in pairs})
+            positions_1 = {r: i for i, r in enumerate(block_rows)}
+            positions_2 = {c: j for j, c in enumerate(block_cols)}
+            block_cost = np.ones((len(block_rows), len(block_cols)))
+            candidate = np.zeros(block_cost.shape, dtype=bool)
+            for r, c, cost in pairs:
+                bonus = ALIGNMENT_EDGE_WEIGHT * agreeing(r, c, aligned) if refinement else 0.0
+                block_cost[positions_1[r], positions_2[c]] = cost - bonus
+                candidate[positions_1[r], positions_2[c]] = True
+            for i, j in zip(*linear_sum_assignment(block_cost)):
+                if candidate[i, j]:
+                    next_aligned[block_rows[i]] = block_cols[j]
+        aligned = next_aligned
+    return aligned
+
+def wl_features(graph: nx.DiGraph) -> Counter:
+    for u in graph.nodes:
+        graph.nodes[u][WL_TYPE_ATTR] = extract_type_text(graph.nodes[u])[0]
+
+    features = Counter(graph.nodes[u][WL_TYPE_ATTR] for u in graph.nodes)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        hashes = nx.weisfeiler_lehman_subgraph_hashes(graph, node_attr=WL_TYPE_ATTR, iterations=WL_ITERATIONS)
+    for node_hashes in hashes.values():
+        features.update(node_hashes)
+    return features
+
+def wl_kernel_similarity(graph_1: nx.DiGraph, graph_2: nx.DiGraph) -> float:
+    features_1 = wl_features(graph_1)
+    features_2 = wl_features(graph_2)
+    if not features_1 or not features_2:
+        return 1.0 if not features_1 and not features_2 else 0.0
+
+    dot = sum(count * features_2[feature] for feature, count in features_1.items())
+    norm = math.sqrt(sum(c * c for c in features_1.values()) * sum(c * c for c in features_2.values()))
+    return dot / norm
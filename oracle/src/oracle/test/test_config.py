@@ -15,4 +15,20 @@ SAVE_AS_CSV = env_bool("TEST_SAVE_AS_CSV", True)
 RESOURCES_DIR = Path(os.getenv("TEST_RESOURCES_DIR", "resources/benchmark_test_data"))
 ORACLE_FILE_POSTFIX = os.getenv("TEST_ORACLE_FILE_POSTFIX", "_oracle")
 RESULT_FILE_PREFIX = os.getenv("TEST_RESULT_FILE_PREFIX", "results")
-ADD_DATE_TO_RESULTS_FILE_POSTFIX = env_bool("TEST_ADD_DATE_TO_RESULTS_FILE_POSTFIX",True)
\ No newline at end of file
+ADD_DATE_TO_RESULTS_FILE_POSTFIX = env_bool("TEST_ADD_DATE_TO_RESULTS_FILE_POSTFIX",True)
+GED_WORKERS = int(os.getenv("TEST_GED_WORKERS", 1)) # 1 = sequential, 0 = one worker per CPU core
+GED_ENGINE = os.getenv("TEST_GED_ENGINE", "exact") # exact = networkx graph_edit_distance, bipartite = fast approximation with bounds
+GED_CACHE_MODE = os.getenv("TEST_GED_CACHE_MODE", "use") # use = read and write, rebuild = only write, bypass = no cache
+GED_CACHE_DIR = Path(os.getenv("TEST_GED_CACHE_DIR", "resources/ged_cache"))
+GED_CACHE_MAX_MB = float(os.getenv("TEST_GED_CACHE_MAX_MB", 100))
+GED_SHORTCUTS = env_bool("TEST_GED_SHORTCUTS", True)
+GED_SHORTCUT_SIZE_RATIO = float(os.getenv("TEST_GED_SHORTCUT_SIZE_RATIO", 0.0)) # 0 = disabled
+GED_DECOMPOSE = env_bool("TEST_GED_DECOMPOSE", False) # compare weakly connected components separately
+GED_COMPONENT_WORKERS = int(os.getenv("TEST_GED_COMPONENT_WORKERS", 1))
+COMPACT_GRAPHS = env_bool("TEST_COMPACT_GRAPHS", False) # load graphs as array-backed CompactAIFGraph
+USE_CORPUS = env_bool("TEST_USE_CORPUS", False) # compile the resources directory into CORPUS_FILE and load graphs from it
+CORPUS_FILE = Path(os.getenv("TEST_CORPUS_FILE", "resources/benchmark_test_data/corpus.bin"))
+METRICS = [m.strip() for m in os.getenv("TEST_METRICS", "ged").split(",") if m.strip()] # any of ged, alignment, wl
+NODE_MATCH_THRESHOLD = float(os.getenv("TEST_NODE_MATCH_THRESHOLD", 0.5)) # max node_subst_cost of aligned nodes that match
+GED_HARD_TIMEOUT = env_bool("TEST_GED_HARD_TIMEOUT", False) # run every pair in its own process, killed after GED_TIMEOUT
+GED_TIME_BUDGET = float(os.getenv("TEST_GED_TIME_BUDGET", 0.0)) # wall-clock seconds for the whole run, 0 = no budget
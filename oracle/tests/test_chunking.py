@@ -0,0 +1,91 @@
+from oracle.models.chunking import merge_fragments
+from oracle.test.models import AIFGraph
+
+
+def window(locution: str, illocution: str, proposition: str) -> AIFGraph:
+    return AIFGraph.from_dict_lists(
+        [
+            {"nodeID": "1", "text": locution, "type": "L"},
+            {"nodeID": "2", "text": proposition, "type": "I"},
+            {"nodeID": "3", "text": illocution, "type": "YA"},
+        ],
+        [
+            {"edgeID": "1", "fromID": "1", "toID": "3"},
+            {"edgeID": "2", "fromID": "3", "toID": "2"},
+        ],
+    )
+
+
+def locutions(*texts: str) -> AIFGraph:
+    # One L-node per text, each anchoring its own "Asserting" YA node to the I-node of the text
+    nodes, edges = [], []
+    for i, text in enumerate(texts):
+        nodes += [
+            {"nodeID": f"l{i}", "text": text, "type": "L"},
+            {"nodeID": f"y{i}", "text": "Asserting", "type": "YA"},
+            {"nodeID": f"i{i}", "text": text.split(":", 1)[1], "type": "I"},
+        ]
+        edges += [
+            {"edgeID": f"e{i}a", "fromID": f"l{i}", "toID": f"y{i}"},
+            {"edgeID": f"e{i}b", "fromID": f"y{i}", "toID": f"i{i}"},
+        ]
+    return AIFGraph.from_dict_lists(nodes, edges)
+
+
+def texts(graph: AIFGraph, node_type: str):
+    return sorted(node.text for node in graph.nodes.values() if node.type == node_type)
+
+
+def test_locutions_with_the_same_local_ids_stay_apart():
+    merged, duplicates = merge_fragments([
+        window("participant1: cats are great", "Asserting", "cats are great"),
+        window("participant2: dogs are better", "Asserting", "dogs are better"),
+    ])
+    assert texts(merged, "L") == ["participant1: cats are great", "participant2: dogs are better"]
+    assert len(texts(merged, "YA")) == 2
+    assert len(merged.edges) == 4
+    assert duplicates == 0
+
+
+def test_overlapping_locutions_are_merged():
+    turns = ["participant1: cats are great", "participant2: dogs are better"]
+    merged, duplicates = merge_fragments(
+        [
+            window("participant1: cats are great", "Asserting", "cats are great"),
+            window("participant1:  Cats are great", "Asserting", "cats are great"),
+        ],
+        [(0, turns[:1]), (0, turns)],
+    )
+    assert len(merged.nodes) == 3
+    assert len(merged.edges) == 2
+    assert duplicates == 3
+
+
+def test_different_illocutions_are_not_merged():
+    merged, _ = merge_fragments([
+        window("participant1: cats are great", "Asserting", "cats are great"),
+        window("participant1: cats are great", "Questioning", "cats are great"),
+    ])
+    assert texts(merged, "YA") == ["Asserting", "Questioning"]
+
+
+def test_repeated_short_locutions_stay_apart():
+    turns = [
+        "participant1: cats are great",
+        "participant2: yes",
+        "participant1: dogs are better",
+        "participant2: yes",
+    ]
+    merged, _ = merge_fragments(
+        [locutions(*turns[0:3]), locutions(*turns[1:4])],
+        [(0, turns[0:3]), (1, turns[1:4])],
+    )
+    # The "yes" and "dogs" turns in the overlap are merged, the second "yes" is a turn of its own
+    assert texts(merged, "L") == sorted(turns)
+    assert len(texts(merged, "YA")) == 4
+
+
+def test_repeated_locutions_in_one_window_stay_apart():
+    turns = ["participant2: yes", "participant1: really?", "participant2: yes"]
+    merged, _ = merge_fragments([locutions(*turns)], [(0, turns)])
+    assert texts(merged, "L") == sorted(turns)
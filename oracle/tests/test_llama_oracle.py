@@ -0,0 +1,79 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from oracle.models.llama_oracle import ForwardCounter, PrefixCache
+
+PREFIX = "You extract argument graphs in AIF. "
+PROMPTS = [PREFIX + "participant1: cats are great", PREFIX + "participant2: dogs are better"]
+MAX_NEW_TOKENS = 12
+
+
+class CharTokenizer:
+    # One token per character, so the prefix boundary never changes the tokenization
+
+    def __call__(self, text, return_tensors=None, add_special_tokens=True):
+        return {"input_ids": torch.tensor([[ord(char) % 128 for char in text]])}
+
+
+def tiny_model(seed: int, layers: int):
+    torch.manual_seed(seed)
+    config = transformers.LlamaConfig(
+        vocab_size=128, hidden_size=32, intermediate_size=64, num_hidden_layers=layers,
+        num_attention_heads=4, num_key_value_heads=4, max_position_embeddings=256,
+        bos_token_id=None, eos_token_id=None, pad_token_id=0,
+    )
+    return transformers.LlamaForCausalLM(config).eval()
+
+
+@pytest.fixture(scope="module")
+def model():
+    return tiny_model(0, 2)
+
+
+@pytest.fixture(scope="module")
+def draft_model():
+    return tiny_model(1, 1)
+
+
+def greedy(model, input_ids, **kwargs):
+    return model.generate(
+        input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+        do_sample=False, max_new_tokens=MAX_NEW_TOKENS, pad_token_id=0, **kwargs
+    )
+
+
+def test_prefix_cache_matches_plain_greedy(model):
+    tokenizer = CharTokenizer()
+    prefix_cache = PrefixCache(model, tokenizer, PREFIX)
+    # Every prompt starts from a copy, the second one must not see the cache extended by the first
+    for prompt in PROMPTS:
+        plain = greedy(model, tokenizer(prompt)["input_ids"])
+        input_ids, past_key_values = prefix_cache.build_inputs(tokenizer, prompt)
+        assert torch.equal(input_ids, tokenizer(prompt)["input_ids"])
+        cached = greedy(model, input_ids, past_key_values=past_key_values)
+        assert torch.equal(plain, cached)
+    assert prefix_cache.build_inputs(tokenizer, "participant1: no prefix") is None
+
+
+def test_prefix_cache_with_draft_model_matches_plain_greedy(model, draft_model):
+    tokenizer = CharTokenizer()
+    prefix_cache = PrefixCache(model, tokenizer, PREFIX)
+    for prompt in PROMPTS:
+        plain = greedy(model, tokenizer(prompt)["input_ids"])
+        input_ids, past_key_values = prefix_cache.build_inputs(tokenizer, prompt)
+        with ForwardCounter(model, draft_model) as counter:
+            assisted = greedy(model, input_ids, past_key_values=past_key_values, assistant_model=draft_model)
+        assert torch.equal(plain, assisted)
+        assert counter.target > 0 and counter.draft > 0
+
+
+def test_forward_counter_removes_its_hooks(model, draft_model):
+    with ForwardCounter(model, draft_model) as counter:
+        greedy(model, CharTokenizer()(PROMPTS[0])["input_ids"])
+    counted = counter.target
+    assert counted > 0
+    assert not model._forward_pre_hooks and not draft_model._forward_pre_hooks
+    greedy(model, CharTokenizer()(PROMPTS[1])["input_ids"])
+    assert counter.target == counted
@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+from oracle.models.oracle_config import MANIFEST_FILE
+from oracle.models.shared import run_with_query
+
+FILES = 9
+CONCURRENCY = 3
+# Measured per run, so they differ between the sequential and the concurrent run
+TIMING_FIELDS = {"elapsed_time", "stage_times", "queue_wait", "tokens_per_second"}
+
+
+def make_prompt(text: str) -> str:
+    return f"Extract the AIF graph of: {text}"
+
+
+def query(prompt: str):
+    text = prompt.split(": ", 1)[1]
+    graph = {"nodes": [{"nodeID": "1", "text": text, "type": "I"}], "edges": []}
+    return {"message": json.dumps(graph), "metadata": {"input_tokens": len(prompt), "output_tokens": len(text), "model": "stub"}}
+
+
+def write_inputs(input_path):
+    input_path.mkdir()
+    for i in range(FILES):
+        (input_path / f"discussion{i}.txt").write_text(f"participant1: argument {i}", encoding="utf-8")
+    (input_path / "empty.txt").write_text("", encoding="utf-8")
+
+
+def read_outputs(output_path):
+    outputs = {}
+    for path in sorted(output_path.glob("*.json")):
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if path.name == MANIFEST_FILE:
+            data = {name: {k: v for k, v in entry.items() if k != "updated"} for name, entry in data["files"].items()}
+        elif isinstance(data, dict):
+            data = {k: v for k, v in data.items() if k not in TIMING_FIELDS}
+        if path.name != "run_summary.json":
+            outputs[path.name] = data
+    return outputs
+
+
+def test_async_path_matches_sequential_path_within_the_concurrency_limit(tmp_path):
+    write_inputs(tmp_path / "in")
+    in_flight = 0
+    max_in_flight = 0
+
+    async def async_query(prompt: str):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return query(prompt)
+
+    def run(output_dir, **kwargs):
+        run_with_query(
+            query, make_prompt, input_dir=str(tmp_path / "in"), output_dir=str(tmp_path / output_dir),
+            use_input_dir=True, resume=False, chunk_max_tokens=0, watch=False, **kwargs
+        )
+
+    run("sequential", concurrency=1)
+    run("concurrent", async_query_fn=async_query, concurrency=CONCURRENCY)
+
+    assert max_in_flight == CONCURRENCY
+    sequential = read_outputs(tmp_path / "sequential")
+    assert len(sequential) == 2 * FILES + 1
+    assert read_outputs(tmp_path / "concurrent") == sequential